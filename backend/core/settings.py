@@ -343,9 +343,13 @@ CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_TIMEZONE = "UTC"
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 CELERY_BEAT_SCHEDULE = {
-    "compute-daily-activity-summary": {
-        "task": "wayfinder.tasks.compute_daily_activity_summary",
-        "schedule": crontab(hour=4, minute=0),
+    "drain-overland-queue": {
+        "task": "wayfinder.tasks.drain_overland_queue",
+        "schedule": crontab(minute="*"),
+    },
+    "replay-overland-spool": {
+        "task": "wayfinder.tasks.replay_overland_spool",
+        "schedule": crontab(minute="*"),
     },
 }
 
@@ -25,6 +25,8 @@ from drf_spectacular.views import (
 from health_check.views import HealthCheckView
 from redis.asyncio import Redis as RedisClient
 
+from wayfinder.views import MetricsView
+
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -51,6 +53,7 @@ urlpatterns = [
             ],
         ),
     ),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
 
 
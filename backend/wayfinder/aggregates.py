@@ -0,0 +1,297 @@
+# aggregates.py
+
+import json
+import logging
+from datetime import datetime, time as dt_time, timedelta
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+from .storage import has_timescaledb
+
+log = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Width of the activity buckets. Every UTC offset in use is a multiple of 15
+# minutes, so the buckets can be rolled up into days of any timezone.
+ACTIVITY_BUCKET = timedelta(minutes=15)
+
+# How often TimescaleDB materializes new rows into the continuous aggregates.
+# Rows after the last materialized bucket are aggregated at query time, rows
+# stored late into a bucket already materialized are counted from the next
+# refresh on.
+REFRESH_INTERVAL = timedelta(minutes=15)
+
+# Continuous aggregates of the activity history: view -> (table, aggregates)
+ACTIVITY_AGGREGATES = {
+    "wayfinder_location_activity": ("wayfinder_location", "count(*) AS location_count"),
+    "wayfinder_visit_activity": ("wayfinder_visit", "count(*) AS visit_count"),
+}
+
+# Downsampled trip tiers, finest first: (view, bucket width). Each tier keeps
+# the first moving location of every bucket and is aggregated from the
+# previous one, so a refresh only reads the tier below it.
+TRIP_TIER_VIEWS = [
+    ("wayfinder_trip_points_10s", timedelta(seconds=10)),
+    ("wayfinder_trip_points_1m", timedelta(minutes=1)),
+    ("wayfinder_trip_points_15m", timedelta(minutes=15)),
+    ("wayfinder_trip_points_1h", timedelta(hours=1)),
+]
+
+# Locations that belong to a trip, as TripsView filters them
+TRIP_LOCATIONS_FILTER = (
+    "NOT (motion @> '\"stationary\"'::jsonb) AND motion <> '[]'::jsonb"
+)
+
+
+def create_continuous_aggregate(
+    connection,
+    view,
+    table,
+    aggregates,
+    bucket,
+    refresh_interval=REFRESH_INTERVAL,
+    time_column="time",
+    where=None,
+):
+    """
+    Create ``view``: the ``aggregates`` (an SQL select list) of the rows of
+    ``table`` matching ``where``, grouped by ``bucket`` of ``time_column``,
+    in a ``bucket`` column.  ``table`` can be another continuous aggregate.
+
+    With TimescaleDB it is a continuous aggregate with real-time aggregation
+    and a refresh policy: each refresh only recomputes the buckets that
+    changed since the last one (including rows inserted into old chunks),
+    and queries add the rows that arrived since.  Without TimescaleDB it is
+    a plain view with the same columns, aggregated at query time.
+
+    Must not run in a transaction.
+    """
+    quote_name = connection.ops.quote_name
+    source = f"{quote_name(table)} WHERE {where}" if where else quote_name(table)
+
+    with connection.cursor() as cursor:
+        if not has_timescaledb(connection):
+            cursor.execute(
+                f"CREATE OR REPLACE VIEW {quote_name(view)} AS "
+                f"SELECT date_bin(%s::interval, {quote_name(time_column)}, "
+                f"TIMESTAMPTZ '2000-01-03') AS bucket, {aggregates} "
+                f"FROM {source} GROUP BY 1",
+                [bucket],
+            )
+            return
+
+        cursor.execute(
+            f"CREATE MATERIALIZED VIEW IF NOT EXISTS {quote_name(view)} "
+            f"WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS "
+            f"SELECT time_bucket(%s::interval, {quote_name(time_column)}) AS bucket, "
+            f"{aggregates} FROM {source} GROUP BY 1 WITH NO DATA",
+            [bucket],
+        )
+        # The first run materializes the whole history, later runs only the
+        # buckets that were invalidated by new rows
+        cursor.execute(
+            "SELECT add_continuous_aggregate_policy(%s, start_offset => NULL, "
+            "end_offset => %s::interval, schedule_interval => %s, "
+            "if_not_exists => true)",
+            [view, bucket, refresh_interval],
+        )
+
+    log.info(f"Created continuous aggregate {view} of {table} by {bucket}")
+
+
+def drop_continuous_aggregate(connection, view):
+    """Drop a view created by ``create_continuous_aggregate``."""
+    quote_name = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        if has_timescaledb(connection):
+            cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {quote_name(view)}")
+        else:
+            cursor.execute(f"DROP VIEW IF EXISTS {quote_name(view)}")
+
+
+def _first(connection, column, order_by):
+    """SQL aggregate of the first ``column`` value by ``order_by``."""
+    if has_timescaledb(connection):
+        return f"first({column}, {order_by})"
+    return f"(array_agg({column} ORDER BY {order_by}))[1]"
+
+
+def create_trip_tiers(connection):
+    """
+    Create the downsampled trip tiers of ``TRIP_TIER_VIEWS``: each row is the
+    first moving location (``time``, ``longitude``, ``latitude``) of a
+    bucket and the number of moving locations it stands for (``points``).
+    """
+    first_longitude = _first(connection, "longitude", "time")
+    first_latitude = _first(connection, "latitude", "time")
+
+    source = None
+    for view, width in TRIP_TIER_VIEWS:
+        if source is None:
+            create_continuous_aggregate(
+                connection,
+                view,
+                "wayfinder_location",
+                f"min(time) AS time, {first_longitude} AS longitude, "
+                f"{first_latitude} AS latitude, count(*) AS points",
+                width,
+                where=TRIP_LOCATIONS_FILTER,
+            )
+        else:
+            create_continuous_aggregate(
+                connection,
+                view,
+                source,
+                f"min(time) AS time, {first_longitude} AS longitude, "
+                f"{first_latitude} AS latitude, sum(points)::bigint AS points",
+                width,
+                time_column="bucket",
+            )
+        source = view
+
+
+def drop_trip_tiers(connection):
+    """Drop the views created by ``create_trip_tiers``, coarsest first."""
+    for view, _ in reversed(TRIP_TIER_VIEWS):
+        drop_continuous_aggregate(connection, view)
+
+
+def floor_to_bucket(value, width):
+    """Return the start of the ``width`` bucket containing ``value``."""
+    # Buckets of a width that divides a day start at multiples of the width
+    # since the epoch, as with time_bucket and date_bin above
+    seconds = value.timestamp()
+    return value - timedelta(seconds=seconds % width.total_seconds())
+
+
+def first_whole_bucket(start, width):
+    """Return the start of the first ``width`` bucket not before ``start``."""
+    bucket = floor_to_bucket(start, width)
+    return bucket if bucket == start else bucket + width
+
+
+def tier_points_in_range(tier, start, end):
+    """
+    Return the rows of ``tier`` that stand for the moving locations between
+    ``start`` and ``end`` (inclusive): the buckets starting in the range
+    whose first location is not after ``end``.
+
+    The bucket ``start`` falls inside of is left out, since its first
+    location can be before ``start``.  Its moving locations within the range
+    are the ``start_edge_locations``.
+    """
+    return tier.objects.filter(
+        bucket__gte=first_whole_bucket(start, tier.bucket_width),
+        bucket__lte=end,
+        time__lte=end,
+    )
+
+
+def start_edge_locations(queryset, start, end, width):
+    """
+    Return the locations of ``queryset`` between ``start`` and ``end`` in
+    the ``width`` bucket ``start`` falls inside of (none if ``start`` is the
+    start of a bucket).  A trip tier stands for them with their first one.
+    """
+    return queryset.filter(
+        time__gte=start, time__lt=first_whole_bucket(start, width), time__lte=end
+    )
+
+
+def count_in_range(queryset, start, end, counts, width):
+    """
+    Return the exact number of rows of ``queryset`` with a ``time`` between
+    ``start`` and ``end`` (inclusive), for each of ``counts``:
+    ``{name: (condition, model, field)}``, where ``condition`` is a ``Q``
+    of the counted rows (None for all) and ``model`` has their counts per
+    ``width`` bucket in ``field``.
+
+    The whole buckets of the range are added up from the bucket models, and
+    ``queryset`` is only read for the partial buckets at the edges of the
+    range, in a single pass with one ``FILTER`` clause per count.
+    """
+    first_bucket = first_whole_bucket(start, width)
+    last_bucket = floor_to_bucket(end, width)
+
+    aggregates = {
+        name: Count("time", filter=condition)
+        for name, (condition, model, field) in counts.items()
+    }
+
+    if first_bucket >= last_bucket:
+        return queryset.filter(time__gte=start, time__lte=end).aggregate(**aggregates)
+
+    result = queryset.filter(
+        Q(time__gte=start, time__lt=first_bucket)
+        | Q(time__gte=last_bucket, time__lte=end)
+    ).aggregate(**aggregates)
+
+    for name, (condition, model, field) in counts.items():
+        buckets = model.objects.filter(
+            bucket__gte=first_bucket, bucket__lt=last_bucket
+        ).aggregate(count=Sum(field))["count"]
+        result[name] += buckets or 0
+
+    return result
+
+
+def estimate_count(queryset):
+    """
+    Return the number of rows of ``queryset`` estimated by the query
+    planner.  The estimate comes from the statistics of the chunks the
+    query would read, so it costs the same for any range, but it can be
+    off by a few percent (or more when the statistics are stale).
+    """
+    plan = json.loads(queryset.explain(format="json"))
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def select_trip_tier(tiers, queryset, start, end, max_points):
+    """
+    Pick the most detailed source of trip points that fits ``max_points``
+    points between ``start`` and ``end``: ``None`` when the raw moving
+    locations of ``queryset`` fit, otherwise the finest of ``tiers``
+    (tier models, finest first) that does, or the coarsest one.
+
+    Each candidate is counted up to ``max_points + 1`` rows, so the choice
+    costs about the same for a day as for a year.  A tier's points include
+    the first of its ``start_edge_locations``, as TripsView reads them.
+    """
+
+    def fits(candidate, extra=0):
+        return candidate[: max_points + 1].count() + extra <= max_points
+
+    if fits(queryset.filter(time__gte=start, time__lte=end)):
+        return None
+
+    for tier in tiers:
+        edge = start_edge_locations(queryset, start, end, tier.bucket_width)
+        if fits(tier_points_in_range(tier, start, end), int(edge.exists())):
+            return tier
+
+    return tiers[-1]
+
+
+def get_daily_counts(model, field, start_date, end_date, tz):
+    """
+    Return ``{date: count}`` for the dates between ``start_date`` and
+    ``end_date`` (inclusive) in timezone ``tz``, by adding up ``field`` of
+    the activity buckets of each day.
+    """
+    start = datetime.combine(start_date, dt_time.min, tzinfo=tz)
+    end = datetime.combine(end_date + timedelta(days=1), dt_time.min, tzinfo=tz)
+
+    counts = (
+        model.objects.filter(bucket__gte=start, bucket__lt=end)
+        .annotate(date=TruncDate("bucket", tzinfo=tz))
+        .values("date")
+        .annotate(count=Sum(field))
+    )
+
+    return {item["date"]: item["count"] for item in counts}
@@ -0,0 +1,267 @@
+# cache.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from bisect import bisect_left
+from datetime import datetime, timezone as dt_timezone
+
+import redis
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .columns import epoch_time
+from .ingestion_queue import get_redis
+from .metrics import RESPONSE_CACHE_INVALIDATIONS, RESPONSE_CACHE_REQUESTS
+from .renderers import GeoJSONRenderer, TripsRenderer
+
+log = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Keep the trips and visits responses of past ranges in Redis, until rows are
+# stored in their range or RESPONSE_CACHE_TTL seconds have passed
+CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "False") == "True"
+CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+
+# Larger responses are not kept
+CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_MB", "8")) * 1024 * 1024
+
+ENTRY_KEY = "wayfinder:cache:{}:{}"
+
+# Every cached entry is listed in the index of each UTC month its range
+# overlaps, as "start:end:key" with the bounds in epoch microseconds
+INDEX_KEY = "wayfinder:cache:index:{}"
+
+# Incremented on every invalidation: a response is only stored if no rows
+# were stored while it was being computed
+GENERATION_KEY = "wayfinder:cache:generation"
+
+# Response headers kept with the body
+CACHED_HEADERS = ("Content-Type", "Content-Disposition")
+
+# Times (epoch microseconds) of stored rows whose invalidation failed. They
+# are invalidated again before this process uses the cache, and responses
+# are neither read from nor stored in it until then.
+_pending_times = set()
+_pending_lock = threading.Lock()
+
+
+def _month(value):
+    """The UTC month of ``value`` (epoch microseconds), e.g. ``2025-01``."""
+    return datetime.fromtimestamp(value / 1e6, tz=dt_timezone.utc).strftime("%Y-%m")
+
+
+def _months(start, end):
+    """Every UTC month from ``start`` to ``end`` (epoch microseconds)."""
+    first = datetime.fromtimestamp(start / 1e6, tz=dt_timezone.utc)
+    last = datetime.fromtimestamp(end / 1e6, tz=dt_timezone.utc)
+    months = []
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class CachedRange:
+    """
+    The cache entry of a trips or visits request for the range from
+    ``start`` to ``end`` (aware datetimes, inclusive), keyed by the view,
+    the query parameters in order and the negotiated media type.
+
+    ``response`` is the cached response, or None on a miss: the view then
+    computes it and passes it through ``store``.  Requests that can't be
+    cached (cache disabled, range not over yet, browsable API, Redis
+    unavailable) are counted as bypasses and never stored.
+    """
+
+    def __init__(self, request, view, start, end):
+        self.view = view
+        self.start = epoch_time(start)
+        self.end = epoch_time(end)
+        self.response = None
+        self.generation = None
+
+        query = sorted(request.query_params.items())
+        payload = json.dumps([query, request.accepted_media_type])
+        digest = hashlib.sha256(payload.encode()).hexdigest()[:32]
+        self.key = ENTRY_KEY.format(view, digest)
+
+        # Ranges that are still going on change with every Overland batch
+        renderer = getattr(request, "accepted_renderer", None)
+        if (
+            not CACHE_ENABLED
+            or end >= timezone.now()
+            or not isinstance(renderer, (GeoJSONRenderer, TripsRenderer))
+        ):
+            RESPONSE_CACHE_REQUESTS.inc(view=view, result="bypass")
+            return
+
+        # Entries may still have rows stored in their range
+        if not retry_invalidations():
+            RESPONSE_CACHE_REQUESTS.inc(view=view, result="bypass")
+            return
+
+        try:
+            with get_redis().pipeline(transaction=False) as pipe:
+                pipe.get(GENERATION_KEY)
+                pipe.hgetall(self.key)
+                generation, entry = pipe.execute()
+        except redis.RedisError as e:
+            log.warning(f"Could not read the response cache: {e}")
+            RESPONSE_CACHE_REQUESTS.inc(view=view, result="bypass")
+            return
+
+        self.generation = int(generation or 0)
+        if not entry:
+            RESPONSE_CACHE_REQUESTS.inc(view=view, result="miss")
+            return
+
+        RESPONSE_CACHE_REQUESTS.inc(view=view, result="hit")
+        headers = json.loads(entry[b"headers"])
+        self.response = HttpResponse(entry[b"body"], headers=headers)
+
+    def store(self, response, max_age=CACHE_TTL):
+        """
+        Return ``response``, keeping its body in the cache for ``max_age``
+        seconds once it has been streamed in full, if it is a successful
+        response of a cacheable request and at most ``CACHE_MAX_BYTES``.
+        """
+        if (
+            self.generation is None
+            or response.status_code != 200
+            or not getattr(response, "streaming", False)
+        ):
+            return response
+
+        response.streaming_content = self._tee(
+            response.streaming_content,
+            {name: response[name] for name in CACHED_HEADERS if name in response},
+            min(max_age, CACHE_TTL),
+        )
+        return response
+
+    def _tee(self, chunks, headers, max_age):
+        """Yield ``chunks`` and store them once all were sent."""
+        body = []
+        size = 0
+        for chunk in chunks:
+            if body is not None:
+                size += len(chunk)
+                if size <= CACHE_MAX_BYTES:
+                    body.append(chunk)
+                else:
+                    log.debug(f"Not caching {self.key}, over {CACHE_MAX_BYTES} bytes")
+                    body = None
+            yield chunk
+
+        if body is not None:
+            self._write(b"".join(body), headers, max_age)
+
+    def _write(self, body, headers, max_age):
+        if _pending_times:
+            log.debug(f"Not caching {self.key}, an invalidation is pending")
+            return
+
+        member = f"{self.start}:{self.end}:{self.key}"
+        try:
+            with get_redis().pipeline() as pipe:
+                # Rows stored since the response was computed may be missing
+                # from it, and their invalidation may have run already
+                pipe.watch(GENERATION_KEY)
+                if int(pipe.get(GENERATION_KEY) or 0) != self.generation:
+                    log.debug(f"Not caching {self.key}, rows were stored meanwhile")
+                    return
+                pipe.multi()
+                pipe.hset(
+                    self.key, mapping={"body": body, "headers": json.dumps(headers)}
+                )
+                pipe.expire(self.key, max_age)
+                for month in _months(self.start, self.end):
+                    pipe.sadd(INDEX_KEY.format(month), member)
+                    # Entries never outlive CACHE_TTL, neither does the index
+                    pipe.expire(INDEX_KEY.format(month), CACHE_TTL)
+                pipe.execute()
+        except redis.WatchError:
+            log.debug(f"Not caching {self.key}, rows were stored meanwhile")
+        except redis.RedisError as e:
+            log.warning(f"Could not store a response in the cache: {e}")
+
+
+def invalidate_times(times):
+    """
+    Delete the cached responses whose range includes any of ``times``
+    (aware datetimes of stored rows).  Responses of ranges around them,
+    without any of the times, are kept.
+
+    When Redis fails, the times are kept and invalidated again with the next
+    call (see ``retry_invalidations``).
+    """
+    if not CACHE_ENABLED:
+        return 0
+
+    with _pending_lock:
+        pending = _pending_times | {epoch_time(time) for time in times}
+        _pending_times.clear()
+    if not pending:
+        return 0
+
+    times = sorted(pending)
+    months = sorted({_month(time) for time in times})
+
+    try:
+        client = get_redis()
+        client.incr(GENERATION_KEY)
+
+        with client.pipeline(transaction=False) as pipe:
+            for month in months:
+                pipe.smembers(INDEX_KEY.format(month))
+            indexes = pipe.execute()
+
+        # Delete the entries with a stored time in their range, and drop them
+        # from every index they are listed in
+        keys = set()
+        members = set()
+        for members_of_month in indexes:
+            for member in members_of_month:
+                start, end, key = member.decode().split(":", 2)
+                i = bisect_left(times, int(start))
+                if i < len(times) and times[i] <= int(end):
+                    keys.add(key)
+                    members.add(member)
+
+        if not keys:
+            return 0
+
+        with client.pipeline(transaction=False) as pipe:
+            pipe.delete(*keys)
+            for member in members:
+                start, end, _ = member.decode().split(":", 2)
+                for month in _months(int(start), int(end)):
+                    pipe.srem(INDEX_KEY.format(month), member)
+            pipe.execute()
+    except redis.RedisError as e:
+        log.warning(f"Could not invalidate the response cache, will retry: {e}")
+        with _pending_lock:
+            _pending_times.update(pending)
+        return 0
+
+    log.debug(f"Invalidated {len(keys)} cached responses")
+    RESPONSE_CACHE_INVALIDATIONS.inc(len(keys))
+    return len(keys)
+
+
+def retry_invalidations():
+    """
+    Invalidate again the times whose invalidation failed in this process.
+    Returns whether none is left.
+    """
+    if _pending_times:
+        invalidate_times([])
+    return not _pending_times
@@ -0,0 +1,155 @@
+# columns.py
+
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, CharField, Func
+
+# Rows read from the database cursor at a time
+FETCH_CHUNK_SIZE = 2000
+
+
+class IsoTime(Func):
+    """
+    A timestamp as the text ``datetime.isoformat()`` gives for it in UTC,
+    e.g. ``2025-01-01T08:30:00+00:00`` or ``2025-01-01T08:30:00.250000+00:00``,
+    formatted by the database instead of per row in Python.
+
+    Texts in this format sort like the times they stand for ("+" sorts
+    before "."), so they can be compared and searched directly.
+    """
+
+    template = (
+        "to_char(%(expressions)s AT TIME ZONE 'UTC', "
+        "CASE WHEN date_trunc('second', %(expressions)s) = %(expressions)s "
+        'THEN \'YYYY-MM-DD"T"HH24:MI:SS"+00:00"\' '
+        'ELSE \'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"\' END)'
+    )
+    output_field = CharField()
+
+
+class EpochTime(Func):
+    """
+    A timestamp as whole microseconds since the Unix epoch, which is exact
+    (unlike seconds in a float) and sorts like the time.
+    """
+
+    template = "(EXTRACT(EPOCH FROM %(expressions)s) * 1000000)::bigint"
+    output_field = BigIntegerField()
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def iso_time(value):
+    """``value`` (an aware datetime) as formatted by ``IsoTime``."""
+    return value.astimezone(dt_timezone.utc).isoformat()
+
+
+def epoch_time(value):
+    """``value`` (an aware datetime) as given by ``EpochTime``."""
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+class LocationColumns:
+    """
+    Times, longitudes and latitudes of locations sorted by time, one column
+    each.  Times are ``IsoTime`` texts, or ``EpochTime`` microseconds if
+    ``epoch`` is True (for the binary formats, which don't need the texts).
+    Parts of it, like trips, are referred to by ``start:end`` positions
+    instead of being copied.
+    """
+
+    __slots__ = ("times", "longitudes", "latitudes", "epoch")
+
+    def __init__(self, times=(), longitudes=(), latitudes=(), epoch=False):
+        self.epoch = epoch
+        self.times = array("q", times) if epoch else list(times)
+        self.longitudes = array("d", longitudes)
+        self.latitudes = array("d", latitudes)
+
+    def __len__(self):
+        return len(self.times)
+
+    def time_key(self, value):
+        """``value`` (an aware datetime) comparable with ``times``."""
+        return epoch_time(value) if self.epoch else iso_time(value)
+
+    def datetime_at(self, index):
+        """The time at position ``index``, as an aware datetime."""
+        if self.epoch:
+            return EPOCH + timedelta(microseconds=self.times[index])
+        return datetime.fromisoformat(self.times[index])
+
+    def truncate(self, end):
+        """Drop the locations from position ``end`` on."""
+        del self.times[end:]
+        del self.longitudes[end:]
+        del self.latitudes[end:]
+
+    def drop_before(self, start):
+        """Drop the locations before position ``start``."""
+        del self.times[:start]
+        del self.longitudes[:start]
+        del self.latitudes[:start]
+
+    def copy(self, start=0, end=None):
+        """A copy of the locations at positions ``start`` to ``end`` (excluded)."""
+        return LocationColumns(
+            self.times[start:end],
+            self.longitudes[start:end],
+            self.latitudes[start:end],
+            epoch=self.epoch,
+        )
+
+    def extend(self, other):
+        """Append the locations of ``other``, which must come after them."""
+        self.times.extend(other.times)
+        self.longitudes.extend(other.longitudes)
+        self.latitudes.extend(other.latitudes)
+
+
+def _location_values(queryset, time_field, epoch):
+    """``queryset`` as ``(longitude, latitude, time)`` rows for the columns."""
+    return queryset.annotate(
+        location_time=(EpochTime if epoch else IsoTime)(time_field)
+    ).values_list("longitude", "latitude", "location_time")
+
+
+def fetch_location_columns(queryset, time_field="time", epoch=False):
+    """
+    Return the ``LocationColumns`` of ``queryset`` (which must have a
+    ``time_field``, ``longitude`` and ``latitude``), in its order and
+    slicing, with epoch times if ``epoch`` is True.
+
+    The rows are read from the database cursor in chunks and transposed into
+    the columns, without model instances, dicts or datetimes per row.
+    """
+    sql, params = _location_values(queryset, time_field, epoch).query.sql_with_params()
+
+    columns = LocationColumns(epoch=epoch)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while rows := cursor.fetchmany(FETCH_CHUNK_SIZE):
+            longitudes, latitudes, times = zip(*rows)
+            columns.times.extend(times)
+            columns.longitudes.extend(longitudes)
+            columns.latitudes.extend(latitudes)
+
+    return columns
+
+
+def iter_location_rows(queryset, time_field="time", epoch=False):
+    """
+    Yield the ``(longitude, latitude, time)`` of every row of ``queryset``
+    as ``fetch_location_columns`` reads them, from a server-side cursor
+    ``FETCH_CHUNK_SIZE`` rows at a time, so that a whole range can be read
+    with constant memory.
+    """
+    # In a transaction, else the cursor is declared WITH HOLD and PostgreSQL
+    # reads the whole result before the first row
+    with transaction.atomic():
+        yield from _location_values(queryset, time_field, epoch).iterator(
+            chunk_size=FETCH_CHUNK_SIZE
+        )
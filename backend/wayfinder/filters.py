@@ -1,10 +1,11 @@
 # filters.py
 
 # Django
+from django.db.models import F
 from django_filters import rest_framework as filters
 
 # Local App
-from .models import Location, Visit
+from .models import MOTION_BITS, Location, Visit
 
 
 class LocationFilterSet(filters.FilterSet):
@@ -14,7 +15,7 @@ class LocationFilterSet(filters.FilterSet):
     end_datetime = filters.IsoDateTimeFilter(
         field_name="time", lookup_expr="lte", required=True
     )
-    motion_contains = filters.CharFilter(field_name="motion", lookup_expr="contains")
+    motion_contains = filters.CharFilter(method="filter_motion_contains")
     h_accuracy_lte = filters.NumberFilter(
         field_name="horizontal_accuracy", lookup_expr="lte"
     )
@@ -30,6 +31,15 @@ class LocationFilterSet(filters.FilterSet):
             "speed_gte",
         ]
 
+    def filter_motion_contains(self, queryset, name, value):
+        """Locations whose motions include ``value``, from the motion bitmask"""
+        bit = MOTION_BITS.get(value)
+        if bit is None:
+            return queryset.none()
+        return queryset.alias(motion_bit=F("motion_mask").bitand(bit)).filter(
+            motion_bit=bit
+        )
+
 
 class VisitFilterSet(filters.FilterSet):
     start_datetime = filters.IsoDateTimeFilter(
@@ -0,0 +1,338 @@
+# formats.py
+
+import math
+import operator
+import struct
+import sys
+from array import array
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# ---------------------------------------------------------------------------- #
+#                               ENCODED POLYLINES                              #
+# ---------------------------------------------------------------------------- #
+
+# Decimal places of the coordinates, 5 (about a meter) like Google's format
+POLYLINE_PRECISION = 5
+
+
+def _encode_values(values):
+    """
+    ``values`` (integers) as the encoded polyline algorithm writes them:
+    zigzag signed, 5 bits per character, offset by 63 into printable ASCII.
+    """
+    out = bytearray()
+    append = out.append
+    for value in values:
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            append((0x20 | (value & 0x1F)) + 63)
+            value >>= 5
+        append(value + 63)
+    return out.decode("ascii")
+
+
+def _deltas(values):
+    """Each of ``values`` minus the previous one, the first one as is."""
+    return list(map(operator.sub, values, [0, *values[:-1]]))
+
+
+def encode_polyline(latitudes, longitudes, precision=POLYLINE_PRECISION):
+    """``latitudes`` and ``longitudes`` as a Google encoded polyline."""
+    factor = 10**precision
+    # Rounded half up, like Math.round in the reference implementation
+    latitudes = [math.floor(latitude * factor + 0.5) for latitude in latitudes]
+    longitudes = [math.floor(longitude * factor + 0.5) for longitude in longitudes]
+
+    # Latitude and longitude deltas interleaved, each against its previous one
+    values = [0] * (2 * len(latitudes))
+    values[0::2] = _deltas(latitudes)
+    values[1::2] = _deltas(longitudes)
+    return _encode_values(values)
+
+
+def encode_times(times):
+    """Sorted integer ``times`` delta encoded in the polyline encoding."""
+    return _encode_values(_deltas(list(times)))
+
+
+def polyline_trips(locations, segments):
+    """
+    The ``segments`` of trips of ``locations`` (``LocationColumns`` with
+    epoch times) as encoded polylines: the coordinates with
+    ``POLYLINE_PRECISION`` decimals and the times in epoch milliseconds.
+    """
+    features = []
+    for trip_id, start, end in segments:
+        features.append(
+            {
+                "trip_id": trip_id,
+                "polyline": encode_polyline(
+                    locations.latitudes[start:end], locations.longitudes[start:end]
+                ),
+                "times": encode_times(
+                    time // 1000 for time in locations.times[start:end]
+                ),
+            }
+        )
+
+    return {
+        "type": "EncodedPolylines",
+        "precision": POLYLINE_PRECISION,
+        "time_unit": "ms",
+        "features": features,
+    }
+
+
+# ---------------------------------------------------------------------------- #
+#                                  FLATGEOBUF                                  #
+# ---------------------------------------------------------------------------- #
+
+# Magic bytes of FlatGeobuf files, version 3
+FLATGEOBUF_MAGIC = b"fgb\x03fgb\x01"
+
+# FlatGeobuf enums
+GEOMETRY_TYPE_LINESTRING = 2
+COLUMN_TYPE_STRING = 11
+
+# FlatBuffers field kinds written by _write_table, with their struct format
+# and size. Tables are lists of fields by field id: (kind, value) or None.
+SCALAR_KINDS = {
+    "bool": ("<?", 1),
+    "ubyte": ("<B", 1),
+    "ushort": ("<H", 2),
+    "int": ("<i", 4),
+    "ulong": ("<Q", 8),
+}
+
+
+def _little_endian(values):
+    """The bytes of ``values`` (an array) in little-endian order."""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _align(buffer, alignment, offset=0):
+    """Pad ``buffer`` until ``offset`` bytes after its end are aligned."""
+    buffer += bytes(-(len(buffer) + offset) % alignment)
+
+
+def _write_child(buffer, kind, value):
+    """Write an object referred to by offset, return its position."""
+    if kind == "table":
+        return _write_table(buffer, value)
+
+    if kind == "string":
+        data = value.encode()
+        _align(buffer, 4)
+        position = len(buffer)
+        buffer += struct.pack("<I", len(data)) + data + b"\0"
+        return position
+
+    if kind == "tables":
+        _align(buffer, 4)
+        position = len(buffer)
+        buffer += struct.pack("<I", len(value)) + bytes(4 * len(value))
+        for i, table in enumerate(value):
+            slot = position + 4 + 4 * i
+            struct.pack_into("<I", buffer, slot, _write_table(buffer, table) - slot)
+        return position
+
+    # A vector of scalars, an array: its items are aligned to their size
+    _align(buffer, max(value.itemsize, 4), 4)
+    position = len(buffer)
+    buffer += struct.pack("<I", len(value)) + _little_endian(value)
+    return position
+
+
+def _write_table(buffer, fields):
+    """
+    Write the FlatBuffers table of ``fields`` at the end of ``buffer``,
+    then the objects it refers to, and return the table position.
+
+    Everything is written front to back: the vtable, the table (scalars
+    largest first, then offsets) and its children, so offsets always point
+    forward.
+    """
+    inline = []
+    for field_id, field in enumerate(fields):
+        if field is not None:
+            kind, value = field
+            size = SCALAR_KINDS[kind][1] if kind in SCALAR_KINDS else 4
+            inline.append((size, field_id, kind, value))
+    inline.sort(key=lambda item: -item[0])
+
+    # Layout of the table after its vtable offset
+    vtable = [0] * len(fields)
+    size = 4
+    for field_size, field_id, _, _ in inline:
+        size += -size % field_size
+        vtable[field_id] = size
+        size += field_size
+
+    _align(buffer, 2)
+    vtable_position = len(buffer)
+    buffer += struct.pack(f"<HH{len(fields)}H", 4 + 2 * len(fields), size, *vtable)
+    _align(buffer, 8)
+    position = len(buffer)
+    buffer += bytes(size)
+    struct.pack_into("<i", buffer, position, position - vtable_position)
+
+    children = []
+    for field_size, field_id, kind, value in inline:
+        if kind in SCALAR_KINDS:
+            struct.pack_into(
+                SCALAR_KINDS[kind][0], buffer, position + vtable[field_id], value
+            )
+        else:
+            children.append((position + vtable[field_id], kind, value))
+
+    for slot, kind, value in children:
+        struct.pack_into("<I", buffer, slot, _write_child(buffer, kind, value) - slot)
+
+    return position
+
+
+def _size_prefixed(fields):
+    """A size prefixed FlatBuffer with the root table of ``fields``."""
+    buffer = bytearray(8)
+    struct.pack_into("<I", buffer, 4, _write_table(buffer, fields) - 4)
+    struct.pack_into("<I", buffer, 0, len(buffer) - 4)
+    return bytes(buffer)
+
+
+def _envelope(locations, segments):
+    """The bounding box of the ``segments`` of ``locations``, or None."""
+    if not segments:
+        return None
+
+    # Segments can overlap and be out of order, see segment_trips_by_midtimes
+    boxes = [
+        (
+            min(locations.longitudes[start:end]),
+            min(locations.latitudes[start:end]),
+            max(locations.longitudes[start:end]),
+            max(locations.latitudes[start:end]),
+        )
+        for _, start, end in segments
+    ]
+    return array(
+        "d",
+        [
+            min(box[0] for box in boxes),
+            min(box[1] for box in boxes),
+            max(box[2] for box in boxes),
+            max(box[3] for box in boxes),
+        ],
+    )
+
+
+def flatgeobuf_trips(locations, segments, metadata=None):
+    """
+    Yield a FlatGeobuf file of the ``segments`` of trips of ``locations``
+    (``LocationColumns`` with epoch times) in pieces: the header, then one
+    LineString feature per trip with a ``trip_id`` property and the times
+    as M values in epoch seconds.  ``metadata`` (a string) is kept in the
+    header.  There is no spatial index, the features are in time order.
+    """
+    envelope = _envelope(locations, segments)
+
+    header = [
+        ("string", "trips"),
+        ("vector", envelope) if envelope else None,
+        ("ubyte", GEOMETRY_TYPE_LINESTRING),
+        None,
+        ("bool", True),  # has_m
+        None,
+        None,
+        ("tables", [[("string", "trip_id"), ("ubyte", COLUMN_TYPE_STRING)]]),
+        ("ulong", len(segments)),
+        ("ushort", 0),  # index_node_size, no spatial index
+        ("table", [("string", "EPSG"), ("int", 4326)]),
+        ("string", "Wayfinder trips"),
+        None,
+        ("string", metadata) if metadata is not None else None,
+    ]
+    yield FLATGEOBUF_MAGIC + _size_prefixed(header)
+
+    for trip_id, start, end in segments:
+        xy = array("d", [0.0]) * (2 * (end - start))
+        xy[0::2] = locations.longitudes[start:end]
+        xy[1::2] = locations.latitudes[start:end]
+        m = array("d", [time / 1e6 for time in locations.times[start:end]])
+        name = trip_id.encode()
+
+        feature = [
+            ("table", [None, ("vector", xy), None, ("vector", m)]),
+            ("vector", array("B", struct.pack("<HI", 0, len(name)) + name)),
+        ]
+        yield _size_prefixed(feature)
+
+
+# ---------------------------------------------------------------------------- #
+#                                  APACHE ARROW                                #
+# ---------------------------------------------------------------------------- #
+
+
+def _arrow_array(arrow_type, values):
+    """An Arrow array of ``values`` (an array) without copying them again."""
+    return pyarrow.Array.from_buffers(
+        arrow_type, len(values), [None, pyarrow.py_buffer(values)]
+    )
+
+
+def arrow_trips(locations, segments, metadata=None):
+    """
+    The ``segments`` of trips of ``locations`` (``LocationColumns`` with
+    epoch times) as an Arrow IPC stream, one row per location: ``trip``
+    (dictionary encoded), ``time`` (UTC microseconds), ``longitude`` and
+    ``latitude``.  ``metadata`` (a string) is kept in the schema metadata
+    under ``wayfinder``.  Requires pyarrow.
+    """
+    if pyarrow is None:
+        raise RuntimeError("pyarrow is required for the Arrow format")
+
+    # Segments can overlap and be out of order (see
+    # segment_trips_by_midtimes), so the rows of each one are copied in turn
+    indices = array("i")
+    times = array("q")
+    longitudes = array("d")
+    latitudes = array("d")
+    for i, (_, start, end) in enumerate(segments):
+        indices.extend(array("i", [i]) * (end - start))
+        times.extend(locations.times[start:end])
+        longitudes.extend(locations.longitudes[start:end])
+        latitudes.extend(locations.latitudes[start:end])
+
+    schema = pyarrow.schema(
+        [
+            ("trip", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+            ("time", pyarrow.timestamp("us", tz="UTC")),
+            ("longitude", pyarrow.float64()),
+            ("latitude", pyarrow.float64()),
+        ],
+        metadata={"wayfinder": metadata} if metadata is not None else None,
+    )
+    table = pyarrow.Table.from_arrays(
+        [
+            pyarrow.DictionaryArray.from_arrays(
+                _arrow_array(pyarrow.int32(), indices),
+                pyarrow.array([segment[0] for segment in segments], pyarrow.string()),
+            ),
+            _arrow_array(schema.field("time").type, times),
+            _arrow_array(pyarrow.float64(), longitudes),
+            _arrow_array(pyarrow.float64(), latitudes),
+        ],
+        schema=schema,
+    )
+
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
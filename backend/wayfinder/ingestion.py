@@ -0,0 +1,522 @@
+# ingestion.py
+
+import io
+import json
+import logging
+import os
+from datetime import datetime
+
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .metrics import (
+    POINTS_DUPLICATE,
+    POINTS_INSERTED,
+    POINTS_INVALID,
+    STAGE_SECONDS,
+    count_device_points,
+)
+from .models import Location, Visit
+from .serializers import LocationSerializer, VisitSerializer
+from .validators import validate_features, validate_features_with_serializer
+
+log = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Number of rows sent per INSERT statement
+INSERT_BATCH_SIZE = 1000
+
+# Batches with at least this many rows are loaded with COPY instead of INSERT
+COPY_THRESHOLD = int(os.getenv("OVERLAND_COPY_THRESHOLD", "1000"))
+
+# Number of rows buffered in memory per COPY round trip
+COPY_CHUNK_SIZE = 10000
+
+# Number of features validated and stored at a time from a streamed request
+STREAM_CHUNK_SIZE = int(os.getenv("OVERLAND_STREAM_CHUNK_SIZE", "500"))
+
+# Abort the database write of a batch after this many seconds (0: no limit)
+DB_WRITE_TIMEOUT = int(os.getenv("OVERLAND_DB_TIMEOUT", "0"))
+
+# "fast" uses the compiled batch validator, "drf" one serializer per feature
+VALIDATOR = os.getenv("OVERLAND_VALIDATOR", "fast")
+
+
+def get_feature_timestamp(item):
+    """
+    Parse the ``properties.timestamp`` of an Overland GeoJSON feature.
+
+    Returns an aware datetime, or None if the timestamp is missing or invalid
+    (the serializer will report the error for that item).
+    """
+    if not isinstance(item, dict):
+        return None
+
+    properties = item.get("properties")
+    if not isinstance(properties, dict):
+        return None
+
+    timestamp = properties.get("timestamp")
+    if not isinstance(timestamp, str):
+        return None
+
+    try:
+        parsed = parse_datetime(timestamp)
+    except ValueError:
+        return None
+
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+
+    return parsed
+
+
+def get_existing_times(model, items):
+    """
+    Return the set of ``time`` values of ``model`` that already exist for a
+    batch of Overland features.
+
+    A single query bounded by the batch's min/max timestamps is run, so the
+    hypertable only touches the chunks covering the batch.  The result is
+    meant to be passed to the serializers as the ``existing_times`` context.
+    """
+    timestamps = set()
+    for item in items:
+        timestamp = get_feature_timestamp(item)
+        if timestamp is not None:
+            timestamps.add(timestamp)
+
+    if not timestamps:
+        return set()
+
+    existing_times = set(
+        model.objects.filter(
+            time__range=(min(timestamps), max(timestamps)),
+            time__in=timestamps,
+        ).values_list("time", flat=True)
+    )
+
+    log.debug(
+        f"Found {len(existing_times)} existing {model.__name__} timestamps "
+        f"for a batch of {len(timestamps)}"
+    )
+
+    return existing_times
+
+
+def validate_overland_items(label, serializer_class, items, existing_times):
+    """
+    Validate Overland features of one kind (locations or visits) with the
+    validator selected by ``OVERLAND_VALIDATOR``.
+
+    Returns the validated rows, without timestamps repeated in the batch, the
+    number of skipped duplicates and the number of invalid features, which are
+    logged and dropped.
+    """
+    if VALIDATOR == "drf":
+        rows, errors = validate_features_with_serializer(
+            serializer_class, items, existing_times
+        )
+    else:
+        rows, errors = validate_features(serializer_class, items, existing_times)
+
+    skipped = 0
+    invalid = 0
+
+    for index, item_errors in errors:
+        # Check if the error is due to a duplicate
+        if "unique" in item_errors.get("time", []):
+            log.debug(
+                f"Skipping duplicate {label}: "
+                f"{items[index].get('properties', {}).get('timestamp', 'unknown time')}"
+            )
+            skipped += 1
+        else:
+            log.error(f"Skipping invalid {label} - validation failed: {item_errors}")
+            invalid += 1
+            log.info(f"{label.capitalize()} data not saved: {items[index]}")
+
+    # Use a set to keep track of unique timestamps
+    unique_timestamps = set()
+    unique_rows = []
+
+    for row in rows:
+        timestamp = row.get("time")
+        if timestamp not in unique_timestamps:
+            unique_timestamps.add(timestamp)
+            unique_rows.append(row)
+        else:
+            log.debug(f"Skipping duplicate {label} with time: {timestamp}")
+            skipped += 1
+
+    return unique_rows, skipped, invalid
+
+
+def parse_overland_features(features, check_existing=True):
+    """
+    Validate a batch of Overland GeoJSON features.
+
+    Features are split into locations and visits and validated with the
+    rules of their serializers (see ``validate_overland_items``).  Invalid
+    features and features whose timestamp is repeated in the batch or already
+    stored are skipped.
+
+    When ``check_existing`` is False the lookup of already stored timestamps
+    is skipped, and duplicates are left for the database to discard on
+    insert (see ``store_overland_batch``).
+
+    Returns a dict with the validated ``locations`` and ``visits`` rows, and
+    the number of ``skipped`` duplicates and ``invalid`` features per model.
+    """
+
+    # Split the batch into visits and locations
+    location_items = []
+    visit_items = []
+    device_counts = {}
+
+    for item in features:
+        properties = item.get("properties", {})
+        if isinstance(properties, dict):
+            device_id = properties.get("device_id", "")
+            if not isinstance(device_id, str):
+                device_id = ""
+            device_counts[device_id] = device_counts.get(device_id, 0) + 1
+
+        if "arrival_date" in properties:
+
+            # If there is no departure date, skip the visit
+            departure_date = item.get("properties", {}).get("departure_date")
+            if departure_date is None or departure_date == "":
+                log.debug("Skipping visit without valid departure date")
+                log.debug(f"Visit data: {item}")
+                continue
+
+            visit_items.append(item)
+        else:
+            location_items.append(item)
+
+    count_device_points(device_counts)
+
+    # Check uniqueness once per batch instead of one query per item
+    if check_existing:
+        with STAGE_SECONDS.time(stage="uniqueness"):
+            visit_existing_times = get_existing_times(Visit, visit_items)
+            location_existing_times = get_existing_times(Location, location_items)
+    else:
+        visit_existing_times = frozenset()
+        location_existing_times = frozenset()
+
+    with STAGE_SECONDS.time(stage="validate"):
+        visit_rows, visit_skipped, visit_invalid = validate_overland_items(
+            "visit", VisitSerializer, visit_items, visit_existing_times
+        )
+        location_rows, location_skipped, location_invalid = validate_overland_items(
+            "location", LocationSerializer, location_items, location_existing_times
+        )
+
+    POINTS_INVALID.inc(location_invalid, kind="location")
+    POINTS_INVALID.inc(visit_invalid, kind="visit")
+
+    batch = {
+        "locations": location_rows,
+        "visits": visit_rows,
+        "skipped": {"locations": location_skipped, "visits": visit_skipped},
+        "invalid": {"locations": location_invalid, "visits": visit_invalid},
+    }
+
+    log.info(f"Parsed {len(batch['locations'])} locations")
+    log.info(f"Parsed {len(batch['visits'])} visits")
+
+    return batch
+
+
+def _get_insert_fields(model):
+    """Return the concrete fields written on insert (everything but the id)."""
+    return [field for field in model._meta.concrete_fields if not field.primary_key]
+
+
+def _get_row_value(row, field):
+    """Return the value of ``field`` in a validated row, or its default."""
+    if field.name in row:
+        return row[field.name]
+    return field.get_default()
+
+
+def insert_ignore_conflicts(model, rows, batch_size=INSERT_BATCH_SIZE):
+    """
+    Insert validated rows with ``INSERT ... ON CONFLICT (time) DO NOTHING``.
+
+    Rows whose ``time`` is already stored are skipped by the database instead
+    of aborting the transaction, so re-sent batches (e.g. Overland retrying
+    after a timeout) are cheap and idempotent.
+
+    Returns the number of rows that were actually inserted.
+    """
+    if not rows:
+        return 0
+
+    fields = _get_insert_fields(model)
+
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    row_placeholder = "(" + ", ".join(["%s"] * len(fields)) + ")"
+
+    inserted = 0
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+
+            params = []
+            for row in batch:
+                params.extend(
+                    field.get_db_prep_save(_get_row_value(row, field), connection)
+                    for field in fields
+                )
+
+            values = ", ".join([row_placeholder] * len(batch))
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {values} "
+                f"ON CONFLICT ({quote_name('time')}) DO NOTHING",
+                params,
+            )
+            inserted += cursor.rowcount
+
+    log.debug(
+        f"Inserted {inserted} of {len(rows)} {model.__name__} rows "
+        f"({len(rows) - inserted} already existed)"
+    )
+
+    return inserted
+
+
+def _format_copy_value(field, value):
+    """
+    Format a value for PostgreSQL's COPY text format.
+    """
+    if value is None:
+        return "\\N"
+
+    if field.get_internal_type() == "JSONField":
+        value = json.dumps(value, cls=field.encoder)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, bool):
+        value = "t" if value else "f"
+    else:
+        value = str(value)
+
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_insert_ignore_conflicts(model, rows, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Bulk load validated rows with ``COPY`` through a staging table.
+
+    Rows are streamed in chunks into a temporary table shaped like the
+    hypertable, then merged with ``INSERT ... SELECT DISTINCT ON (time) ...
+    ON CONFLICT (time) DO NOTHING`` so duplicates within the load and rows
+    that are already stored are discarded.  ``rows`` can be any iterable,
+    which keeps memory bounded for very large imports.
+
+    Returns the number of rows that were actually inserted.
+    """
+    fields = _get_insert_fields(model)
+
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    staging_table = quote_name(f"{model._meta.db_table}_staging")
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    time_column = quote_name("time")
+
+    received = 0
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {staging_table} AS "
+            f"SELECT {columns} FROM {table} WITH NO DATA"
+        )
+
+        buffer = io.StringIO()
+        buffered = 0
+
+        def flush():
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {staging_table} ({columns}) FROM STDIN", buffer)
+            buffer.seek(0)
+            buffer.truncate()
+
+        for row in rows:
+            buffer.write(
+                "\t".join(
+                    _format_copy_value(field, _get_row_value(row, field))
+                    for field in fields
+                )
+            )
+            buffer.write("\n")
+            received += 1
+            buffered += 1
+
+            if buffered >= chunk_size:
+                flush()
+                buffered = 0
+
+        if buffered:
+            flush()
+
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) "
+            f"SELECT DISTINCT ON ({time_column}) {columns} FROM {staging_table} "
+            f"ORDER BY {time_column} "
+            f"ON CONFLICT ({time_column}) DO NOTHING"
+        )
+        inserted = cursor.rowcount
+
+        cursor.execute(f"DROP TABLE {staging_table}")
+
+    log.debug(
+        f"Copied {inserted} of {received} {model.__name__} rows "
+        f"({received - inserted} duplicates or already existed)"
+    )
+
+    return inserted
+
+
+def bulk_insert_ignore_conflicts(model, rows):
+    """
+    Insert validated rows, using COPY for large batches and a plain
+    multi-row INSERT otherwise.  Returns the number of inserted rows.
+    """
+    if len(rows) >= COPY_THRESHOLD:
+        return copy_insert_ignore_conflicts(model, rows)
+    return insert_ignore_conflicts(model, rows)
+
+
+def store_overland_batch(batch, timeout=DB_WRITE_TIMEOUT):
+    """
+    Store a batch returned by ``parse_overland_features``.
+
+    Rows that were stored in the meantime (e.g. by a concurrent retry of the
+    same batch) are skipped by the database instead of failing.  When
+    ``timeout`` is set, statements running longer than ``timeout`` seconds are
+    cancelled and raise ``OperationalError``.  Returns the ``inserted`` and
+    ``skipped`` counts per model.
+    """
+    with STAGE_SECONDS.time(stage="insert"), transaction.atomic():
+        if timeout:
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = %s", [f"{timeout}s"])
+
+        inserted_locations = bulk_insert_ignore_conflicts(Location, batch["locations"])
+        inserted_visits = bulk_insert_ignore_conflicts(Visit, batch["visits"])
+
+    result = {
+        "inserted": {
+            "locations": inserted_locations,
+            "visits": inserted_visits,
+        },
+        "skipped": {
+            "locations": batch["skipped"]["locations"]
+            + len(batch["locations"])
+            - inserted_locations,
+            "visits": batch["skipped"]["visits"]
+            + len(batch["visits"])
+            - inserted_visits,
+        },
+    }
+
+    POINTS_INSERTED.inc(inserted_locations, kind="location")
+    POINTS_INSERTED.inc(inserted_visits, kind="visit")
+    POINTS_DUPLICATE.inc(result["skipped"]["locations"], kind="location")
+    POINTS_DUPLICATE.inc(result["skipped"]["visits"], kind="visit")
+
+    if inserted_locations or inserted_visits:
+        # Imported here to avoid a circular import with ingestion_queue.py
+        from .cache import invalidate_times
+
+        times = [row["time"] for row in batch["locations"]] + [
+            row["time"] for row in batch["visits"]
+        ]
+        # Once the rows are committed, or a response computed in between
+        # without them could be cached after the invalidation
+        transaction.on_commit(lambda: invalidate_times(times))
+
+    return result
+
+
+def iter_chunks(items, size):
+    """Yield lists of up to ``size`` items from an iterable."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ingest_overland_features(features, fallback=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Validate and store an iterable of Overland features ``chunk_size`` at a
+    time, so a large upload never has to be held in memory at once.
+
+    Each chunk is committed on its own; a retried upload is harmless since
+    stored rows are skipped.  When a chunk fails with a ``DatabaseError`` and
+    a ``fallback`` callable is given (e.g. the spool), it receives that chunk
+    and every remaining one, and must return True once a chunk is safely
+    kept.  Otherwise the error is raised.
+
+    Returns the total ``received``, ``inserted``, ``skipped`` and
+    ``fallback`` feature counts.
+    """
+    totals = {
+        "received": 0,
+        "inserted": {"locations": 0, "visits": 0},
+        "skipped": {"locations": 0, "visits": 0},
+        "fallback": 0,
+    }
+
+    error = None
+    chunks = iter_chunks(features, chunk_size)
+
+    while True:
+        # Streamed features are decoded while the chunk is being read
+        with STAGE_SECONDS.time(stage="parse"):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+
+        totals["received"] += len(chunk)
+
+        if error is None:
+            try:
+                result = store_overland_batch(parse_overland_features(chunk))
+            except DatabaseError as e:
+                if fallback is None:
+                    raise
+                log.error(f"Error saving data: {str(e)}")
+                error = e
+            else:
+                for model in ("locations", "visits"):
+                    totals["inserted"][model] += result["inserted"][model]
+                    totals["skipped"][model] += result["skipped"][model]
+                continue
+
+        # The database failed, the fallback takes this chunk and the next ones
+        if not fallback(chunk):
+            raise error
+        totals["fallback"] += len(chunk)
+
+    return totals
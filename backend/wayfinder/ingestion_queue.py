@@ -0,0 +1,290 @@
+# ingestion_queue.py
+
+import json
+import logging
+import os
+import socket
+import time
+
+import redis
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, OperationalError
+
+from .ingestion import parse_overland_features, store_overland_batch
+
+log = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Acknowledge Overland batches as soon as they are in the Redis stream and
+# store them from a Celery worker
+QUEUE_ENABLED = os.getenv("OVERLAND_QUEUE", "False") == "True"
+
+# Refuse new batches (HTTP 503) while this many are waiting in the stream
+QUEUE_MAX_LENGTH = int(os.getenv("OVERLAND_QUEUE_MAX_LENGTH", "10000"))
+
+# Number of queued batches coalesced into a single database write
+DRAIN_BATCH_SIZE = int(os.getenv("OVERLAND_QUEUE_DRAIN_BATCH_SIZE", "100"))
+
+# Stop draining after this many seconds and let the next task continue
+DRAIN_TIME_LIMIT = 50
+
+# Batches left unacknowledged by a failed drain are claimed again after this long
+CLAIM_IDLE_MS = 2 * 60 * 1000
+
+# Seconds before a Redis connection or command gives up, so a Redis that
+# hangs fails like one that refuses connections instead of blocking requests
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT_SECONDS", "2"))
+
+# Redis keys
+STREAM_KEY = "wayfinder:overland:stream"
+GROUP_NAME = "wayfinder-ingestion"
+DEAD_LETTER_KEY = "wayfinder:overland:dead-letter"
+DRAIN_SCHEDULED_KEY = "wayfinder:overland:drain-scheduled"
+
+# Database errors that leave batches in the stream to be retried later
+RETRYABLE_ERRORS = (OperationalError, InterfaceError)
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion stream has reached ``QUEUE_MAX_LENGTH``."""
+
+
+_redis_client = None
+
+
+def get_redis():
+    """Return a Redis client for the instance used as the Celery broker."""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=REDIS_TIMEOUT,
+            socket_connect_timeout=REDIS_TIMEOUT,
+        )
+    return _redis_client
+
+
+def enqueue_overland_payload(locations):
+    """
+    Append the raw ``locations`` array of an Overland request to the
+    ingestion stream and make sure a drain task is scheduled.
+
+    Raises ``QueueFullError`` when too many batches are already waiting, so
+    the phone keeps its backlog and retries later.
+    """
+    client = get_redis()
+
+    if client.xlen(STREAM_KEY) >= QUEUE_MAX_LENGTH:
+        raise QueueFullError(
+            f"Ingestion queue is full ({QUEUE_MAX_LENGTH} batches waiting)"
+        )
+
+    message_id = client.xadd(STREAM_KEY, {"payload": json.dumps(locations)})
+    log.debug(f"Queued batch {message_id} with {len(locations)} features")
+
+    schedule_drain()
+
+    return message_id
+
+
+def schedule_drain():
+    """
+    Schedule a ``drain_overland_queue`` task unless one is already waiting
+    to run, so a burst of requests doesn't flood the Celery queue.
+    """
+    # Imported here to avoid a circular import with tasks.py
+    from .tasks import drain_overland_queue
+
+    try:
+        if get_redis().set(DRAIN_SCHEDULED_KEY, 1, nx=True, ex=60):
+            drain_overland_queue.delay()
+    except Exception as e:
+        # Queued batches are safe, the periodic drain will pick them up
+        log.warning(f"Could not schedule a drain of the ingestion queue: {str(e)}")
+
+
+def _ensure_group(client):
+    """Create the consumer group (and the stream) if they don't exist."""
+    try:
+        client.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _read_messages(client, consumer):
+    """
+    Return up to ``DRAIN_BATCH_SIZE`` messages for ``consumer``: batches left
+    pending by a dead consumer first, then new ones.
+    """
+    _, messages, *_ = client.xautoclaim(
+        STREAM_KEY,
+        GROUP_NAME,
+        consumer,
+        min_idle_time=CLAIM_IDLE_MS,
+        start_id="0-0",
+        count=DRAIN_BATCH_SIZE,
+    )
+    messages = [(message_id, fields) for message_id, fields in messages if fields]
+
+    if len(messages) < DRAIN_BATCH_SIZE:
+        response = client.xreadgroup(
+            GROUP_NAME,
+            consumer,
+            {STREAM_KEY: ">"},
+            count=DRAIN_BATCH_SIZE - len(messages),
+        )
+        for _, stream_messages in response:
+            messages.extend(stream_messages)
+
+    return messages
+
+
+def _acknowledge(client, message_ids):
+    """Acknowledge and delete processed messages so XLEN reflects the backlog."""
+    if not message_ids:
+        return
+    pipeline = client.pipeline()
+    pipeline.xack(STREAM_KEY, GROUP_NAME, *message_ids)
+    pipeline.xdel(STREAM_KEY, *message_ids)
+    pipeline.execute()
+
+
+def _dead_letter(client, message_id, payload, error):
+    """Move a batch that can't be ingested to the dead-letter list."""
+    log.error(f"Moving queued batch {message_id} to the dead-letter list: {error}")
+    client.lpush(
+        DEAD_LETTER_KEY,
+        json.dumps(
+            {
+                "id": message_id.decode(),
+                "error": str(error),
+                "payload": payload.decode(errors="replace"),
+            }
+        ),
+    )
+    _acknowledge(client, [message_id])
+
+
+def _decode_payload(fields):
+    """Return the list of features stored in a stream message."""
+    features = json.loads(fields[b"payload"])
+    if not isinstance(features, list):
+        raise ValueError("payload is not a list of features")
+    return features
+
+
+def _store(features):
+    """Validate and store a list of features, returning the counts."""
+    return store_overland_batch(parse_overland_features(features))
+
+
+def drain_stream():
+    """
+    Store the batches waiting in the ingestion stream.
+
+    Messages are read through a consumer group and only acknowledged once
+    their rows are committed, so a worker crash never loses a batch: it is
+    claimed by the next drain (at-least-once delivery; replays are harmless
+    thanks to ``ON CONFLICT DO NOTHING``).  Up to ``DRAIN_BATCH_SIZE`` batches
+    are coalesced into a single write.  Batches that can't be decoded or
+    stored are moved to the dead-letter list.
+
+    When the time limit is reached before the stream is empty, another drain
+    is scheduled.  Returns the number of processed batches.
+    """
+    client = get_redis()
+    _ensure_group(client)
+
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    deadline = time.monotonic() + DRAIN_TIME_LIMIT
+    processed = 0
+
+    while True:
+        if time.monotonic() >= deadline:
+            schedule_drain()
+            break
+
+        messages = _read_messages(client, consumer)
+        if not messages:
+            break
+
+        # Decode the batches, dead-lettering the ones that aren't valid JSON
+        decoded = []
+        for message_id, fields in messages:
+            try:
+                decoded.append((message_id, fields, _decode_payload(fields)))
+            except (KeyError, ValueError) as e:
+                _dead_letter(client, message_id, fields.get(b"payload", b""), e)
+                processed += 1
+
+        # Store all batches in one go
+        features = [feature for _, _, batch in decoded for feature in batch]
+        try:
+            result = _store(features)
+        except RETRYABLE_ERRORS:
+            # Leave the batches pending, they will be claimed again
+            raise
+        except Exception as e:
+            log.warning(f"Coalesced write failed ({e}), storing batches one by one")
+        else:
+            _acknowledge(client, [message_id for message_id, _, _ in decoded])
+            processed += len(decoded)
+            log.info(
+                f"Stored {len(decoded)} queued batches: inserted "
+                f"{result['inserted']['locations']} locations and "
+                f"{result['inserted']['visits']} visits"
+            )
+            continue
+
+        # Isolate the batches that break the coalesced write
+        for message_id, fields, batch in decoded:
+            try:
+                _store(batch)
+            except RETRYABLE_ERRORS:
+                raise
+            except (DatabaseError, ValueError, TypeError, AttributeError) as e:
+                _dead_letter(client, message_id, fields[b"payload"], e)
+            else:
+                _acknowledge(client, [message_id])
+            processed += 1
+
+    return processed
+
+
+def get_queue_stats():
+    """Return the number of waiting, pending and dead-lettered batches."""
+    client = get_redis()
+    _ensure_group(client)
+
+    return {
+        "waiting": client.xlen(STREAM_KEY),
+        "pending": client.xpending(STREAM_KEY, GROUP_NAME)["pending"],
+        "dead_letter": client.llen(DEAD_LETTER_KEY),
+    }
+
+
+def requeue_dead_letter():
+    """
+    Move every batch of the dead-letter list back to the ingestion stream,
+    e.g. after fixing the bug that made them fail.  Returns how many were
+    requeued.
+    """
+    client = get_redis()
+    requeued = 0
+
+    while True:
+        entry = client.rpop(DEAD_LETTER_KEY)
+        if entry is None:
+            break
+        client.xadd(STREAM_KEY, {"payload": json.loads(entry)["payload"]})
+        requeued += 1
+
+    if requeued:
+        schedule_drain()
+
+    return requeued
@@ -0,0 +1,703 @@
+# benchmarks.py
+
+import gzip
+import io
+import json
+import math
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import pandas as pd
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.text import compress_sequence, compress_string
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ..columns import LocationColumns, epoch_time, iso_time
+from ..ingestion import parse_overland_features, store_overland_batch
+from ..parsers import iter_json_array
+from ..renderers import TRIPS_RENDERERS, GeoJSONRenderer, orjson
+from ..serializers import OVERLAND_DATE_FORMAT
+from ..utils import (
+    build_trips_feature_collection,
+    segment_trips,
+    segment_trips_by_midtimes,
+)
+
+# Batch sizes benchmarked by default
+DEFAULT_BATCH_SIZES = [10, 100, 1000, 10000]
+
+# Synthetic data starts here, away from real data, and is always rolled back
+DEFAULT_START = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+# Stages timed for every batch, in order
+STAGES = ["parse", "validate", "insert", "request"]
+
+# Meters per degree of latitude
+METERS_PER_DEGREE = 111320
+
+# Motion profiles: Overland motions, speed range (m/s) and duration (s)
+MOTION_PROFILES = [
+    (["walking"], (0.8, 1.8), (120, 900)),
+    (["running"], (2.5, 4.0), (300, 1800)),
+    (["cycling"], (3.5, 7.0), (300, 2400)),
+    (["driving"], (8.0, 30.0), (300, 3600)),
+    (["driving", "stationary"], (0.0, 0.5), (20, 120)),
+]
+
+# Ways a generated feature can be broken, each rejected by the serializers
+INVALID_MUTATIONS = [
+    ("battery_state", "exploded"),
+    ("motion", ["teleporting"]),
+    ("timestamp", "yesterday"),
+    ("battery_level", "full"),
+    ("altitude", None),
+]
+
+
+class OverlandPayloadGenerator:
+    """
+    Generate realistic Overland batches: a device alternating between visits
+    (stationary at a place) and trips with mixed motions, reporting one
+    location per second.
+
+    A share of the features are duplicates of earlier ones (as sent by
+    Overland when it retries a batch) or invalid, and some visits are sent
+    without a departure date (they are still ongoing) and dropped by the
+    parser.  Output is deterministic for a given ``seed``.
+    """
+
+    def __init__(
+        self,
+        start=DEFAULT_START,
+        seed=0,
+        duplicate_ratio=0.02,
+        invalid_ratio=0.01,
+        device_id="benchmark",
+    ):
+        self.random = random.Random(seed)
+        self.time = start
+        self.duplicate_ratio = duplicate_ratio
+        self.invalid_ratio = invalid_ratio
+        self.device_id = device_id
+
+        self.longitude = -4.2838405
+        self.latitude = 38.665856
+        self.heading = self.random.uniform(0, 2 * math.pi)
+        self.battery_level = 1.0
+
+        self.segment = None
+        self.segment_left = 0
+        self.visit_started = None
+
+    def _next_segment(self):
+        """Pick the next motion profile, or a stay at a place."""
+        if self.segment is not None and self.random.random() < 0.3:
+            self.segment = "visit"
+            self.segment_left = self.random.randint(600, 7200)
+            self.visit_started = self.time
+            return
+
+        motion, speeds, durations = self.random.choice(MOTION_PROFILES)
+        self.segment = (motion, speeds)
+        self.segment_left = self.random.randint(*durations)
+        self.heading = self.random.uniform(0, 2 * math.pi)
+
+    def _properties(self, speed, motion):
+        battery_state = "charging" if self.battery_level < 0.2 else "unplugged"
+        return {
+            "speed": round(speed) if speed else -1,
+            "battery_state": battery_state,
+            "motion": motion,
+            "timestamp": self.time.strftime(OVERLAND_DATE_FORMAT),
+            "horizontal_accuracy": self.random.choice([5, 10, 16, 35, 65]),
+            "speed_accuracy": round(self.random.uniform(0.5, 2), 2) if speed else -1,
+            "vertical_accuracy": self.random.choice([3, 4, 8, 12]),
+            "battery_level": round(self.battery_level, 2),
+            "wifi": "",
+            "course": round(math.degrees(self.heading)) % 360 if speed else -1,
+            "device_id": self.device_id,
+            "altitude": self.random.randint(0, 900),
+            "course_accuracy": round(self.random.uniform(1, 20), 2) if speed else -1,
+        }
+
+    def _feature(self, properties):
+        return {
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [round(self.longitude, 7), round(self.latitude, 7)],
+            },
+            "properties": properties,
+        }
+
+    def _move(self, distance):
+        self.heading += self.random.gauss(0, 0.05)
+        self.latitude += distance * math.cos(self.heading) / METERS_PER_DEGREE
+        self.longitude += (
+            distance
+            * math.sin(self.heading)
+            / (METERS_PER_DEGREE * math.cos(math.radians(self.latitude)))
+        )
+
+    def _visit(self, departure_date):
+        """Visit feature for the place the device is at."""
+        properties = self._properties(0, [])
+        for name in ("speed", "motion", "speed_accuracy", "course", "course_accuracy"):
+            del properties[name]
+        properties["horizontal_accuracy"] = 30
+        properties["wifi"] = "Home"
+        properties["arrival_date"] = self.visit_started.strftime(OVERLAND_DATE_FORMAT)
+        properties["departure_date"] = (
+            departure_date.strftime(OVERLAND_DATE_FORMAT) if departure_date else ""
+        )
+        return self._feature(properties)
+
+    def _corrupt(self, feature):
+        """Return a copy of ``feature`` the serializers reject."""
+        feature = json.loads(json.dumps(feature))
+        if self.random.random() < 0.2:
+            del feature["geometry"]["coordinates"]
+            return feature
+        name, value = self.random.choice(INVALID_MUTATIONS)
+        feature["properties"][name] = value
+        return feature
+
+    def features(self, count):
+        """Return the next ``count`` features of the device's history."""
+        features = []
+
+        while len(features) < count:
+            if self.segment_left <= 0:
+                # Overland reports a visit on arrival, then once it is over
+                if self.segment == "visit":
+                    features.append(self._visit(self.time))
+                self._next_segment()
+                if self.segment == "visit":
+                    features.append(self._visit(None))
+
+            if features and self.random.random() < self.duplicate_ratio:
+                features.append(json.loads(json.dumps(self.random.choice(features))))
+                continue
+
+            if self.segment == "visit":
+                # Overland reports a few points per minute while stationary
+                self.time += timedelta(seconds=self.random.randint(10, 60))
+                self.segment_left -= 30
+                feature = self._feature(self._properties(0, ["stationary"]))
+            else:
+                motion, speeds = self.segment
+                speed = self.random.uniform(*speeds)
+                self._move(speed)  # for one second
+                self.time += timedelta(seconds=1)
+                self.segment_left -= 1
+                feature = self._feature(self._properties(speed, motion))
+
+            self.battery_level = max(0.05, self.battery_level - 0.00002)
+
+            if self.random.random() < self.invalid_ratio:
+                feature = self._corrupt(feature)
+            features.append(feature)
+
+        return features[:count]
+
+    def payload(self, count):
+        """Return the body of an Overland request with ``count`` features."""
+        return {"locations": self.features(count)}
+
+
+def _measure(function, *args):
+    """Run ``function`` and return its result, and its duration and queries."""
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - started
+    return result, (elapsed, len(queries.captured_queries))
+
+
+def _parse_body(body):
+    """Decode the features of a request body with the streaming parser."""
+    return list(iter_json_array(io.BytesIO(body), "locations"))
+
+
+def _post_overland(body):
+    """Send ``body`` through ``OverlandView`` as the Overland app would."""
+    # Imported here, views.py pulls in the whole API
+    from ..views import OverlandView
+
+    request = APIRequestFactory().post(
+        "/wayfinder/overland/", body, content_type="application/json"
+    )
+    force_authenticate(request, user=User(username="benchmark"))
+    response = OverlandView.as_view()(request)
+    if response.status_code != 200:
+        raise RuntimeError(f"OverlandView answered {response.status_code}")
+    return response
+
+
+def benchmark_batch(generator, size):
+    """
+    Time each ingestion stage for one batch of ``size`` features.
+
+    Every write happens in a transaction that is rolled back, so the
+    database is left untouched.  Returns ``{stage: (seconds, queries)}``
+    and the counts returned by ``store_overland_batch``.
+    """
+    body = json.dumps(generator.payload(size)).encode()
+    results = {}
+
+    with transaction.atomic():
+        features, results["parse"] = _measure(_parse_body, body)
+        batch, results["validate"] = _measure(parse_overland_features, features)
+        stored, results["insert"] = _measure(store_overland_batch, batch)
+        transaction.set_rollback(True)
+
+    # The whole request, from the raw body to the stored rows
+    with transaction.atomic():
+        _, results["request"] = _measure(_post_overland, body)
+        transaction.set_rollback(True)
+
+    return results, stored
+
+
+def run_benchmark(sizes=DEFAULT_BATCH_SIZES, repeat=3, seed=0, **generator_options):
+    """
+    Benchmark the ingestion of batches of each size ``repeat`` times.
+
+    Returns one result per size with, for each stage, the median time per
+    batch, the throughput in points per second and the queries per batch.
+    """
+    generator = OverlandPayloadGenerator(seed=seed, **generator_options)
+    report = []
+
+    for size in sizes:
+        runs = []
+        for _ in range(repeat):
+            runs.append(benchmark_batch(generator, size))
+
+        stages = {}
+        for stage in STAGES:
+            seconds = statistics.median(timings[stage][0] for timings, _ in runs)
+            stages[stage] = {
+                "ms": round(seconds * 1000, 2),
+                "points_per_second": round(size / seconds) if seconds else None,
+                "queries": max(timings[stage][1] for timings, _ in runs),
+            }
+
+        _, stored = runs[-1]
+        inserted = sum(stored["inserted"].values())
+        skipped = sum(stored["skipped"].values())
+        report.append(
+            {
+                "size": size,
+                "stages": stages,
+                "inserted": inserted,
+                "skipped": skipped,
+                # Invalid features and visits without a departure date
+                "dropped": size - inserted - skipped,
+            }
+        )
+
+    return report
+
+
+# Trip segmentation benchmark: locations per page and visits in the range
+DEFAULT_SEGMENTATION_POINTS = [10000, 100000, 1000000]
+DEFAULT_SEGMENTATION_VISITS = [10, 100, 1000]
+
+# Trip rendering benchmark: locations per page, with DEFAULT_RENDER_VISITS
+DEFAULT_RENDER_POINTS = [1000, 10000, 100000]
+DEFAULT_RENDER_VISITS = 100
+
+
+def synthetic_trip_locations(points, visits, seed=0, start=DEFAULT_START):
+    """
+    Return ``points`` trip locations one second apart, as dicts like the
+    ORM returned them, and the sorted midtimes of ``visits`` visits spread
+    over the same period, as ``TripsView`` passes them to the trip
+    segmentation.
+    """
+    rng = random.Random(seed)
+    locations = [
+        {
+            "time": start + timedelta(seconds=i),
+            "longitude": rng.uniform(-180, 180),
+            "latitude": rng.uniform(-90, 90),
+        }
+        for i in range(points)
+    ]
+    midtimes = sorted(
+        start + timedelta(seconds=rng.uniform(0, points)) for _ in range(visits)
+    )
+    return locations, midtimes
+
+
+def to_location_columns(locations, epoch=False):
+    """``LocationColumns`` of location dicts, as ``fetch_location_columns``
+    reads them from the database."""
+    time_key = epoch_time if epoch else iso_time
+    return LocationColumns(
+        [time_key(location["time"]) for location in locations],
+        [location["longitude"] for location in locations],
+        [location["latitude"] for location in locations],
+        epoch=epoch,
+    )
+
+
+def segment_trips_with_masks(locations_df, midtimes, trip_id_offset=1):
+    """
+    Reference segmentation, as done before ``segment_trips_by_midtimes``:
+    a boolean mask over every location of a DataFrame and a copy for each
+    pair of midtimes.  Kept to check that both give the same trips.
+    """
+    locations_df = locations_df.sort_values("time").copy()
+    segments = []
+    trip_counter = trip_id_offset
+
+    mask = locations_df["time"] < midtimes[0]
+    if mask.any():
+        segments.append((f"trip_{trip_counter:03d}", locations_df[mask].copy()))
+        trip_counter += 1
+
+    for i in range(len(midtimes) - 1):
+        mask = (locations_df["time"] >= midtimes[i]) & (
+            locations_df["time"] < midtimes[i + 1]
+        )
+        if mask.any():
+            segments.append((f"trip_{trip_counter:03d}", locations_df[mask].copy()))
+            trip_counter += 1
+
+    mask = locations_df["time"] >= midtimes[-1]
+    if mask.any():
+        segments.append((f"trip_{trip_counter:03d}", locations_df[mask].copy()))
+
+    return segments
+
+
+def _linestring_from_dataframe(trip_id, locations_df):
+    """Reference GeoJSON LineString of a DataFrame, through per-row dicts."""
+    records = locations_df.sort_values("time").to_dict("records")
+    return {
+        "type": "Feature",
+        "id": trip_id,
+        "geometry": {
+            "type": "LineString",
+            "coordinates": [[loc["longitude"], loc["latitude"]] for loc in records],
+        },
+        "properties": {
+            "trip_id": trip_id,
+            "times": [loc["time"].isoformat() for loc in records],
+        },
+    }
+
+
+def build_trips_with_dataframes(locations, midtimes):
+    """
+    Reference trips FeatureCollection, built as before the columnar
+    pipeline: ORM dicts to a DataFrame, segmented with masks, and back to
+    dicts for each trip.
+    """
+    segments = segment_trips_with_masks(pd.DataFrame(locations), midtimes)
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            _linestring_from_dataframe(trip_id, segment_df)
+            for trip_id, segment_df in segments
+        ],
+    }
+
+
+def _same_segments(segments, locations, reference):
+    """Whether both segmentations have the same trip IDs and boundaries."""
+    return [
+        (trip_id, locations.times[start], locations.times[end - 1], end - start)
+        for trip_id, start, end in segments
+    ] == [
+        (
+            trip_id,
+            iso_time(segment["time"].iloc[0]),
+            iso_time(segment["time"].iloc[-1]),
+            len(segment),
+        )
+        for trip_id, segment in reference
+    ]
+
+
+def _time(function, *args, repeat=3):
+    """Return the result of ``function`` and its median duration in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return result, statistics.median(timings)
+
+
+def _peak_memory(function, *args):
+    """Return the peak memory allocated by ``function``, in bytes."""
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_segmentation_benchmark(
+    points=DEFAULT_SEGMENTATION_POINTS,
+    visits=DEFAULT_SEGMENTATION_VISITS,
+    repeat=3,
+    seed=0,
+    reference=True,
+):
+    """
+    Time ``segment_trips_by_midtimes`` for every combination of ``points``
+    and ``visits``, and the mask-per-visit reference unless ``reference``
+    is False.  Returns one result per combination with the median times,
+    the number of trips and whether both gave the same trips.
+    """
+    report = []
+
+    for point_count in points:
+        for visit_count in visits:
+            locations, midtimes = synthetic_trip_locations(
+                point_count, visit_count, seed=seed
+            )
+            columns = to_location_columns(locations)
+            segments, seconds = _time(
+                segment_trips_by_midtimes, columns, midtimes, repeat=repeat
+            )
+            result = {
+                "points": point_count,
+                "visits": visit_count,
+                "trips": len(segments),
+                "ms": round(seconds * 1000, 2),
+            }
+
+            if reference:
+                locations_df = pd.DataFrame(locations)
+                expected, reference_seconds = _time(
+                    segment_trips_with_masks, locations_df, midtimes, repeat=repeat
+                )
+                result["reference_ms"] = round(reference_seconds * 1000, 2)
+                result["speedup"] = (
+                    round(reference_seconds / seconds, 1) if seconds else None
+                )
+                result["identical"] = _same_segments(segments, columns, expected)
+
+            report.append(result)
+
+    return report
+
+
+def run_render_benchmark(
+    points=DEFAULT_RENDER_POINTS,
+    visits=DEFAULT_RENDER_VISITS,
+    repeat=3,
+    seed=0,
+    reference=True,
+):
+    """
+    Time and measure the peak memory of ``build_trips_feature_collection``
+    with separated trips, for pages of each number of ``points``, and of
+    the DataFrame-based reference unless ``reference`` is False.  Returns
+    one result per page size, with whether both gave the same GeoJSON.
+
+    Reading the columns from the database is timed by ``storage_report``.
+    """
+    report = []
+
+    for point_count in points:
+        locations, midtimes = synthetic_trip_locations(point_count, visits, seed=seed)
+        columns = to_location_columns(locations)
+
+        def build():
+            return build_trips_feature_collection(
+                columns, separate_trips=True, midtimes=midtimes
+            )
+
+        collection, seconds = _time(build, repeat=repeat)
+        result = {
+            "points": point_count,
+            "visits": visits,
+            "trips": len(collection["features"]),
+            "ms": round(seconds * 1000, 2),
+            "peak_kb": round(_peak_memory(build) / 1024),
+        }
+
+        if reference:
+            expected, reference_seconds = _time(
+                build_trips_with_dataframes, locations, midtimes, repeat=repeat
+            )
+            reference_peak = _peak_memory(
+                build_trips_with_dataframes, locations, midtimes
+            )
+            result["reference_ms"] = round(reference_seconds * 1000, 2)
+            result["reference_peak_kb"] = round(reference_peak / 1024)
+            result["speedup"] = (
+                round(reference_seconds / seconds, 1) if seconds else None
+            )
+            result["identical"] = collection == expected
+
+        report.append(result)
+
+    return report
+
+
+def _trips_response(points, visits, seed=0):
+    """A ``TripsView`` response body with a page of ``points`` locations."""
+    locations, midtimes = synthetic_trip_locations(points, visits, seed=seed)
+    trips = build_trips_feature_collection(
+        to_location_columns(locations), separate_trips=True, midtimes=midtimes
+    )
+    return {
+        "trips": trips,
+        "visits": {"type": "FeatureCollection", "features": []},
+        "meta": {"trip_locations": points, "trips_count": len(trips["features"])},
+    }
+
+
+def _render_with_json_renderer(data):
+    """Reference rendering: the whole body, then gzip on the whole body."""
+    return compress_string(JSONRenderer().render(data))
+
+
+def _render_with_geojson_renderer(data):
+    """Streamed rendering, gzip compressed chunk by chunk."""
+    return b"".join(compress_sequence(GeoJSONRenderer().iter_render(data)))
+
+
+def _first_chunk(data):
+    """The first chunk of the streamed body."""
+    return next(GeoJSONRenderer().iter_render(data))
+
+
+def run_renderer_benchmark(
+    points=DEFAULT_RENDER_POINTS,
+    visits=DEFAULT_RENDER_VISITS,
+    repeat=3,
+    seed=0,
+):
+    """
+    Time and measure the peak memory of rendering a ``TripsView`` response
+    and compressing it as ``GZipMiddleware`` does, with DRF's
+    ``JSONRenderer`` and with the streaming ``GeoJSONRenderer``, for pages
+    of each number of ``points``.  Returns one result per page size, with
+    the time to the first streamed chunk and whether both gave the same
+    JSON.
+    """
+    report = []
+
+    for point_count in points:
+        data = _trips_response(point_count, visits, seed=seed)
+
+        streamed, seconds = _time(_render_with_geojson_renderer, data, repeat=repeat)
+        buffered, reference_seconds = _time(
+            _render_with_json_renderer, data, repeat=repeat
+        )
+        _, first_chunk_seconds = _time(_first_chunk, data, repeat=repeat)
+
+        report.append(
+            {
+                "points": point_count,
+                "orjson": orjson is not None,
+                "bytes": len(buffered),
+                "ms": round(seconds * 1000, 2),
+                "first_chunk_ms": round(first_chunk_seconds * 1000, 2),
+                "peak_kb": round(
+                    _peak_memory(_render_with_geojson_renderer, data) / 1024
+                ),
+                "reference_ms": round(reference_seconds * 1000, 2),
+                "reference_peak_kb": round(
+                    _peak_memory(_render_with_json_renderer, data) / 1024
+                ),
+                "speedup": round(reference_seconds / seconds, 1) if seconds else None,
+                # orjson writes some floats differently (1e-5 for 1e-05)
+                "identical": json.loads(gzip.decompress(streamed))
+                == json.loads(gzip.decompress(buffered)),
+            }
+        )
+
+    return report
+
+
+# GeoJSON variants benchmarked with the other formats: the opt-in compact
+# forms of the trip features (see build_trips_feature_collection)
+GEOJSON_VARIANTS = [
+    ("json", {}),
+    ("json delta", {"delta_times": True}),
+    ("json delta q5", {"delta_times": True, "coordinate_scale": 10**5}),
+]
+
+
+def _render_trips(renderer, locations, segments, data, geojson_options):
+    """A ``TripsView`` body in the format of ``renderer``, as bytes."""
+    if isinstance(renderer, GeoJSONRenderer):
+        trips = build_trips_feature_collection(
+            locations, segments=segments, **geojson_options
+        )
+        return b"".join(renderer.iter_render({"trips": trips, **data}))
+    return b"".join(renderer.iter_trips(locations, segments, data))
+
+
+def run_format_benchmark(
+    points=DEFAULT_RENDER_POINTS,
+    visits=DEFAULT_RENDER_VISITS,
+    repeat=3,
+    seed=0,
+):
+    """
+    Size and render time of a ``TripsView`` page of separated trips in each
+    format (the ``GEOJSON_VARIANTS`` and the ones of ``TRIPS_RENDERERS``),
+    for pages of each number of ``points``.  Returns one result per page
+    size and format, with the sizes before and after gzip and relative to
+    plain GeoJSON.
+    """
+    formats = [
+        (label, GeoJSONRenderer, options) for label, options in GEOJSON_VARIANTS
+    ] + [(renderer.format, renderer, {}) for renderer in TRIPS_RENDERERS]
+    report = []
+
+    for point_count in points:
+        locations, midtimes = synthetic_trip_locations(point_count, visits, seed=seed)
+        data = {
+            "visits": {"type": "FeatureCollection", "features": []},
+            "meta": {"trip_locations": point_count},
+        }
+
+        geojson_size = None
+        for label, renderer_class, options in formats:
+            # Columns as TripsView fetches them for the format
+            columns = to_location_columns(
+                locations,
+                epoch=renderer_class is not GeoJSONRenderer
+                or options.get("delta_times", False),
+            )
+            segments = segment_trips(columns, separate_trips=True, midtimes=midtimes)
+            body, seconds = _time(
+                _render_trips,
+                renderer_class(),
+                columns,
+                segments,
+                data,
+                options,
+                repeat=repeat,
+            )
+            geojson_size = geojson_size or len(body)
+            report.append(
+                {
+                    "points": point_count,
+                    "format": label,
+                    "bytes": len(body),
+                    "gzip_bytes": len(gzip.compress(body)),
+                    "ms": round(seconds * 1000, 2),
+                    "ratio": round(geojson_size / len(body), 1),
+                }
+            )
+
+    return report
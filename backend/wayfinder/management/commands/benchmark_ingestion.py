@@ -0,0 +1,120 @@
+# benchmark_ingestion.py
+
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wayfinder.management.benchmarks import (
+    DEFAULT_BATCH_SIZES,
+    STAGES,
+    OverlandPayloadGenerator,
+    run_benchmark,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark Overland ingestion with synthetic batches. Parsing, "
+        "validation, insertion and the whole OverlandView request are timed "
+        "separately for each batch size and reported as points/sec and "
+        "queries per batch. Everything is rolled back, the database is left "
+        "untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=DEFAULT_BATCH_SIZES,
+            help="Batch sizes to benchmark (default: 10 100 1000 10000)",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Runs per batch size, the median is reported (default: 3)",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the payload generator"
+        )
+        parser.add_argument(
+            "--duplicates",
+            type=float,
+            default=0.02,
+            help="Share of features repeated in a batch (default: 0.02)",
+        )
+        parser.add_argument(
+            "--invalid",
+            type=float,
+            default=0.01,
+            help="Share of invalid features (default: 0.01)",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Print the results as JSON, to compare runs",
+        )
+        parser.add_argument(
+            "--dump",
+            metavar="FILE",
+            help=(
+                "Only write a request body with the first batch size to FILE, "
+                "e.g. to load test a running server"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if min(options["sizes"]) < 1 or options["repeat"] < 1:
+            raise CommandError("--sizes and --repeat must be positive numbers")
+
+        generator_options = {
+            "duplicate_ratio": options["duplicates"],
+            "invalid_ratio": options["invalid"],
+        }
+
+        if options["dump"]:
+            generator = OverlandPayloadGenerator(
+                seed=options["seed"], **generator_options
+            )
+            with open(options["dump"], "w") as f:
+                json.dump(generator.payload(options["sizes"][0]), f)
+            self.stdout.write(
+                f"Wrote {options['sizes'][0]} features to {options['dump']}"
+            )
+            return
+
+        # Invalid features are logged one by one, keep them out of the timings
+        if options["verbosity"] < 2:
+            logging.disable(logging.ERROR)
+
+        try:
+            report = run_benchmark(
+                options["sizes"],
+                repeat=options["repeat"],
+                seed=options["seed"],
+                **generator_options,
+            )
+        finally:
+            logging.disable(logging.NOTSET)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'size':>7} {'stage':<9} {'ms/batch':>10} {'points/s':>10} {'queries':>8}"
+        )
+        for result in report:
+            for stage in STAGES:
+                timings = result["stages"][stage]
+                self.stdout.write(
+                    f"{result['size']:>7} {stage:<9} {timings['ms']:>10.2f} "
+                    f"{timings['points_per_second'] or 0:>10} "
+                    f"{timings['queries']:>8}"
+                )
+            self.stdout.write(
+                f"{'':>7} inserted {result['inserted']}, skipped "
+                f"{result['skipped']}, dropped {result['dropped']}"
+            )
@@ -0,0 +1,188 @@
+# benchmark_trips.py
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wayfinder.management.benchmarks import (
+    DEFAULT_RENDER_POINTS,
+    DEFAULT_RENDER_VISITS,
+    DEFAULT_SEGMENTATION_POINTS,
+    DEFAULT_SEGMENTATION_VISITS,
+    run_format_benchmark,
+    run_render_benchmark,
+    run_renderer_benchmark,
+    run_segmentation_benchmark,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark the CPU side of TripsView on synthetic data, against "
+        "the previous DataFrame-based implementation: trip segmentation by "
+        "visit midtimes for each number of locations and visits, and the "
+        "GeoJSON of a page of separated trips and its rendering to a gzipped "
+        "response body, with their peak memory, and the size of the page in "
+        "each format. No database access."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--points",
+            type=int,
+            nargs="+",
+            default=DEFAULT_SEGMENTATION_POINTS,
+            help="Numbers of locations to segment (default: 10000 100000 1000000)",
+        )
+        parser.add_argument(
+            "--visits",
+            type=int,
+            nargs="+",
+            default=DEFAULT_SEGMENTATION_VISITS,
+            help="Numbers of visits in the range (default: 10 100 1000)",
+        )
+        parser.add_argument(
+            "--render-points",
+            type=int,
+            nargs="+",
+            default=DEFAULT_RENDER_POINTS,
+            help="Page sizes to render as GeoJSON (default: 1000 10000 100000)",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Runs per combination, the median is reported (default: 3)",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the synthetic data"
+        )
+        parser.add_argument(
+            "--no-reference",
+            action="store_true",
+            help="Skip the previous implementation, which is slow for large sizes",
+        )
+        parser.add_argument(
+            "--skip-render",
+            action="store_true",
+            help="Only benchmark the segmentation, not the GeoJSON",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Print the results as JSON, to compare runs",
+        )
+
+    def handle(self, *args, **options):
+        if (
+            min(options["points"]) < 1
+            or min(options["visits"]) < 1
+            or min(options["render_points"]) < 1
+            or options["repeat"] < 1
+        ):
+            raise CommandError(
+                "--points, --visits, --render-points and --repeat must be positive"
+            )
+
+        report = {
+            "segmentation": run_segmentation_benchmark(
+                options["points"],
+                options["visits"],
+                repeat=options["repeat"],
+                seed=options["seed"],
+                reference=not options["no_reference"],
+            )
+        }
+        if not options["skip_render"]:
+            report["render"] = run_render_benchmark(
+                options["render_points"],
+                DEFAULT_RENDER_VISITS,
+                repeat=options["repeat"],
+                seed=options["seed"],
+                reference=not options["no_reference"],
+            )
+            report["renderer"] = run_renderer_benchmark(
+                options["render_points"],
+                DEFAULT_RENDER_VISITS,
+                repeat=options["repeat"],
+                seed=options["seed"],
+            )
+            report["formats"] = run_format_benchmark(
+                options["render_points"],
+                DEFAULT_RENDER_VISITS,
+                repeat=options["repeat"],
+                seed=options["seed"],
+            )
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write("Segmentation")
+        self.stdout.write(
+            f"{'points':>8} {'visits':>7} {'trips':>6} {'ms':>10} "
+            f"{'before ms':>10} {'speedup':>8} {'same':>5}"
+        )
+        for result in report["segmentation"]:
+            line = (
+                f"{result['points']:>8} {result['visits']:>7} "
+                f"{result['trips']:>6} {result['ms']:>10.2f}"
+            )
+            if "reference_ms" in result:
+                line += (
+                    f" {result['reference_ms']:>10.2f} "
+                    f"{result['speedup'] or 0:>7}x {str(result['identical']):>5}"
+                )
+            self.stdout.write(line)
+
+        if "render" not in report:
+            return
+
+        self.stdout.write(f"\nGeoJSON of a page, {DEFAULT_RENDER_VISITS} visits")
+        self.stdout.write(
+            f"{'points':>8} {'trips':>6} {'ms':>10} {'peak KB':>8} "
+            f"{'before ms':>10} {'before KB':>10} {'speedup':>8} {'same':>5}"
+        )
+        for result in report["render"]:
+            line = (
+                f"{result['points']:>8} {result['trips']:>6} "
+                f"{result['ms']:>10.2f} {result['peak_kb']:>8}"
+            )
+            if "reference_ms" in result:
+                line += (
+                    f" {result['reference_ms']:>10.2f} "
+                    f"{result['reference_peak_kb']:>10} "
+                    f"{result['speedup'] or 0:>7}x {str(result['identical']):>5}"
+                )
+            self.stdout.write(line)
+
+        renderer = "orjson" if report["renderer"][0]["orjson"] else "json"
+        self.stdout.write(
+            f"\nResponse body with GeoJSONRenderer ({renderer}) and gzip, "
+            "against JSONRenderer"
+        )
+        self.stdout.write(
+            f"{'points':>8} {'KB':>7} {'ms':>10} {'first ms':>9} {'peak KB':>8} "
+            f"{'before ms':>10} {'before KB':>10} {'speedup':>8} {'same':>5}"
+        )
+        for result in report["renderer"]:
+            self.stdout.write(
+                f"{result['points']:>8} {round(result['bytes'] / 1024):>7} "
+                f"{result['ms']:>10.2f} {result['first_chunk_ms']:>9.2f} "
+                f"{result['peak_kb']:>8} {result['reference_ms']:>10.2f} "
+                f"{result['reference_peak_kb']:>10} "
+                f"{result['speedup'] or 0:>7}x {str(result['identical']):>5}"
+            )
+
+        self.stdout.write("\nPage by format, against GeoJSON")
+        self.stdout.write(
+            f"{'points':>8} {'format':>14} {'KB':>8} {'gzip KB':>8} {'ms':>10} "
+            f"{'smaller':>8}"
+        )
+        for result in report["formats"]:
+            self.stdout.write(
+                f"{result['points']:>8} {result['format']:>14} "
+                f"{round(result['bytes'] / 1024):>8} "
+                f"{round(result['gzip_bytes'] / 1024):>8} {result['ms']:>10.2f} "
+                f"{result['ratio']:>7}x"
+            )
@@ -0,0 +1,86 @@
+# compression.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from wayfinder.storage import (
+    COMPRESS_AFTER,
+    COMPRESSION_SETTINGS,
+    compress_chunks,
+    disable_compression,
+    enable_compression,
+    get_compression_stats,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Show how much of the Location and Visit hypertables is compressed, "
+        "change the compression policy, or compress the old chunks now "
+        "instead of waiting for the policy."
+    )
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument(
+            "--enable",
+            action="store_true",
+            help="Enable compression and (re)create the compression policy",
+        )
+        action.add_argument(
+            "--disable",
+            action="store_true",
+            help="Remove the policy, decompress every chunk and disable compression",
+        )
+        parser.add_argument(
+            "--after",
+            type=int,
+            default=COMPRESS_AFTER.days,
+            help=(
+                "Age in days after which chunks are compressed "
+                f"(default: {COMPRESS_AFTER.days})"
+            ),
+        )
+        parser.add_argument(
+            "--now",
+            action="store_true",
+            help="Compress the chunks older than --after now",
+        )
+
+    def handle(self, *args, **options):
+        if options["after"] < 1:
+            raise CommandError("--after must be a positive number")
+        if options["disable"] and options["now"]:
+            raise CommandError("--now can't be used with --disable")
+
+        compress_after = timedelta(days=options["after"])
+
+        for table, settings in COMPRESSION_SETTINGS.items():
+            if get_compression_stats(connection, table) is None:
+                raise CommandError(f"{table} is not a TimescaleDB hypertable")
+
+            if options["enable"]:
+                enable_compression(
+                    connection, table, compress_after=compress_after, **settings
+                )
+                self.stdout.write(
+                    f"{table}: compressing chunks older than {options['after']} days"
+                )
+            elif options["disable"]:
+                disable_compression(connection, table)
+                self.stdout.write(f"{table}: compression disabled")
+
+            if options["now"]:
+                compressed = compress_chunks(connection, table, compress_after)
+                self.stdout.write(f"{table}: compressed {compressed} chunks")
+
+            stats = get_compression_stats(connection, table)
+            before = stats["bytes_before_compression"]
+            after = stats["bytes_after_compression"]
+            ratio = f", {before / after:.1f}x smaller" if before and after else ""
+            self.stdout.write(
+                f"{table}: {stats['compressed_chunks']} of {stats['chunks']} "
+                f"chunks compressed{ratio}"
+            )
@@ -0,0 +1,156 @@
+# import_overland.py
+
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.exceptions import ParseError
+
+from wayfinder.cache import invalidate_times
+from wayfinder.ingestion import copy_insert_ignore_conflicts, parse_overland_features
+from wayfinder.models import Location, Visit
+from wayfinder.parsers import JSONStreamReader, iter_json_array
+
+# Keys holding the features of an Overland request body and a FeatureCollection
+DOCUMENT_KEYS = ("locations", "features")
+
+# NDJSON files are recognised by a first line holding a whole feature, read
+# up to this many bytes so a single-line document isn't read whole
+FIRST_LINE_MAX_BYTES = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Import historical Overland data. Each file can be an Overland request "
+        "body ({'locations': [...]}), a JSON list of GeoJSON features or a "
+        "newline-delimited file with one feature per line. Rows are loaded "
+        "with COPY; timestamps that are already stored are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+", help="Files to import")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=50000,
+            help="Number of features validated and loaded at a time (default: 50000)",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be a positive number")
+
+        totals = {"features": 0, "locations": 0, "visits": 0}
+        started = time.monotonic()
+
+        for path in options["files"]:
+            self.stdout.write(f"Importing {path}")
+
+            chunk = []
+            for feature in self.read_features(path):
+                chunk.append(feature)
+                if len(chunk) >= chunk_size:
+                    self.import_chunk(chunk, totals)
+                    chunk = []
+
+            if chunk:
+                self.import_chunk(chunk, totals)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {totals['locations']} locations and {totals['visits']} "
+                f"visits from {totals['features']} features in {elapsed:.1f}s "
+                f"({totals['features'] / max(elapsed, 1e-9):.0f} features/s)"
+            )
+        )
+
+    def read_features(self, path):
+        """
+        Yield the GeoJSON features stored in ``path``, reading the file as
+        they are yielded so memory doesn't grow with its size.
+        """
+        try:
+            with open(path, "rb") as f:
+                first_line = self.read_first_line(f)
+                f.seek(0)
+
+                if self.is_feature(first_line):
+                    yield from self.read_lines(path, f)
+                elif first_line.lstrip().startswith(b"["):
+                    yield from self.read_list(path, f)
+                else:
+                    yield from self.read_document(path, f)
+        except OSError as e:
+            raise CommandError(f"Could not read {path}: {e}")
+
+    def read_first_line(self, f):
+        """The first non-blank line of ``f``, up to ``FIRST_LINE_MAX_BYTES``."""
+        line = f.readline(FIRST_LINE_MAX_BYTES)
+        while line and not line.strip():
+            line = f.readline(FIRST_LINE_MAX_BYTES)
+        return line
+
+    def is_feature(self, line):
+        """Whether ``line`` holds a whole feature, the first of an NDJSON file."""
+        try:
+            value = json.loads(line)
+        except ValueError:
+            # Only the start of a document
+            return False
+        return isinstance(value, dict) and value.get("type") == "Feature"
+
+    def read_lines(self, path, f):
+        """Yield the features of a newline-delimited file."""
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise CommandError(f"{path}:{line_number}: {e}")
+
+    def read_list(self, path, f):
+        """Yield the features of a JSON list, one at a time."""
+        reader = JSONStreamReader(f)
+        try:
+            reader.expect("[")
+            if reader.peek() == "]":
+                return
+            while True:
+                yield reader.decode_value()
+                if not reader.has_next_item("]"):
+                    return
+        except ParseError as e:
+            raise CommandError(f"{path}: {e.detail}")
+
+    def read_document(self, path, f):
+        """Yield the features of an Overland request body or FeatureCollection."""
+        try:
+            yield from iter_json_array(f, DOCUMENT_KEYS, required=True)
+        except ParseError as e:
+            raise CommandError(f"Unrecognised JSON document in {path}: {e.detail}")
+
+    def import_chunk(self, features, totals):
+        """Validate a chunk of features and load it with COPY."""
+        batch = parse_overland_features(features, check_existing=False)
+
+        inserted_locations = copy_insert_ignore_conflicts(Location, batch["locations"])
+        inserted_visits = copy_insert_ignore_conflicts(Visit, batch["visits"])
+
+        if inserted_locations or inserted_visits:
+            times = [row["time"] for row in batch["locations"]] + [
+                row["time"] for row in batch["visits"]
+            ]
+            transaction.on_commit(lambda: invalidate_times(times))
+
+        totals["features"] += len(features)
+        totals["locations"] += inserted_locations
+        totals["visits"] += inserted_visits
+
+        self.stdout.write(
+            f"  {totals['features']} features read, {totals['locations']} "
+            f"locations and {totals['visits']} visits inserted"
+        )
@@ -0,0 +1,39 @@
+# overland_queue.py
+
+from django.core.management.base import BaseCommand
+
+from wayfinder.ingestion_queue import drain_stream, get_queue_stats, requeue_dead_letter
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the state of the Overland ingestion queue, drain it in the "
+        "foreground or requeue the batches of the dead-letter list."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--drain",
+            action="store_true",
+            help="Store the queued batches now instead of waiting for a worker",
+        )
+        parser.add_argument(
+            "--requeue-dead-letter",
+            action="store_true",
+            help="Move the batches of the dead-letter list back to the queue",
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue_dead_letter"]:
+            requeued = requeue_dead_letter()
+            self.stdout.write(f"Requeued {requeued} dead-lettered batches")
+
+        if options["drain"]:
+            processed = drain_stream()
+            self.stdout.write(f"Processed {processed} queued batches")
+
+        stats = get_queue_stats()
+        self.stdout.write(
+            f"Waiting: {stats['waiting']}, pending: {stats['pending']}, "
+            f"dead letter: {stats['dead_letter']}"
+        )
@@ -0,0 +1,36 @@
+# overland_spool.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wayfinder.spool import REPLAY_CONCURRENCY, get_spool_stats, replay_spool
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the state of the Overland ingestion spool, or replay the batches "
+        "spooled to disk while the database was unavailable."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--replay",
+            action="store_true",
+            help="Store the spooled batches now instead of waiting for a worker",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=REPLAY_CONCURRENCY,
+            help=f"Number of segments replayed at a time (default: {REPLAY_CONCURRENCY})",
+        )
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be a positive number")
+
+        if options["replay"]:
+            replayed = replay_spool(max_workers=options["concurrency"])
+            self.stdout.write(f"Replayed {replayed} spooled batches")
+
+        for name, value in get_spool_stats().items():
+            self.stdout.write(f"{name}: {value}")
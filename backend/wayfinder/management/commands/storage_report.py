@@ -0,0 +1,136 @@
+# storage_report.py
+
+import json
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+
+from wayfinder.columns import fetch_location_columns
+from wayfinder.models import Location, Visit
+from wayfinder.storage import (
+    get_column_sizes,
+    get_compression_stats,
+    get_table_size,
+)
+from wayfinder.utils import locations_to_geojson_linestring
+
+# Columns whose storage depends on the numeric types in use
+REPORTED_COLUMNS = {
+    Location: [
+        "longitude",
+        "latitude",
+        "battery_level",
+        "course",
+        "course_accuracy",
+        "speed",
+        "speed_accuracy",
+    ],
+    Visit: ["longitude", "latitude", "battery_level"],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the size of the Location and Visit tables and the time taken "
+        "by the trips query over the most recent data. Run it before and "
+        "after a storage change (e.g. migrations) and compare the --json "
+        "output."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=7,
+            help="Days of the most recent data queried (default: 7)",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Runs of the trips query, the median is reported (default: 5)",
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Print the report as JSON"
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 1 or options["repeat"] < 1:
+            raise CommandError("--days and --repeat must be positive numbers")
+
+        report = {"tables": {}, "trips_query": self.time_trips_query(options)}
+
+        for model, columns in REPORTED_COLUMNS.items():
+            table = model._meta.db_table
+            rows, size = get_table_size(connection, table)
+            report["tables"][table] = {
+                "rows": rows,
+                "bytes": size,
+                "bytes_per_row": round(size / rows, 1) if rows else None,
+                "column_bytes": get_column_sizes(connection, table, columns),
+                "compression": get_compression_stats(connection, table),
+            }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        for table, stats in report["tables"].items():
+            self.stdout.write(
+                f"{table}: {stats['rows']} rows, {stats['bytes'] / 1024 / 1024:.1f} MB "
+                f"({stats['bytes_per_row']} bytes/row)"
+            )
+            for column, average in stats["column_bytes"].items():
+                self.stdout.write(f"  {column}: {average} bytes")
+            if stats["compression"] is not None:
+                self.stdout.write(
+                    f"  {stats['compression']['compressed_chunks']} of "
+                    f"{stats['compression']['chunks']} chunks compressed"
+                )
+
+        trips = report["trips_query"]
+        self.stdout.write(
+            f"Trips query over {trips['days']} days: {trips['points']} points in "
+            f"{trips['query_ms']} ms, GeoJSON built in {trips['build_ms']} ms"
+        )
+
+    def time_trips_query(self, options):
+        """
+        Time the raw trips query of ``TripsView`` and the GeoJSON conversion
+        of its result, over the last ``--days`` of data.
+        """
+        end = Location.objects.aggregate(end=Max("time"))["end"]
+        if end is None:
+            return {"days": options["days"], "points": 0, "query_ms": 0, "build_ms": 0}
+
+        query = (
+            Location.objects.filter(
+                time__range=[end - timedelta(days=options["days"]), end]
+            )
+            .filter(moving=True)
+            .order_by("time")
+        )
+
+        query_times = []
+        build_times = []
+
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            points = fetch_location_columns(query)
+            query_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            if points:
+                locations_to_geojson_linestring("trip_001", points)
+            build_times.append(time.perf_counter() - started)
+
+        return {
+            "days": options["days"],
+            "points": len(points),
+            "query_ms": round(statistics.median(query_times) * 1000, 1),
+            "build_ms": round(statistics.median(build_times) * 1000, 1),
+        }
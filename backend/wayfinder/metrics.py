@@ -0,0 +1,403 @@
+# metrics.py
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import redis
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Latency buckets in seconds, from a 10-point batch to a large import
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+# Device ids beyond this many are counted as "other" to bound the label set
+MAX_DEVICE_LABELS = int(os.getenv("METRICS_MAX_DEVICES", "50"))
+
+# Bearer token Prometheus sends to read /metrics/ (staff users only when empty)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Seconds between two flushes of a process' updates to the totals in Redis,
+# by a background thread (0 to only flush at the end of the Celery tasks and
+# when /metrics/ is read)
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_SECONDS", "10"))
+
+# Hash holding the totals of a metric, added up over every web and Celery
+# worker process
+REDIS_KEY = "wayfinder:metrics:{}"
+
+
+# Every metric, in the order they are rendered
+REGISTRY = []
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _number(value):
+    """An int or float read back from a Redis hash."""
+    value = value.decode()
+    return float(value) if "." in value or "e" in value else int(value)
+
+
+class Metric:
+    """
+    Metric exported in the Prometheus text format.
+
+    Updates only take an uncontended lock and a dict lookup, so instrumenting
+    the ingestion hot path costs a few microseconds per batch.  They are kept
+    in process and added to the totals in Redis every ``FLUSH_INTERVAL``
+    seconds by a thread of the process (see ``flush_metrics``), never by the
+    request updating them, so /metrics/ exports the sum over every web and
+    Celery worker.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def _updated(self):
+        # Worker processes are forked after the metrics are created, so each
+        # starts its flush thread with its first update
+        if _flusher_pid != os.getpid():
+            _start_flusher()
+
+    def take(self):
+        """Return the updates since the last flush, and forget them."""
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    def restore(self, values):
+        """Put back updates taken by ``take`` that could not be flushed."""
+        with self.lock:
+            for key, value in values.items():
+                self.merge(self.values, key, value)
+
+    def merge(self, values, key, value):
+        raise NotImplementedError
+
+    def fields(self, values):
+        """Yield the ``(field, amount)`` increments of the Redis hash."""
+        raise NotImplementedError
+
+    def load(self, fields):
+        """Values in the shape of ``values`` from the Redis hash."""
+        raise NotImplementedError
+
+    def samples(self, values):
+        """Yield ``(suffix, labelnames, labelvalues, value)`` tuples."""
+        raise NotImplementedError
+
+    def render(self, values=None):
+        """Render ``values``, or the updates of this process when None."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        if values is None:
+            with self.lock:
+                samples = list(self.samples(self.values))
+        else:
+            samples = list(self.samples(values))
+        for suffix, names, values, value in samples:
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(names, values)} "
+                f"{_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self._updated()
+
+    def merge(self, values, key, value):
+        values[key] = values.get(key, 0) + value
+
+    def fields(self, values):
+        for key, value in values.items():
+            yield json.dumps(key), value
+
+    def load(self, fields):
+        return {
+            tuple(json.loads(field)): _number(value) for field, value in fields.items()
+        }
+
+    def samples(self, values):
+        for key, value in values.items():
+            yield "_total", self.labelnames, key, value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), sum
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+        self._updated()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def merge(self, values, key, value):
+        state = values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+        for index, count in enumerate(value[0]):
+            state[0][index] += count
+        state[1] += value[1]
+
+    def fields(self, values):
+        # One field per bucket count (by index) and one for the sum
+        for key, (counts, total) in values.items():
+            for index, count in enumerate(counts):
+                if count:
+                    yield json.dumps([key, index]), count
+            yield json.dumps([key, "sum"]), total
+
+    def load(self, fields):
+        values = {}
+        for field, value in fields.items():
+            key, index = json.loads(field)
+            state = values.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0])
+            if index == "sum":
+                state[1] = _number(value)
+            else:
+                state[0][index] = _number(value)
+        return values
+
+    def samples(self, values):
+        names = self.labelnames + ("le",)
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield "_bucket", names, key + (bound,), cumulative
+            yield "_sum", self.labelnames, key, total
+            yield "_count", self.labelnames, key, cumulative
+
+
+# ---------------------------------------------------------------------------- #
+#                               INGESTION METRICS                              #
+# ---------------------------------------------------------------------------- #
+
+STAGE_SECONDS = Histogram(
+    "wayfinder_overland_stage_seconds",
+    "Time spent in each stage of Overland ingestion, per batch",
+    ["stage"],
+)
+
+REQUESTS = Counter(
+    "wayfinder_overland_requests",
+    "Overland requests by HTTP status",
+    ["status"],
+)
+
+POINTS_RECEIVED = Counter(
+    "wayfinder_overland_points_received",
+    "Overland features received",
+)
+
+POINTS_INSERTED = Counter(
+    "wayfinder_overland_points_inserted",
+    "Overland features stored",
+    ["kind"],
+)
+
+POINTS_DUPLICATE = Counter(
+    "wayfinder_overland_points_duplicate",
+    "Overland features skipped because their timestamp was already stored or repeated",
+    ["kind"],
+)
+
+POINTS_INVALID = Counter(
+    "wayfinder_overland_points_invalid",
+    "Overland features that failed validation",
+    ["kind"],
+)
+
+DEVICE_POINTS = Counter(
+    "wayfinder_overland_device_points",
+    "Overland features received per device_id",
+    ["device_id"],
+)
+
+_device_labels = set()
+
+
+def count_device_points(device_counts):
+    """Add ``{device_id: count}`` to the per-device counter."""
+    for device_id, count in device_counts.items():
+        if device_id not in _device_labels:
+            if len(_device_labels) >= MAX_DEVICE_LABELS:
+                device_id = "other"
+            else:
+                _device_labels.add(device_id)
+        DEVICE_POINTS.inc(count, device_id=device_id)
+
+
+# ---------------------------------------------------------------------------- #
+#                             RESPONSE CACHE METRICS                           #
+# ---------------------------------------------------------------------------- #
+
+RESPONSE_CACHE_REQUESTS = Counter(
+    "wayfinder_response_cache_requests",
+    "Trips and visits requests by response cache result: hit, miss or bypass "
+    "(not cacheable)",
+    ["view", "result"],
+)
+
+RESPONSE_CACHE_INVALIDATIONS = Counter(
+    "wayfinder_response_cache_invalidations",
+    "Cached responses deleted because rows were stored in their range",
+)
+
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _start_flusher():
+    """Start the thread flushing the metrics of this process, once."""
+    global _flusher_pid
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        if FLUSH_INTERVAL > 0:
+            threading.Thread(
+                target=_flush_periodically, name="metrics-flush", daemon=True
+            ).start()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush_metrics()
+        except Exception as e:
+            log.warning(f"Could not flush the metrics: {e}")
+
+
+def flush_metrics():
+    """
+    Add the updates of this process to the totals in Redis.  Called every
+    ``FLUSH_INTERVAL`` seconds by the flush thread of the process, at the end
+    of the Celery tasks, and before /metrics/ is rendered.  When Redis is
+    unavailable the updates are kept for the next flush.  Returns whether
+    they were flushed.
+    """
+    # Imported here to avoid a circular import with ingestion_queue.py
+    from .ingestion_queue import get_redis
+
+    taken = [(metric, metric.take()) for metric in REGISTRY]
+    try:
+        with get_redis().pipeline() as pipe:
+            for metric, values in taken:
+                for field, amount in metric.fields(values):
+                    if isinstance(amount, float):
+                        pipe.hincrbyfloat(REDIS_KEY.format(metric.name), field, amount)
+                    else:
+                        pipe.hincrby(REDIS_KEY.format(metric.name), field, amount)
+            pipe.execute()
+    except redis.RedisError as e:
+        log.warning(f"Could not flush the metrics to Redis: {e}")
+        for metric, values in taken:
+            metric.restore(values)
+        return False
+
+    return True
+
+
+def render_metrics():
+    """
+    Return every metric in the Prometheus text exposition format, with the
+    totals of every process.  Only the updates of this process since its
+    last flush are rendered when Redis is unavailable.
+    """
+    # Imported here to avoid a circular import with ingestion_queue.py
+    from .ingestion_queue import get_redis
+
+    if flush_metrics():
+        try:
+            with get_redis().pipeline(transaction=False) as pipe:
+                for metric in REGISTRY:
+                    pipe.hgetall(REDIS_KEY.format(metric.name))
+                totals = pipe.execute()
+        except redis.RedisError as e:
+            log.warning(f"Could not read the metrics from Redis: {e}")
+        else:
+            return (
+                "\n".join(
+                    metric.render(metric.load(fields))
+                    for metric, fields in zip(REGISTRY, totals)
+                )
+                + "\n"
+            )
+
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
@@ -0,0 +1,127 @@
+# Migrate Location and Visit coordinates and sensor readings from numeric
+# columns to double precision, real and smallint.
+#
+# The hypertables are not rewritten with ALTER COLUMN ... TYPE, which would
+# lock them for the whole rewrite. Rows are copied one day at a time to a new
+# table with the compact types instead, and the new table is swapped in with
+# a short lock (see wayfinder.storage). The migration is not atomic so the
+# copy can run while Overland keeps posting; if it is interrupted, running
+# it again resumes the copy.
+
+from django.db import migrations, models
+
+import wayfinder.models
+from wayfinder.storage import change_column_types
+
+COMPACT_COLUMNS = {
+    "wayfinder_location": {
+        "longitude": "double precision",
+        "latitude": "double precision",
+        "battery_level": "real",
+        "course": "smallint",
+        "course_accuracy": "real",
+        "speed": "smallint",
+        "speed_accuracy": "real",
+    },
+    "wayfinder_visit": {
+        "longitude": "double precision",
+        "latitude": "double precision",
+        "battery_level": "real",
+    },
+}
+
+DECIMAL_COLUMNS = {
+    "wayfinder_location": {
+        "longitude": "numeric(20, 17)",
+        "latitude": "numeric(20, 17)",
+        "battery_level": "numeric(3, 2)",
+        "course": "integer",
+        "course_accuracy": "numeric(5, 2)",
+        "speed": "integer",
+        "speed_accuracy": "numeric(5, 2)",
+    },
+    "wayfinder_visit": {
+        "longitude": "numeric(20, 17)",
+        "latitude": "numeric(20, 17)",
+        "battery_level": "numeric(3, 2)",
+    },
+}
+
+
+def compact_columns(apps, schema_editor):
+    for table, columns in COMPACT_COLUMNS.items():
+        change_column_types(schema_editor.connection, table, columns)
+
+
+def restore_decimal_columns(apps, schema_editor):
+    for table, columns in DECIMAL_COLUMNS.items():
+        change_column_types(schema_editor.connection, table, columns)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("wayfinder", "0010_add_partial_to_dailyactivitysummary"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(compact_columns, restore_decimal_columns),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="location",
+                    name="longitude",
+                    field=models.FloatField(),
+                ),
+                migrations.AlterField(
+                    model_name="location",
+                    name="latitude",
+                    field=models.FloatField(),
+                ),
+                migrations.AlterField(
+                    model_name="location",
+                    name="battery_level",
+                    field=wayfinder.models.RealField(),
+                ),
+                migrations.AlterField(
+                    model_name="location",
+                    name="course",
+                    field=models.SmallIntegerField(),
+                ),
+                migrations.AlterField(
+                    model_name="location",
+                    name="course_accuracy",
+                    field=wayfinder.models.RealField(),
+                ),
+                migrations.AlterField(
+                    model_name="location",
+                    name="speed",
+                    field=models.SmallIntegerField(),
+                ),
+                migrations.AlterField(
+                    model_name="location",
+                    name="speed_accuracy",
+                    field=wayfinder.models.RealField(),
+                ),
+                migrations.AlterField(
+                    model_name="visit",
+                    name="longitude",
+                    field=models.FloatField(),
+                ),
+                migrations.AlterField(
+                    model_name="visit",
+                    name="latitude",
+                    field=models.FloatField(),
+                ),
+                migrations.AlterField(
+                    model_name="visit",
+                    name="battery_level",
+                    field=wayfinder.models.RealField(),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Enable TimescaleDB native compression of the Location and Visit hypertables,
+# with a policy that compresses chunks older than COMPRESS_AFTER_DAYS (see
+# wayfinder.storage). Does nothing on a database without TimescaleDB.
+#
+# Not atomic: reverting decompresses the chunks one at a time.
+
+from django.db import migrations
+
+from wayfinder.storage import (
+    COMPRESS_AFTER,
+    COMPRESSION_SETTINGS,
+    disable_compression,
+    enable_compression,
+)
+
+
+def compress_tables(apps, schema_editor):
+    for table, settings in COMPRESSION_SETTINGS.items():
+        enable_compression(
+            schema_editor.connection, table, compress_after=COMPRESS_AFTER, **settings
+        )
+
+
+def decompress_tables(apps, schema_editor):
+    for table in COMPRESSION_SETTINGS:
+        disable_compression(schema_editor.connection, table)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("wayfinder", "0011_compact_numeric_columns"),
+    ]
+
+    operations = [
+        migrations.RunPython(compress_tables, decompress_tables),
+    ]
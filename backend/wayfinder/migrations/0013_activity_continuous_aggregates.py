@@ -0,0 +1,98 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:04
+
+#
+# Replace the DailyActivitySummary table, filled by a nightly Celery task, with
+# continuous aggregates of the location and visit counts per 15 minutes (see
+# wayfinder.aggregates), rolled up per day by ActivityHistoryView. Not atomic:
+# continuous aggregates can't be created in a transaction.
+
+from django.db import migrations, models
+
+from wayfinder.aggregates import (
+    ACTIVITY_AGGREGATES,
+    ACTIVITY_BUCKET,
+    create_continuous_aggregate,
+    drop_continuous_aggregate,
+)
+
+
+def create_activity_aggregates(apps, schema_editor):
+    for view, (table, aggregates) in ACTIVITY_AGGREGATES.items():
+        create_continuous_aggregate(
+            schema_editor.connection, view, table, aggregates, ACTIVITY_BUCKET
+        )
+
+
+def drop_activity_aggregates(apps, schema_editor):
+    for view in ACTIVITY_AGGREGATES:
+        drop_continuous_aggregate(schema_editor.connection, view)
+
+
+def remove_activity_summary_task(apps, schema_editor):
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    PeriodicTask.objects.filter(name="compute-daily-activity-summary").delete()
+
+
+def restore_activity_summary_task(apps, schema_editor):
+    # The beat schedule entry removed with this migration, so the summary is
+    # computed every night again without waiting for celery beat to restart
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    schedule, _ = CrontabSchedule.objects.get_or_create(
+        minute="0",
+        hour="4",
+        day_of_week="*",
+        day_of_month="*",
+        month_of_year="*",
+    )
+    PeriodicTask.objects.get_or_create(
+        name="compute-daily-activity-summary",
+        defaults={
+            "task": "wayfinder.tasks.compute_daily_activity_summary",
+            "crontab": schedule,
+        },
+    )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("wayfinder", "0012_compress_location_and_visit_chunks"),
+        ("django_celery_beat", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_activity_aggregates, drop_activity_aggregates),
+        migrations.CreateModel(
+            name="LocationActivity",
+            fields=[
+                ("bucket", models.DateTimeField(primary_key=True, serialize=False)),
+                ("location_count", models.BigIntegerField()),
+            ],
+            options={
+                "verbose_name_plural": "location activity",
+                "db_table": "wayfinder_location_activity",
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="VisitActivity",
+            fields=[
+                ("bucket", models.DateTimeField(primary_key=True, serialize=False)),
+                ("visit_count", models.BigIntegerField()),
+            ],
+            options={
+                "verbose_name_plural": "visit activity",
+                "db_table": "wayfinder_visit_activity",
+                "managed": False,
+            },
+        ),
+        migrations.RunPython(
+            remove_activity_summary_task, reverse_code=restore_activity_summary_task
+        ),
+        migrations.DeleteModel(
+            name="DailyActivitySummary",
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:07
+
+#
+# Downsampled trip tiers (10 s, 1 min, 15 min and 1 h) kept as hierarchical
+# continuous aggregates of the moving locations (see wayfinder.aggregates).
+# Not atomic: continuous aggregates can't be created in a transaction.
+
+from django.db import migrations, models
+
+from wayfinder.aggregates import create_trip_tiers, drop_trip_tiers
+
+
+def create_tiers(apps, schema_editor):
+    create_trip_tiers(schema_editor.connection)
+
+
+def drop_tiers(apps, schema_editor):
+    drop_trip_tiers(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("wayfinder", "0013_activity_continuous_aggregates"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_tiers, drop_tiers),
+        migrations.CreateModel(
+            name="TripPoints10s",
+            fields=[
+                ("bucket", models.DateTimeField(primary_key=True, serialize=False)),
+                ("time", models.DateTimeField()),
+                ("longitude", models.FloatField()),
+                ("latitude", models.FloatField()),
+                ("points", models.BigIntegerField()),
+            ],
+            options={
+                "verbose_name_plural": "trip points (10 seconds)",
+                "db_table": "wayfinder_trip_points_10s",
+                "abstract": False,
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="TripPoints15m",
+            fields=[
+                ("bucket", models.DateTimeField(primary_key=True, serialize=False)),
+                ("time", models.DateTimeField()),
+                ("longitude", models.FloatField()),
+                ("latitude", models.FloatField()),
+                ("points", models.BigIntegerField()),
+            ],
+            options={
+                "verbose_name_plural": "trip points (15 minutes)",
+                "db_table": "wayfinder_trip_points_15m",
+                "abstract": False,
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="TripPoints1h",
+            fields=[
+                ("bucket", models.DateTimeField(primary_key=True, serialize=False)),
+                ("time", models.DateTimeField()),
+                ("longitude", models.FloatField()),
+                ("latitude", models.FloatField()),
+                ("points", models.BigIntegerField()),
+            ],
+            options={
+                "verbose_name_plural": "trip points (1 hour)",
+                "db_table": "wayfinder_trip_points_1h",
+                "abstract": False,
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="TripPoints1m",
+            fields=[
+                ("bucket", models.DateTimeField(primary_key=True, serialize=False)),
+                ("time", models.DateTimeField()),
+                ("longitude", models.FloatField()),
+                ("latitude", models.FloatField()),
+                ("points", models.BigIntegerField()),
+            ],
+            options={
+                "verbose_name_plural": "trip points (1 minute)",
+                "db_table": "wayfinder_trip_points_1m",
+                "abstract": False,
+                "managed": False,
+            },
+        ),
+    ]
@@ -0,0 +1,127 @@
+# Store the motions of each location as a bitmask and a moving flag, so trip
+# queries can use a partial index instead of scanning the JSONB motion column.
+#
+# The columns keep a database default, so adding them doesn't rewrite the
+# hypertable. Existing rows are then backfilled one day at a time (see
+# wayfinder.storage.update_in_windows). Not atomic, so the backfill doesn't
+# lock the whole table; if it is interrupted, running it again resumes.
+#
+# Compressed chunks (see 0012) are decompressed first, since the backfill
+# updates and the new index need the rows uncompressed, and compressed again
+# at the end. This needs room for the whole uncompressed table. If the
+# migration is interrupted in between, compression stays disabled: enable it
+# again with `manage.py compression --enable --now`.
+
+from django.db import migrations, models
+
+from wayfinder.storage import (
+    COMPRESS_AFTER,
+    COMPRESSION_SETTINGS,
+    compress_chunks,
+    compression_enabled,
+    disable_compression,
+    enable_compression,
+    update_in_windows,
+)
+
+# MOTION_BITS of wayfinder.models when this migration was written
+MOTION_BITS = {
+    "driving": 1,
+    "walking": 2,
+    "running": 4,
+    "cycling": 8,
+    "stationary": 16,
+}
+
+MOTION_MASK_SQL = (
+    "("
+    + " | ".join(
+        f"(CASE WHEN motion @> '\"{name}\"'::jsonb THEN {bit} ELSE 0 END)"
+        for name, bit in MOTION_BITS.items()
+    )
+    + ")::smallint"
+)
+
+MOVING_SQL = "motion <> '[]'::jsonb AND NOT motion @> '\"stationary\"'::jsonb"
+
+# Whether decompress_location found compression enabled, to restore it
+_was_compressed = []
+
+
+def decompress_location(apps, schema_editor):
+    if compression_enabled(schema_editor.connection, "wayfinder_location"):
+        disable_compression(schema_editor.connection, "wayfinder_location")
+        _was_compressed.append(True)
+
+
+def restore_compression(apps, schema_editor):
+    if not _was_compressed:
+        return
+
+    enable_compression(
+        schema_editor.connection,
+        "wayfinder_location",
+        compress_after=COMPRESS_AFTER,
+        **COMPRESSION_SETTINGS["wayfinder_location"],
+    )
+    compress_chunks(schema_editor.connection, "wayfinder_location")
+
+
+def backfill_motion_mask(apps, schema_editor):
+    # Rows without motion already have the right defaults
+    update_in_windows(
+        schema_editor.connection,
+        "wayfinder_location",
+        f"motion_mask = {MOTION_MASK_SQL}, moving = {MOVING_SQL}",
+        where=(
+            f"motion <> '[]'::jsonb AND "
+            f"(motion_mask <> {MOTION_MASK_SQL} OR moving <> ({MOVING_SQL}))"
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("wayfinder", "0014_trip_tiers"),
+    ]
+
+    operations = [
+        migrations.RunPython(decompress_location, restore_compression),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    "ALTER TABLE wayfinder_location "
+                    "ADD COLUMN IF NOT EXISTS motion_mask smallint NOT NULL DEFAULT 0, "
+                    "ADD COLUMN IF NOT EXISTS moving boolean NOT NULL DEFAULT false",
+                    "ALTER TABLE wayfinder_location "
+                    "DROP COLUMN IF EXISTS motion_mask, DROP COLUMN IF EXISTS moving",
+                ),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name="location",
+                    name="motion_mask",
+                    field=models.SmallIntegerField(default=0),
+                ),
+                migrations.AddField(
+                    model_name="location",
+                    name="moving",
+                    field=models.BooleanField(default=False),
+                ),
+            ],
+        ),
+        migrations.RunPython(backfill_motion_mask, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="location",
+            index=models.Index(
+                condition=models.Q(("moving", True)),
+                fields=["time"],
+                include=("longitude", "latitude"),
+                name="wayfinder_location_moving_idx",
+            ),
+        ),
+        migrations.RunPython(restore_compression, decompress_location),
+    ]
@@ -1,10 +1,47 @@
 # models.py
 
+from datetime import timedelta
+
 from django.db import models
 from django.contrib.auth.models import User
 from timescale.db.models.fields import TimescaleDateTimeField
 from timescale.db.models.managers import TimescaleManager
 
+# Bit of each Overland motion in Location.motion_mask
+MOTION_BITS = {
+    "driving": 1,
+    "walking": 2,
+    "running": 4,
+    "cycling": 8,
+    "stationary": 16,
+}
+
+
+def get_motion_mask(motion):
+    """Return the ``motion_mask`` of a list of Overland motions."""
+    mask = 0
+    for name in motion or []:
+        mask |= MOTION_BITS.get(name, 0)
+    return mask
+
+
+def is_moving(motion):
+    """
+    Return True when a location with these motions is part of a trip: it has
+    a motion, and it isn't stationary.
+    """
+    return bool(motion) and "stationary" not in motion
+
+
+class RealField(models.FloatField):
+    """
+    Single precision (4 bytes) float, for sensor readings that don't need
+    the 15 significant digits of a FloatField.
+    """
+
+    def db_type(self, connection):
+        return "real"
+
 
 class TimescaleModel(models.Model):
     """
@@ -29,9 +66,9 @@ class Location(TimescaleModel):
 
     # time = TimescaleDateTimeField(interval="1 day")
 
-    longitude = models.DecimalField(max_digits=20, decimal_places=17)
+    longitude = models.FloatField()
 
-    latitude = models.DecimalField(max_digits=20, decimal_places=17)
+    latitude = models.FloatField()
 
     # Properties
 
@@ -39,16 +76,16 @@ class Location(TimescaleModel):
     altitude = models.IntegerField()
 
     # The iPhone's battery level, between 0.00 and 1.00
-    battery_level = models.DecimalField(max_digits=3, decimal_places=2)
+    battery_level = RealField()
 
     # The iPhone's battery state, it can be 'charging', 'full', 'unplugged', or 'unknown'
     battery_state = models.CharField(max_length=20)
 
     # Direction of travel in degrees (-1 if speed unknown)
-    course = models.IntegerField()
+    course = models.SmallIntegerField()
 
     # The accuracy of the course in degrees (-1 if speed is unknown)
-    course_accuracy = models.DecimalField(max_digits=5, decimal_places=2)
+    course_accuracy = RealField()
 
     # The device id set in Overland settings or an empty string if not set
     device_id = models.CharField(max_length=50, blank=True, default="")
@@ -60,11 +97,17 @@ class Location(TimescaleModel):
     # Note that you can have several such as driving and stationary
     motion = models.JSONField()
 
+    # The motions as a bitmask of MOTION_BITS, derived from motion
+    motion_mask = models.SmallIntegerField(default=0)
+
+    # Whether the location is part of a trip (see is_moving), derived from motion
+    moving = models.BooleanField(default=False)
+
     # The speed in meters per seocond (-1 if unknown)
-    speed = models.IntegerField()
+    speed = models.SmallIntegerField()
 
     # The accuracy of the speed in meters per second (-1 if speed is unknown)
-    speed_accuracy = models.DecimalField(max_digits=5, decimal_places=2)
+    speed_accuracy = RealField()
 
     # The timestamp of the location
     # Set to the Timescale's time field
@@ -79,6 +122,22 @@ class Location(TimescaleModel):
     # Wifi SSID if connected to a wifi network, an empty string if not connected
     wifi = models.CharField(max_length=100, blank=True)
 
+    class Meta:
+        indexes = [
+            # Trip queries read the moving locations of a time range, in order
+            models.Index(
+                fields=["time"],
+                include=["longitude", "latitude"],
+                condition=models.Q(moving=True),
+                name="wayfinder_location_moving_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.motion_mask = get_motion_mask(self.motion)
+        self.moving = is_moving(self.motion)
+        super().save(*args, **kwargs)
+
 
 class Visit(TimescaleModel):
     """
@@ -88,9 +147,9 @@ class Visit(TimescaleModel):
 
     # time = TimescaleDateTimeField(interval="1 day")
 
-    longitude = models.DecimalField(max_digits=20, decimal_places=17)
+    longitude = models.FloatField()
 
-    latitude = models.DecimalField(max_digits=20, decimal_places=17)
+    latitude = models.FloatField()
 
     # Properties
 
@@ -101,7 +160,7 @@ class Visit(TimescaleModel):
     arrival_date = models.DateTimeField()
 
     # The iPhone's battery level, between 0.00 and 1.00
-    battery_level = models.DecimalField(max_digits=3, decimal_places=2)
+    battery_level = RealField()
 
     # The iPhone's battery state, it can be 'charging', 'full', 'unplugged', or 'unknown'
     battery_state = models.CharField(max_length=20)
@@ -154,23 +213,93 @@ class UserSettings(models.Model):
         return f"{self.user.username} settings"
 
 
-class DailyActivitySummary(models.Model):
+class LocationActivity(models.Model):
     """
-    Pre-computed daily counts of locations and visits, grouped by date in a
-    specific timezone.  Populated by the celery task
-    ``wayfinder.tasks.compute_daily_activity_summary``.
+    Number of locations recorded in each 15-minute bucket, kept up to date
+    by a TimescaleDB continuous aggregate (see ``wayfinder.aggregates``).
+    Read-only.
     """
 
-    date = models.DateField()
-    timezone = models.CharField(max_length=63)
-    location_count = models.IntegerField(default=0)
-    visit_count = models.IntegerField(default=0)
-    computed_at = models.DateTimeField(auto_now=True)
-    partial = models.BooleanField(default=False)
+    bucket = models.DateTimeField(primary_key=True)
+    location_count = models.BigIntegerField()
 
     class Meta:
-        unique_together = ("date", "timezone")
-        ordering = ["date"]
+        managed = False
+        db_table = "wayfinder_location_activity"
+        verbose_name_plural = "location activity"
 
-    def __str__(self):
-        return f"{self.date} ({self.timezone}): {self.location_count} locs, {self.visit_count} visits"
+
+class VisitActivity(models.Model):
+    """
+    Number of visits recorded in each 15-minute bucket, kept up to date by
+    a TimescaleDB continuous aggregate (see ``wayfinder.aggregates``).
+    Read-only.
+    """
+
+    bucket = models.DateTimeField(primary_key=True)
+    visit_count = models.BigIntegerField()
+
+    class Meta:
+        managed = False
+        db_table = "wayfinder_visit_activity"
+        verbose_name_plural = "visit activity"
+
+
+class TripPoints(models.Model):
+    """
+    Downsampled trip locations: the first moving location of each bucket of
+    ``bucket_width`` (``bucket_size`` as an interval) and the number of
+    moving locations it stands for.  Kept
+    up to date by TimescaleDB continuous aggregates (see
+    ``wayfinder.aggregates.create_trip_tiers``).  Read-only.
+    """
+
+    bucket = models.DateTimeField(primary_key=True)
+    time = models.DateTimeField()
+    longitude = models.FloatField()
+    latitude = models.FloatField()
+    points = models.BigIntegerField()
+
+    class Meta:
+        abstract = True
+        managed = False
+
+
+class TripPoints10s(TripPoints):
+    bucket_width = timedelta(seconds=10)
+    bucket_size = "10 seconds"
+
+    class Meta(TripPoints.Meta):
+        db_table = "wayfinder_trip_points_10s"
+        verbose_name_plural = "trip points (10 seconds)"
+
+
+class TripPoints1m(TripPoints):
+    bucket_width = timedelta(minutes=1)
+    bucket_size = "1 minute"
+
+    class Meta(TripPoints.Meta):
+        db_table = "wayfinder_trip_points_1m"
+        verbose_name_plural = "trip points (1 minute)"
+
+
+class TripPoints15m(TripPoints):
+    bucket_width = timedelta(minutes=15)
+    bucket_size = "15 minutes"
+
+    class Meta(TripPoints.Meta):
+        db_table = "wayfinder_trip_points_15m"
+        verbose_name_plural = "trip points (15 minutes)"
+
+
+class TripPoints1h(TripPoints):
+    bucket_width = timedelta(hours=1)
+    bucket_size = "1 hour"
+
+    class Meta(TripPoints.Meta):
+        db_table = "wayfinder_trip_points_1h"
+        verbose_name_plural = "trip points (1 hour)"
+
+
+# Trip tiers from the finest to the coarsest
+TRIP_TIERS = [TripPoints10s, TripPoints1m, TripPoints15m, TripPoints1h]
@@ -0,0 +1,164 @@
+# pagination.py
+
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import redis
+from dateutil import parser as date_parser
+from django.core import signing
+from django.utils import timezone
+
+from .ingestion_queue import get_redis
+
+log = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Seconds a next_cursor stays valid. The state it carries (totals, visit
+# midtimes) is reused as is until then, without looking at new data.
+CURSOR_MAX_AGE = int(os.getenv("TRIP_CURSOR_MAX_AGE", "3600"))
+
+# Visit midtimes carried in the cursor itself, more are kept in Redis for
+# CURSOR_MAX_AGE and the cursor carries their key
+CURSOR_MAX_MIDTIMES = int(os.getenv("TRIP_CURSOR_MAX_MIDTIMES", "200"))
+
+CURSOR_SALT = "wayfinder.pagination.cursor"
+MIDTIMES_KEY = "wayfinder:trips:midtimes:{}"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _fingerprint(query):
+    """Short digest of the request parameters a cursor is valid for."""
+    payload = json.dumps(query, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _to_microseconds(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_microseconds(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _pack_midtimes(midtimes):
+    """Sorted datetimes as microsecond deltas, which compress well."""
+    packed = []
+    previous = 0
+    for midtime in midtimes:
+        value = _to_microseconds(midtime)
+        packed.append(value - previous)
+        previous = value
+    return packed
+
+
+def _unpack_midtimes(packed):
+    midtimes = []
+    value = 0
+    for delta in packed:
+        value += delta
+        midtimes.append(_from_microseconds(value))
+    return midtimes
+
+
+def _store_midtimes(packed):
+    """Keep ``packed`` midtimes in Redis, return their key or None."""
+    key = MIDTIMES_KEY.format(uuid.uuid4().hex)
+    try:
+        get_redis().set(key, json.dumps(packed), ex=CURSOR_MAX_AGE)
+    except redis.RedisError as e:
+        log.warning(f"Could not store the visit midtimes of a cursor: {e}")
+        return None
+    return key
+
+
+def _load_midtimes(key):
+    """Return the packed midtimes stored at ``key``, or None if gone."""
+    try:
+        packed = get_redis().get(key)
+    except redis.RedisError as e:
+        log.warning(f"Could not load the visit midtimes of a cursor: {e}")
+        return None
+    return json.loads(packed) if packed is not None else None
+
+
+def encode_cursor(time, query, midtimes=None, **state):
+    """
+    Return the signed ``next_cursor`` of a page ending at ``time``.
+
+    The cursor is only valid for requests with the same ``query`` (a dict
+    of the request parameters, without the cursor) and carries ``state``
+    resolved on the first page (totals, bucket size, trip offset) so the
+    following pages don't have to compute it again.
+
+    ``midtimes`` (sorted visit midtimes) are trimmed to the ones a later
+    page can still need: from the last one before ``time`` onwards.
+    """
+    payload = {
+        "time": _to_microseconds(time),
+        "query": _fingerprint(query),
+        **state,
+    }
+
+    if midtimes is not None:
+        start = 0
+        for i, midtime in enumerate(midtimes):
+            if midtime <= time:
+                start = i
+            else:
+                break
+        packed = _pack_midtimes(midtimes[start:])
+
+        if len(packed) <= CURSOR_MAX_MIDTIMES:
+            payload["midtimes"] = packed
+        else:
+            key = _store_midtimes(packed)
+            if key is not None:
+                payload["midtimes_key"] = key
+
+    return signing.dumps(payload, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(value, query):
+    """
+    Return the ``(time, state)`` of a cursor made by ``encode_cursor`` for
+    the same ``query``.  The state holds ``midtimes`` as datetimes when
+    they were carried and are still available.
+
+    A bare ISO datetime, as returned before cursors carried any state, is
+    still accepted with an empty state.  Naive datetimes are read in the
+    default timezone.  Raises ValueError for anything else, including
+    expired or tampered cursors and cursors of other requests.
+    """
+    try:
+        state = signing.loads(value, salt=CURSOR_SALT, max_age=CURSOR_MAX_AGE)
+    except signing.BadSignature:
+        try:
+            time = date_parser.isoparse(value)
+        except (ValueError, OverflowError):
+            raise ValueError("Invalid or expired cursor")
+        if timezone.is_naive(time):
+            time = timezone.make_aware(time)
+        return time, {}
+
+    if state.pop("query", None) != _fingerprint(query):
+        raise ValueError("Cursor of a request with other parameters")
+
+    time = _from_microseconds(state.pop("time"))
+
+    packed = state.pop("midtimes", None)
+    key = state.pop("midtimes_key", None)
+    if packed is None and key is not None:
+        packed = _load_midtimes(key)
+    if packed is not None:
+        state["midtimes"] = _unpack_midtimes(packed)
+
+    return time, state
@@ -0,0 +1,330 @@
+# parsers.py
+
+import codecs
+import json
+import logging
+import os
+import zlib
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError, UnsupportedMediaType
+from rest_framework.parsers import BaseParser
+from rest_framework.settings import api_settings
+from rest_framework.utils import json as drf_json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Maximum size of an Overland request body, once decompressed
+MAX_DECOMPRESSED_SIZE = int(os.getenv("OVERLAND_MAX_BODY_MB", "32")) * 1024 * 1024
+
+# Number of (compressed) bytes read from the request at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+# Whitespace allowed between JSON tokens
+JSON_WHITESPACE = " \t\n\r"
+
+
+class RequestTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Request body is too large."
+    default_code = "request_too_large"
+
+
+class ZlibReader:
+    """
+    File-like reader decompressing a gzip or deflate stream.
+
+    Output is produced at most ``size`` bytes at a time, so a small body that
+    expands to gigabytes is never decompressed in one go.
+    """
+
+    def __init__(self, stream, encoding):
+        self.stream = stream
+        self.encoding = encoding
+        self.decompressor = self._new_decompressor()
+        self.pending = b""
+        self.started = False
+
+    def _new_decompressor(self, raw=False):
+        if self.encoding == "gzip":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # "deflate" should be zlib-wrapped, but some clients send raw deflate
+        return zlib.decompressobj(-zlib.MAX_WBITS if raw else zlib.MAX_WBITS)
+
+    def read(self, size):
+        while True:
+            if self.pending:
+                try:
+                    data = self.decompressor.decompress(self.pending, size)
+                except zlib.error:
+                    if self.encoding == "deflate" and not self.started:
+                        self.decompressor = self._new_decompressor(raw=True)
+                        self.started = True
+                        continue
+                    raise
+                self.started = True
+                self.pending = self.decompressor.unconsumed_tail
+
+                # Concatenated gzip members
+                if self.decompressor.eof and self.decompressor.unused_data:
+                    self.pending = self.decompressor.unused_data
+                    self.decompressor = self._new_decompressor()
+
+                if data:
+                    return data
+
+            chunk = self.stream.read(READ_CHUNK_SIZE)
+            if not chunk:
+                if self.started and not self.decompressor.eof:
+                    raise zlib.error("compressed body is truncated")
+                return b""
+            self.pending = chunk
+
+
+class DecompressingStream:
+    """
+    File-like wrapper around the request stream that decodes its
+    ``Content-Encoding`` while it is read, and raises ``RequestTooLarge``
+    once more than ``max_size`` bytes have been produced.
+    """
+
+    def __init__(self, stream, encodings, max_size=MAX_DECOMPRESSED_SIZE):
+        self.max_size = max_size
+        self.size = 0
+
+        # Encodings are listed in the order they were applied
+        for encoding in reversed(encodings):
+            if encoding in ("gzip", "x-gzip"):
+                stream = ZlibReader(stream, "gzip")
+            elif encoding == "deflate":
+                stream = ZlibReader(stream, "deflate")
+            elif encoding == "zstd" and zstandard is not None:
+                stream = zstandard.ZstdDecompressor().stream_reader(
+                    stream, read_size=READ_CHUNK_SIZE
+                )
+            else:
+                raise UnsupportedMediaType(
+                    encoding, detail=f"Unsupported Content-Encoding '{encoding}'."
+                )
+
+        self.stream = stream
+
+    def _read_chunk(self, size):
+        try:
+            data = self.stream.read(size)
+        except zlib.error as e:
+            raise ParseError(f"Invalid compressed body: {e}")
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                raise ParseError(f"Invalid compressed body: {e}")
+            raise
+
+        self.size += len(data)
+        if self.size > self.max_size:
+            log.warning(f"Rejecting request body larger than {self.max_size} bytes")
+            raise RequestTooLarge()
+
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self._read_chunk(READ_CHUNK_SIZE), b""))
+        return self._read_chunk(size)
+
+
+def get_content_encodings(request):
+    """Return the codings listed in the request's ``Content-Encoding``."""
+    header = request.META.get("HTTP_CONTENT_ENCODING", "")
+    return [
+        encoding.strip().lower()
+        for encoding in header.split(",")
+        if encoding.strip() and encoding.strip().lower() != "identity"
+    ]
+
+
+def decompress_request_stream(stream, request, max_size=MAX_DECOMPRESSED_SIZE):
+    """
+    Wrap the request stream to decode its ``Content-Encoding`` and cap the
+    size of the (decoded) body.
+    """
+    encodings = get_content_encodings(request) if request is not None else []
+    return DecompressingStream(stream, encodings, max_size)
+
+
+class JSONStreamReader:
+    """
+    Minimal incremental JSON tokenizer over a byte stream.
+
+    Only the structure around the values we are interested in is walked by
+    hand; each value is decoded with ``JSONDecoder.raw_decode`` as soon as it
+    is complete in the buffer, so memory is bounded by the largest single
+    value rather than by the whole document.
+    """
+
+    def __init__(self, stream, encoding="utf-8", strict=True):
+        self.stream = stream
+        self.text_decoder = codecs.getincrementaldecoder(encoding)()
+        self.decoder = json.JSONDecoder(
+            parse_constant=drf_json.strict_constant if strict else None
+        )
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=READ_CHUNK_SIZE):
+        """Read more of the stream, dropping the part already consumed."""
+        data = self.stream.read(size)
+        if not data:
+            self.eof = True
+        try:
+            text = self.text_decoder.decode(data, final=self.eof)
+        except UnicodeDecodeError as e:
+            raise ParseError(f"JSON parse error - {e}")
+
+        self.buffer = self.buffer[self.pos :] + text
+        self.pos = 0
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while (
+                self.pos < len(self.buffer) and self.buffer[self.pos] in JSON_WHITESPACE
+            ):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise ParseError("JSON parse error - unexpected end of data")
+            self._fill()
+
+    def next_char(self):
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def expect(self, char):
+        found = self.next_char()
+        if found != char:
+            raise ParseError(
+                f"JSON parse error - expected '{char}' but found '{found}'"
+            )
+
+    def has_next_item(self, closing):
+        """
+        Consume the ``,`` after an item and return True, or the ``closing``
+        bracket of the container and return False.
+        """
+        char = self.next_char()
+        if char == ",":
+            return True
+        if char == closing:
+            return False
+        raise ParseError(
+            f"JSON parse error - expected ',' or '{closing}' but found '{char}'"
+        )
+
+    def decode_value(self):
+        """Decode the next JSON value, reading more of the stream as needed."""
+        self.peek()
+        size = READ_CHUNK_SIZE
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ParseError(f"JSON parse error - {e}")
+            except ValueError as e:
+                # Rejected constants (NaN, Infinity)
+                raise ParseError(f"JSON parse error - {e}")
+            else:
+                # A number at the end of the buffer may continue in the stream
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+
+            # Grow reads so a large value isn't re-parsed once per chunk
+            self._fill(size)
+            size *= 2
+
+
+def iter_json_array(stream, key, encoding="utf-8", strict=True, required=False):
+    """
+    Yield the items of the array stored under ``key`` (or the first of a
+    tuple of keys) in the top-level JSON object of ``stream``, one at a time.
+    Other keys are skipped, and the rest of the document after the array is
+    not read.  When ``required``, a missing key raises ``ParseError``.
+    """
+    reader = JSONStreamReader(stream, encoding, strict)
+    keys = (key,) if isinstance(key, str) else key
+
+    reader.expect("{")
+    if reader.peek() == "}":
+        if required:
+            raise ParseError(f"'{keys[0]}' is missing")
+        return
+
+    while True:
+        name = reader.decode_value()
+        if not isinstance(name, str):
+            raise ParseError("JSON parse error - object keys must be strings")
+        reader.expect(":")
+
+        if name in keys:
+            if reader.peek() != "[":
+                raise ParseError(f"'{name}' must be a list")
+            reader.expect("[")
+
+            if reader.peek() == "]":
+                return
+
+            while True:
+                yield reader.decode_value()
+                if not reader.has_next_item("]"):
+                    return
+
+        # Not the key we are looking for, skip its value
+        reader.decode_value()
+        if not reader.has_next_item("}"):
+            if required:
+                raise ParseError(f"'{keys[0]}' is missing")
+            return
+
+
+class StreamingOverlandParser(BaseParser):
+    """
+    JSON parser for Overland request bodies that doesn't load the whole body.
+
+    ``request.data`` is ``{"locations": <iterator>}``: features are parsed one
+    at a time while the iterator is consumed, so memory stays flat whatever
+    the size of the batch.  ``gzip``, ``deflate`` and ``zstd`` (when the
+    ``zstandard`` package is installed) bodies are decompressed on the fly,
+    and bodies larger than ``OVERLAND_MAX_BODY_MB`` are rejected.
+
+    Unlike ``JSONParser`` subclasses, this parser gets the raw request stream
+    from DRF rather than ``request.body``, so Django's
+    ``DATA_UPLOAD_MAX_MEMORY_SIZE`` doesn't apply.
+    """
+
+    media_type = "application/json"
+    strict = api_settings.STRICT_JSON
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        stream = decompress_request_stream(stream, parser_context.get("request"))
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+
+        return {
+            "locations": iter_json_array(stream, "locations", encoding, self.strict)
+        }
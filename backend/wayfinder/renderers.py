@@ -0,0 +1,288 @@
+# renderers.py
+
+import json
+import os
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .formats import arrow_trips, flatgeobuf_trips, polyline_trips, pyarrow
+from .utils import build_trips_feature_collection
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Size of the chunks streamed to the client (and compressed one at a time by
+# GZipMiddleware). Smaller chunks start the transfer sooner but compress worse.
+STREAM_CHUNK_SIZE = int(os.getenv("GEOJSON_STREAM_CHUNK_KB", "64")) * 1024
+
+# Arrays longer than this (coordinates, times) are serialized in slices of
+# this many items, so no single piece of the body gets larger than needed
+STREAM_ARRAY_SLICE = 4096
+
+
+if orjson is not None:
+    _encoder = JSONEncoder()
+
+    def dumps(value):
+        """``value`` as compact JSON bytes, encoded like DRF's JSONRenderer."""
+        # Datetimes go through DRF's encoder, orjson doesn't shorten UTC to "Z"
+        return orjson.dumps(
+            value,
+            default=_encoder.default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME,
+        )
+
+else:
+
+    def dumps(value):
+        """``value`` as compact JSON bytes, encoded like DRF's JSONRenderer."""
+        return json.dumps(
+            value,
+            cls=JSONEncoder,
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+        ).encode()
+
+
+def _iter_json(value):
+    """
+    Yield ``value`` as JSON in pieces: objects and arrays of objects (like
+    features) are written member by member, long arrays slice by slice, and
+    everything else in one go.
+    """
+    if isinstance(value, dict):
+        separator = b"{"
+        for key, member in value.items():
+            yield separator + dumps(str(key)) + b":"
+            yield from _iter_json(member)
+            separator = b","
+        yield b"}" if separator == b"," else b"{}"
+
+    elif isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+        separator = b"["
+        for item in value:
+            yield separator
+            yield from _iter_json(item)
+            separator = b","
+        yield b"]"
+
+    elif isinstance(value, (list, tuple)) and len(value) > STREAM_ARRAY_SLICE:
+        separator = b"["
+        for start in range(0, len(value), STREAM_ARRAY_SLICE):
+            # Drop the brackets of the slice
+            yield separator + dumps(value[start : start + STREAM_ARRAY_SLICE])[1:-1]
+            separator = b","
+        yield b"]"
+
+    else:
+        yield dumps(value)
+
+
+def _iter_chunks(pieces):
+    """Join ``pieces`` of bytes into chunks of about ``STREAM_CHUNK_SIZE``."""
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= STREAM_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+class GeoJSONRenderer(JSONRenderer):
+    """
+    JSON renderer for large GeoJSON responses.  The output is the same JSON
+    as ``JSONRenderer`` (orjson is used when it is installed), and it can be
+    produced as a sequence of chunks with ``iter_render`` instead of one
+    large string, see ``stream_response``.
+    """
+
+    def iter_render(self, data):
+        """Yield ``data`` as JSON chunks of about ``STREAM_CHUNK_SIZE`` bytes."""
+        return _iter_chunks(_iter_json(data))
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return b"".join(self.iter_render(data))
+
+
+def stream_response(request, data, status=200):
+    """
+    Return ``data`` as a streaming response if the renderer negotiated for
+    ``request`` can stream it, otherwise as a regular ``Response`` (e.g. for
+    the browsable API).
+    """
+    renderer = getattr(request, "accepted_renderer", None)
+    if not isinstance(renderer, GeoJSONRenderer):
+        return Response(data, status=status)
+
+    return StreamingHttpResponse(
+        renderer.iter_render(data),
+        status=status,
+        content_type=request.accepted_media_type or renderer.media_type,
+    )
+
+
+class TripsRenderer(BaseRenderer):
+    """
+    Base of the renderers of ``TripsView`` in other formats than GeoJSON,
+    picked with the Accept header or the ``format`` query parameter.  They
+    render the trips straight from the ``LocationColumns`` (with epoch
+    times) and their segments, with ``iter_trips``, and keep the rest of
+    the response (visits, meta, pagination) as JSON, see
+    ``stream_trips_response``.
+    """
+
+    charset = None
+
+    def iter_trips(self, locations, segments, data):
+        """Yield the body for the trips and the rest of the response ``data``."""
+        raise NotImplementedError(".iter_trips() must be overridden.")
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        raise NotImplementedError(
+            "Trips are rendered with .iter_trips(), see stream_trips_response."
+        )
+
+
+class PolylineRenderer(TripsRenderer):
+    """
+    The response as JSON, with the trips as Google encoded polylines and
+    their times delta encoded in the same way, see ``polyline_trips``.
+    """
+
+    media_type = "application/vnd.wayfinder.polyline+json"
+    format = "polyline"
+
+    def iter_trips(self, locations, segments, data):
+        return _iter_chunks(
+            _iter_json({"trips": polyline_trips(locations, segments), **data})
+        )
+
+
+class FlatGeobufRenderer(TripsRenderer):
+    """
+    A FlatGeobuf file of the trips, with the rest of the response as JSON
+    in the header metadata, see ``flatgeobuf_trips``.
+    """
+
+    media_type = "application/flatgeobuf"
+    format = "fgb"
+
+    def iter_trips(self, locations, segments, data):
+        return _iter_chunks(
+            flatgeobuf_trips(locations, segments, metadata=dumps(data).decode())
+        )
+
+
+class ArrowRenderer(TripsRenderer):
+    """
+    An Arrow IPC stream of the trip locations, with the rest of the
+    response as JSON in the schema metadata, see ``arrow_trips``.
+    """
+
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+
+    def iter_trips(self, locations, segments, data):
+        yield arrow_trips(locations, segments, metadata=dumps(data).decode())
+
+
+# Formats of TripsView besides GeoJSON, Arrow only if pyarrow is installed
+TRIPS_RENDERERS = [PolylineRenderer, FlatGeobufRenderer] + (
+    [ArrowRenderer] if pyarrow is not None else []
+)
+
+
+def stream_trips_response(
+    request, locations, segments, data, status=200, **geojson_options
+):
+    """
+    Return the ``TripsView`` response of ``data`` (without ``trips``) and
+    the trips ``segments`` of ``locations`` in the format negotiated for
+    ``request``: streamed by a ``TripsRenderer``, or as a GeoJSON
+    FeatureCollection otherwise (see ``stream_response``), built with
+    ``geojson_options`` (see ``build_trips_feature_collection``).
+    """
+    renderer = getattr(request, "accepted_renderer", None)
+    if not isinstance(renderer, TripsRenderer):
+        trips = build_trips_feature_collection(
+            locations, segments=segments, **geojson_options
+        )
+        return stream_response(request, {"trips": trips, **data}, status=status)
+
+    return StreamingHttpResponse(
+        renderer.iter_trips(locations, segments, data),
+        status=status,
+        content_type=renderer.media_type,
+    )
+
+
+class FeatureStreamRenderer(BaseRenderer):
+    """
+    Base of the renderers of the streaming mode of ``TripsView``: the
+    whole range as a sequence of GeoJSON features, one record each,
+    written as soon as each trip is complete instead of in pages, see
+    ``stream_features_response``.
+    """
+
+    charset = None
+    record_prefix = b""
+
+    def iter_features(self, features):
+        """Yield a record for each of ``features``."""
+        for feature in features:
+            yield self.record_prefix + dumps(feature) + b"\n"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        raise NotImplementedError(
+            "Features are rendered with .iter_features(), see "
+            "stream_features_response."
+        )
+
+
+class NDJSONRenderer(FeatureStreamRenderer):
+    """Newline delimited JSON, a feature per line."""
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+
+class GeoJSONSeqRenderer(FeatureStreamRenderer):
+    """GeoJSON text sequences (RFC 8142), a feature per record."""
+
+    media_type = "application/geo+json-seq"
+    format = "geojsonseq"
+    record_prefix = b"\x1e"
+
+
+FEATURE_STREAM_RENDERERS = [NDJSONRenderer, GeoJSONSeqRenderer]
+
+
+def stream_features_response(request, features, status=200):
+    """
+    Return the streaming response of ``features`` (an iterable, consumed
+    while the response is sent) with the ``FeatureStreamRenderer``
+    negotiated for ``request``.
+    """
+    response = StreamingHttpResponse(
+        request.accepted_renderer.iter_features(features),
+        status=status,
+        content_type=request.accepted_renderer.media_type,
+    )
+    # Proxies should pass each trip on as soon as it is written
+    response["X-Accel-Buffering"] = "no"
+    return response
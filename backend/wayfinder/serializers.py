@@ -1,14 +1,124 @@
 # serializers.py
 
+import math
 from datetime import datetime
+from django.db import models
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from .models import DailyActivitySummary, Location, UserSettings, Visit
+from .models import Location, UserSettings, Visit, get_motion_mask, is_moving
 
+# Validation rules shared by the serializers and the batch validator
+VALID_BATTERY_STATES = ["charging", "full", "unplugged", "unknown"]
+VALID_MOTIONS = ["driving", "walking", "running", "cycling", "stationary"]
+OVERLAND_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def get_overland_feature_parts(data):
+    """
+    Validate the GeoJSON structure of a feature sent by Overland and return
+    its ``properties`` dict and ``coordinates`` list.
+    """
+
+    # Validate that data is a dictionary
+    if not isinstance(data, dict):
+        raise serializers.ValidationError(
+            {"non_field_errors": ["Invalid data format: expected a dictionary"]}
+        )
+
+    # Extract data from the GeoJSON structure
+    properties = data.get("properties", {})
+    geometry = data.get("geometry", {})
+    coordinates = geometry.get("coordinates", []) if isinstance(geometry, dict) else []
+
+    # Validate GeoJSON structure
+    if not isinstance(properties, dict):
+        raise serializers.ValidationError(
+            {"non_field_errors": ["Invalid GeoJSON: 'properties' must be a dictionary"]}
+        )
+
+    if not isinstance(geometry, dict):
+        raise serializers.ValidationError(
+            {"non_field_errors": ["Invalid GeoJSON: 'geometry' must be a dictionary"]}
+        )
+
+    # Validate coordinates
+    if not isinstance(coordinates, list) or len(coordinates) < 2:
+        raise serializers.ValidationError(
+            {
+                "non_field_errors": [
+                    "Invalid GeoJSON: 'coordinates' must be a list with at least 2 elements [longitude, latitude]"
+                ]
+            }
+        )
+
+    return properties, coordinates
+
+
+class FiniteFloatField(serializers.FloatField):
+    """FloatField that rejects NaN and infinity."""
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if not math.isfinite(value):
+            self.fail("invalid")
+        return value
+
+
+# Model FloatFields (coordinates, accuracies) are validated as finite numbers
+OVERLAND_FIELD_MAPPING = {
+    **serializers.ModelSerializer.serializer_field_mapping,
+    models.FloatField: FiniteFloatField,
+}
+
+
+class PrefetchedUniqueTimeValidator:
+    """
+    Replacement for the ``UniqueValidator`` that DRF generates for the unique
+    ``time`` field.  Instead of running one query per item, the value is
+    checked against a set of timestamps prefetched once for the whole batch.
+    """
+
+    def __init__(self, existing_times, message):
+        self.existing_times = existing_times
+        self.message = message
+
+    def __call__(self, value):
+        if value in self.existing_times:
+            raise serializers.ValidationError(self.message, code="unique")
+
+
+class BatchUniqueTimeMixin:
+    """
+    When the serializer context contains ``existing_times`` (a set of
+    timestamps already stored for the batch's time range) the per-item
+    uniqueness query on ``time`` is replaced by an in-memory lookup.
+    Duplicates are still reported as a ``unique`` error on ``time``.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+
+        existing_times = self.context.get("existing_times")
+        if existing_times is not None:
+            time_field = fields["time"]
+            time_field.validators = [
+                (
+                    PrefetchedUniqueTimeValidator(existing_times, validator.message)
+                    if isinstance(validator, UniqueValidator)
+                    else validator
+                )
+                for validator in time_field.validators
+            ]
+
+        return fields
+
+
+class LocationSerializer(BatchUniqueTimeMixin, serializers.ModelSerializer):
+    serializer_field_mapping = OVERLAND_FIELD_MAPPING
 
-class LocationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Location
         fields = [
@@ -36,49 +146,19 @@ class LocationSerializer(serializers.ModelSerializer):
         into a format that the serializer can understand so it can then
         be saved into the database.
         """
+        properties, coordinates = get_overland_feature_parts(data)
+        prepared_data = self.prepare_overland_data(properties, coordinates)
 
-        # Validate that data is a dictionary
-        if not isinstance(data, dict):
-            raise serializers.ValidationError(
-                {"non_field_errors": ["Invalid data format: expected a dictionary"]}
-            )
-
-        # Extract data from the GeoJSON structure
-        properties = data.get("properties", {})
-        geometry = data.get("geometry", {})
-        coordinates = geometry.get("coordinates", [])
-
-        # Validate GeoJSON structure
-        if not isinstance(properties, dict):
-            raise serializers.ValidationError(
-                {
-                    "non_field_errors": [
-                        "Invalid GeoJSON: 'properties' must be a dictionary"
-                    ]
-                }
-            )
-
-        if not isinstance(geometry, dict):
-            raise serializers.ValidationError(
-                {
-                    "non_field_errors": [
-                        "Invalid GeoJSON: 'geometry' must be a dictionary"
-                    ]
-                }
-            )
-
-        # Validate coordinates
-        if not isinstance(coordinates, list) or len(coordinates) < 2:
-            raise serializers.ValidationError(
-                {
-                    "non_field_errors": [
-                        "Invalid GeoJSON: 'coordinates' must be a list with at least 2 elements [longitude, latitude]"
-                    ]
-                }
-            )
+        # Use the parent's to_internal_value to do the actual validation
+        return super().to_internal_value(prepared_data)
 
-        # Prepare the data for the serializer
-        prepared_data = {
+    @staticmethod
+    def prepare_overland_data(properties, coordinates):
+        """
+        Map the properties and coordinates of an Overland feature to the
+        serializer fields.
+        """
+        return {
             "time": properties.get("timestamp"),
             "longitude": coordinates[0] if len(coordinates) > 0 else None,
             "latitude": coordinates[1] if len(coordinates) > 1 else None,
@@ -97,9 +177,6 @@ class LocationSerializer(serializers.ModelSerializer):
             "wifi": properties.get("wifi"),
         }
 
-        # Use the parent's to_internal_value to do the actual validation
-        return super().to_internal_value(prepared_data)
-
     def validate_longitude(self, value):
         """Validate longitude is within valid range"""
         if value is None:
@@ -132,12 +209,11 @@ class LocationSerializer(serializers.ModelSerializer):
 
     def validate_battery_state(self, value):
         """Validate battery state is one of the valid options"""
-        valid_states = ["charging", "full", "unplugged", "unknown"]
         if not value:
             raise serializers.ValidationError("Battery state is required")
-        if value not in valid_states:
+        if value not in VALID_BATTERY_STATES:
             raise serializers.ValidationError(
-                f"Battery state must be one of: {', '.join(valid_states)}"
+                f"Battery state must be one of: {', '.join(VALID_BATTERY_STATES)}"
             )
         return value
 
@@ -148,11 +224,10 @@ class LocationSerializer(serializers.ModelSerializer):
         if not isinstance(value, list):
             raise serializers.ValidationError("Motion must be a list")
 
-        valid_motions = ["driving", "walking", "running", "cycling", "stationary"]
         for motion in value:
-            if motion not in valid_motions:
+            if motion not in VALID_MOTIONS:
                 raise serializers.ValidationError(
-                    f"Invalid motion type '{motion}'. Must be one of: {', '.join(valid_motions)}"
+                    f"Invalid motion type '{motion}'. Must be one of: {', '.join(VALID_MOTIONS)}"
                 )
         return value
 
@@ -162,8 +237,16 @@ class LocationSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Timestamp is required")
         return value
 
+    def validate(self, attrs):
+        """Derive the motion bitmask and moving flag stored with the location"""
+        attrs["motion_mask"] = get_motion_mask(attrs["motion"])
+        attrs["moving"] = is_moving(attrs["motion"])
+        return attrs
+
+
+class VisitSerializer(BatchUniqueTimeMixin, serializers.ModelSerializer):
+    serializer_field_mapping = OVERLAND_FIELD_MAPPING
 
-class VisitSerializer(serializers.ModelSerializer):
     class Meta:
         model = Visit
         fields = [
@@ -189,46 +272,18 @@ class VisitSerializer(serializers.ModelSerializer):
         into a format that the serializer can understand so it can then
         be saved into the database.
         """
+        properties, coordinates = get_overland_feature_parts(data)
+        prepared_data = self.prepare_overland_data(properties, coordinates)
 
-        # Validate that data is a dictionary
-        if not isinstance(data, dict):
-            raise serializers.ValidationError(
-                {"non_field_errors": ["Invalid data format: expected a dictionary"]}
-            )
-
-        # Extract data from the GeoJSON structure
-        properties = data.get("properties", {})
-        geometry = data.get("geometry", {})
-        coordinates = geometry.get("coordinates", [])
-
-        # Validate GeoJSON structure
-        if not isinstance(properties, dict):
-            raise serializers.ValidationError(
-                {
-                    "non_field_errors": [
-                        "Invalid GeoJSON: 'properties' must be a dictionary"
-                    ]
-                }
-            )
-
-        if not isinstance(geometry, dict):
-            raise serializers.ValidationError(
-                {
-                    "non_field_errors": [
-                        "Invalid GeoJSON: 'geometry' must be a dictionary"
-                    ]
-                }
-            )
+        # Use the parent's to_internal_value to do the actual validation
+        return super().to_internal_value(prepared_data)
 
-        # Validate coordinates
-        if not isinstance(coordinates, list) or len(coordinates) < 2:
-            raise serializers.ValidationError(
-                {
-                    "non_field_errors": [
-                        "Invalid GeoJSON: 'coordinates' must be a list with at least 2 elements [longitude, latitude]"
-                    ]
-                }
-            )
+    @staticmethod
+    def prepare_overland_data(properties, coordinates):
+        """
+        Map the properties and coordinates of an Overland visit to the
+        serializer fields, calculating the duration of the visit.
+        """
 
         # Calculate the duration of the visit
         arrival_date = properties.get("arrival_date")
@@ -244,64 +299,53 @@ class VisitSerializer(serializers.ModelSerializer):
                 {"departure_date": ["This field is required for visits"]}
             )
 
-        if arrival_date and departure_date:
-            try:
-                # Convert the dates to datetime objects
-                arrival_datetime = datetime.strptime(arrival_date, "%Y-%m-%dT%H:%M:%SZ")
-                departure_datetime = datetime.strptime(
-                    departure_date, "%Y-%m-%dT%H:%M:%SZ"
-                )
-            except ValueError as e:
-                raise serializers.ValidationError(
-                    {
-                        "non_field_errors": [
-                            f"Invalid date format. Expected format: YYYY-MM-DDTHH:MM:SSZ. Error: {str(e)}"
-                        ]
-                    }
-                )
-
-            # Validate that departure is after arrival
-            if departure_datetime <= arrival_datetime:
-                raise serializers.ValidationError(
-                    {"non_field_errors": ["departure_date must be after arrival_date"]}
-                )
-
-            # Calculate the duration in seconds
-            duration = (departure_datetime - arrival_datetime).total_seconds()
+        try:
+            # Convert the dates to datetime objects
+            arrival_datetime = datetime.strptime(arrival_date, OVERLAND_DATE_FORMAT)
+            departure_datetime = datetime.strptime(departure_date, OVERLAND_DATE_FORMAT)
+        except (TypeError, ValueError) as e:
+            raise serializers.ValidationError(
+                {
+                    "non_field_errors": [
+                        f"Invalid date format. Expected format: YYYY-MM-DDTHH:MM:SSZ. Error: {str(e)}"
+                    ]
+                }
+            )
 
-            # Convert the duration to hours
-            properties["duration"] = duration / 3600
+        # Validate that departure is after arrival
+        if departure_datetime <= arrival_datetime:
+            raise serializers.ValidationError(
+                {"non_field_errors": ["departure_date must be after arrival_date"]}
+            )
 
-            # Ensure duration has 2 decimal places
-            properties["duration"] = round(properties["duration"], 2)
+        # Calculate the duration in hours, with 2 decimal places
+        duration = round(
+            (departure_datetime - arrival_datetime).total_seconds() / 3600, 2
+        )
 
-            # Validate duration is positive
-            if properties["duration"] <= 0:
-                raise serializers.ValidationError(
-                    {"duration": ["Visit duration must be positive"]}
-                )
+        # Validate duration is positive
+        if duration <= 0:
+            raise serializers.ValidationError(
+                {"duration": ["Visit duration must be positive"]}
+            )
 
-        # Prepare the data for the serializer
-        prepared_data = {
+        return {
             "time": properties.get("timestamp"),
             "longitude": coordinates[0] if len(coordinates) > 0 else None,
             "latitude": coordinates[1] if len(coordinates) > 1 else None,
             "altitude": properties.get("altitude"),
-            "arrival_date": properties.get("arrival_date"),
+            "arrival_date": arrival_date,
             "battery_level": properties.get("battery_level"),
             "battery_state": properties.get("battery_state"),
-            "departure_date": properties.get("departure_date") or None,
+            "departure_date": departure_date,
             "device_id": properties.get("device_id") or "",
             "horizontal_accuracy": properties.get("horizontal_accuracy"),
             "unique_id": properties.get("unique_id"),
             "vertical_accuracy": properties.get("vertical_accuracy"),
             "wifi": properties.get("wifi"),
-            "duration": properties.get("duration"),
+            "duration": duration,
         }
 
-        # Use the parent's to_internal_value to do the actual validation
-        return super().to_internal_value(prepared_data)
-
     def validate_longitude(self, value):
         """Validate longitude is within valid range"""
         if value is None:
@@ -334,12 +378,11 @@ class VisitSerializer(serializers.ModelSerializer):
 
     def validate_battery_state(self, value):
         """Validate battery state is one of the valid options"""
-        valid_states = ["charging", "full", "unplugged", "unknown"]
         if not value:
             raise serializers.ValidationError("Battery state is required")
-        if value not in valid_states:
+        if value not in VALID_BATTERY_STATES:
             raise serializers.ValidationError(
-                f"Battery state must be one of: {', '.join(valid_states)}"
+                f"Battery state must be one of: {', '.join(VALID_BATTERY_STATES)}"
             )
         return value
 
@@ -451,6 +494,9 @@ class TripPlotMetaSerializer(serializers.Serializer):
         help_text="Time bucket size used for downsampling (e.g., '1 hour', '15 minutes')",
     )
     downsampled = serializers.BooleanField(help_text="Whether the data was downsampled")
+    approximate_counts = serializers.BooleanField(
+        help_text="Whether total_locations and trip_locations_raw are planner estimates"
+    )
 
 
 class PaginationSerializer(serializers.Serializer):
@@ -460,7 +506,7 @@ class PaginationSerializer(serializers.Serializer):
     )
     next_cursor = serializers.CharField(
         allow_null=True,
-        help_text="Cursor for the next page (ISO datetime). Use this in the 'cursor' query parameter.",
+        help_text="Signed, opaque cursor for the next page, carrying what the first page resolved for the whole range. Use this in the 'cursor' query parameter with the same other parameters; it expires after TRIP_CURSOR_MAX_AGE seconds.",
     )
     is_first_page = serializers.BooleanField(help_text="Whether this is the first page")
     trip_boundary_aligned = serializers.BooleanField(
@@ -485,6 +531,42 @@ class TripPlotResponseSerializer(serializers.Serializer):
     )
 
 
+class TripShardSerializer(serializers.Serializer):
+    start_datetime = serializers.DateTimeField(
+        help_text="Start of the shard (inclusive), to use as the start_datetime of a trips request"
+    )
+    end_datetime = serializers.DateTimeField(
+        help_text="End of the shard (inclusive), to use as the end_datetime of a trips request"
+    )
+    points = serializers.IntegerField(
+        help_text="Approximate number of trip locations in the shard"
+    )
+
+
+class TripShardPlanMetaSerializer(serializers.Serializer):
+    start_datetime = serializers.CharField(
+        help_text="Start datetime of the query range"
+    )
+    end_datetime = serializers.CharField(help_text="End datetime of the query range")
+    trip_locations = serializers.IntegerField(
+        help_text="Approximate number of trip locations in the range"
+    )
+    shards_count = serializers.IntegerField(help_text="Number of shards")
+    bucket_size = serializers.CharField(
+        help_text="Width of the point counts the shards were planned from"
+    )
+    separate_trips = serializers.BooleanField(
+        help_text="Whether the shard edges are visit midtimes, so no trip is split between shards"
+    )
+
+
+class TripShardPlanResponseSerializer(serializers.Serializer):
+    shards = TripShardSerializer(
+        many=True, help_text="Consecutive time ranges covering the query range"
+    )
+    meta = TripShardPlanMetaSerializer(help_text="Metadata about the plan")
+
+
 # ------------------------- Activity History serializers --------------------- #
 class DailyActivitySerializer(serializers.Serializer):
     date = serializers.DateField(help_text="Date in YYYY-MM-DD format")
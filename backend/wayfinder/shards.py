@@ -0,0 +1,129 @@
+# shards.py
+
+import os
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from django.db.models import Count, Q
+
+from .aggregates import first_whole_bucket, floor_to_bucket
+from .models import TRIP_TIERS
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Shards of a plan when the request doesn't ask for a number, and at most
+DEFAULT_SHARDS = int(os.getenv("TRIP_SHARDS", "4"))
+MAX_SHARDS = 64
+
+# Buckets of point counts read to plan a range at most: the finest trip tier
+# with no more buckets over the range is used, so planning a year costs
+# about as much as a day
+SHARD_PLAN_MAX_BUCKETS = int(os.getenv("TRIP_SHARD_PLAN_BUCKETS", "5000"))
+
+
+def select_plan_tier(start, end):
+    """The finest trip tier with at most ``SHARD_PLAN_MAX_BUCKETS`` buckets
+    between ``start`` and ``end``, or the coarsest one."""
+    for tier in TRIP_TIERS:
+        if (end - start) / tier.bucket_width <= SHARD_PLAN_MAX_BUCKETS:
+            return tier
+    return TRIP_TIERS[-1]
+
+
+def get_point_buckets(queryset, start, end, tier, use_tiers=True):
+    """
+    Return the ``[(bucket, points)]`` of the moving locations between
+    ``start`` and ``end`` per bucket of ``tier``, sorted by bucket.
+
+    They are read from the precomputed ``tier`` if ``use_tiers``, except in
+    the partial buckets at the edges of the range, which are counted from
+    ``queryset`` like ``count_in_range`` does.  Otherwise every bucket is
+    counted from ``queryset`` (moving locations with filters the tiers
+    don't have, like the accuracy) in buckets of the same width.
+    """
+    width = tier.bucket_width
+    first_bucket = first_whole_bucket(start, width)
+    last_bucket = floor_to_bucket(end, width)
+
+    if use_tiers:
+        rows = list(
+            tier.objects.filter(bucket__gte=first_bucket, bucket__lt=last_bucket)
+            .order_by("bucket")
+            .values_list("bucket", "points")
+        )
+
+        # Both edges are in the same bucket when the range is shorter
+        head = Q(time__gte=start, time__lt=min(first_bucket, last_bucket))
+        tail = Q(time__gte=max(start, last_bucket), time__lte=end)
+        edges = queryset.filter(head | tail).aggregate(
+            head=Count("time", filter=head), tail=Count("time", filter=tail)
+        )
+        if edges["head"]:
+            rows.insert(0, (floor_to_bucket(start, width), edges["head"]))
+        if edges["tail"]:
+            rows.append((last_bucket, edges["tail"]))
+        return rows
+
+    rows = (
+        queryset.filter(time__gte=start, time__lte=end)
+        .time_bucket("time", tier.bucket_size, annotations={"points": Count("time")})
+        .order_by("bucket")
+    )
+    return [(row["bucket"], row["points"]) for row in rows]
+
+
+def _align_edges(edges, midtimes, start, end):
+    """
+    Move each of ``edges`` to the nearest of ``midtimes`` between ``start``
+    and ``end``, so that no trip is split between two shards.  Edges with
+    no midtime to move to are dropped, as are duplicates.
+    """
+    midtimes = [midtime for midtime in midtimes if start < midtime <= end]
+    aligned = set()
+    for edge in edges:
+        i = bisect_left(midtimes, edge)
+        candidates = midtimes[max(i - 1, 0) : i + 1]
+        if candidates:
+            aligned.add(min(candidates, key=lambda midtime: abs(midtime - edge)))
+    return sorted(aligned)
+
+
+def plan_shards(buckets, start, end, shards, midtimes=None):
+    """
+    Split the range from ``start`` to ``end`` (inclusive) into up to
+    ``shards`` consecutive ranges with about the same number of points,
+    from the ``[(bucket, points)]`` counts of ``get_point_buckets``.
+
+    The edges are placed at bucket starts, or moved to the nearest visit
+    midtime if ``midtimes`` (sorted) is given, where ``TripsView`` would
+    separate two trips anyway.  Each shard is ``(start, end, points)``,
+    ``end`` inclusive and one microsecond before the next shard starts;
+    points are counted by bucket, so they are approximate around edges.
+    """
+    total = sum(points for _, points in buckets)
+
+    # Place edge k before the first bucket that starts after k / shards of
+    # the points
+    edges = []
+    if total and shards > 1:
+        target = total / shards
+        cumulative = 0
+        for bucket, points in buckets:
+            while len(edges) < shards - 1 and cumulative >= (len(edges) + 1) * target:
+                edges.append(bucket)
+            cumulative += points
+        edges = [edge for edge in edges if start < edge <= end]
+
+    if midtimes is not None:
+        edges = _align_edges(edges, midtimes, start, end)
+
+    # Points of each shard, by the start of the buckets
+    counts = [0] * (len(edges) + 1)
+    for bucket, points in buckets:
+        counts[bisect_right(edges, bucket)] += points
+
+    bounds = [start, *edges]
+    ends = [edge - timedelta(microseconds=1) for edge in edges] + [end]
+    return list(zip(bounds, ends, counts))
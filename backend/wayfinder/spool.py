@@ -0,0 +1,384 @@
+# spool.py
+
+import fcntl
+import json
+import logging
+import os
+import socket
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .ingestion import parse_overland_features, store_overland_batch
+from .ingestion_queue import RETRYABLE_ERRORS, get_redis
+
+log = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Spool Overland batches to disk when they can't be written to the database
+SPOOL_ENABLED = os.getenv("OVERLAND_SPOOL", "False") == "True"
+
+# Directory holding the spool segments, shared by the web and worker containers
+SPOOL_DIR = os.getenv("OVERLAND_SPOOL_DIR", str(settings.BASE_DIR / "spool"))
+
+# Batches are refused once the spool holds this many bytes
+SPOOL_MAX_BYTES = int(os.getenv("OVERLAND_SPOOL_MAX_MB", "512")) * 1024 * 1024
+
+# A worker starts a new segment once its current one reaches this size
+SEGMENT_MAX_BYTES = 16 * 1024 * 1024
+
+# Number of segments replayed at the same time
+REPLAY_CONCURRENCY = int(os.getenv("OVERLAND_SPOOL_REPLAY_CONCURRENCY", "2"))
+
+SEGMENT_SUFFIX = ".seg"
+CORRUPT_SUFFIX = ".corrupt"
+
+# Batches the database refuses for good (e.g. a DataError) are set aside in a
+# file of the same format next to their segment, so the rest of it is stored
+REFUSED_SUFFIX = ".refused"
+
+# A segment kept because the database became unavailable during its replay
+# has the offset of its first batch not stored yet in a file of this suffix,
+# so the batches before it are not replayed (and set aside) again
+OFFSET_SUFFIX = ".offset"
+
+# Record header: payload length and CRC32 of the payload
+RECORD_HEADER = struct.Struct(">II")
+
+# Counters kept in Redis, shared by all workers
+STATS_KEY = "wayfinder:spool:stats"
+
+
+def _increment_stat(name, amount=1):
+    """Increment a spool counter, ignoring Redis errors."""
+    try:
+        get_redis().hincrby(STATS_KEY, name, amount)
+    except Exception as e:
+        log.debug(f"Could not update spool stat {name}: {str(e)}")
+
+
+def _list_segment_times(suffix=SEGMENT_SUFFIX):
+    """Return the ``(mtime, path)`` of the spool segments, oldest first."""
+    try:
+        names = os.listdir(SPOOL_DIR)
+    except FileNotFoundError:
+        return []
+
+    segments = []
+    for name in names:
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(SPOOL_DIR, name)
+        try:
+            segments.append((os.path.getmtime(path), path))
+        except FileNotFoundError:
+            # Replayed in the meantime
+            pass
+    return sorted(segments)
+
+
+def _list_segments(suffix=SEGMENT_SUFFIX):
+    """Return the paths of the spool segments, oldest first."""
+    return [path for _, path in _list_segment_times(suffix)]
+
+
+def get_spool_size():
+    """Return the number of bytes held by the spool segments."""
+    size = 0
+    for path in _list_segments():
+        try:
+            size += os.path.getsize(path)
+        except FileNotFoundError:
+            # Replayed in the meantime
+            pass
+    return size
+
+
+def _pack_record(payload):
+    """A spool record of ``payload``: its header, then its bytes."""
+    data = payload.encode()
+    return RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+class SegmentWriter:
+    """
+    Append-only writer for this process' spool segment.
+
+    Each record is a length and CRC32 header followed by the JSON payload, and
+    is fsync'd before ``append`` returns.  The file is locked while writing so
+    the replayer never reads (or deletes) a segment during an append, and a
+    new segment is started rather than waiting for a segment being replayed.
+    """
+
+    def __init__(self):
+        self.path = None
+
+    def _new_path(self):
+        name = f"{socket.gethostname()}-{os.getpid()}-{time.time_ns()}{SEGMENT_SUFFIX}"
+        return os.path.join(SPOOL_DIR, name)
+
+    def _open_locked(self):
+        """Open and lock the current segment, starting a new one if needed."""
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+
+        while True:
+            if self.path is None:
+                self.path = self._new_path()
+
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Being replayed, don't wait for it
+                os.close(fd)
+                self.path = None
+                continue
+
+            stat = os.fstat(fd)
+            if stat.st_nlink > 0 and stat.st_size < SEGMENT_MAX_BYTES:
+                return fd
+
+            # The segment was replayed and deleted, or is full
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            self.path = None
+
+    def append(self, payload):
+        record = _pack_record(payload)
+
+        fd = self._open_locked()
+        try:
+            os.write(fd, record)
+            os.fsync(fd)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+        return len(record)
+
+
+_writer = SegmentWriter()
+
+
+def spool_overland_payload(locations):
+    """
+    Durably append the raw ``locations`` array of an Overland request to
+    this worker's spool segment, to be stored later by ``replay_spool``.
+
+    Returns False (and stores nothing) when the spool is full.
+    """
+    payload = json.dumps(locations)
+
+    if get_spool_size() + len(payload) > SPOOL_MAX_BYTES:
+        log.error(f"Spool is full ({SPOOL_MAX_BYTES} bytes), refusing batch")
+        _increment_stat("rejected_batches")
+        return False
+
+    written = _writer.append(payload)
+
+    log.warning(f"Spooled a batch of {len(locations)} features ({written} bytes)")
+    _increment_stat("spooled_batches")
+    _increment_stat("spooled_bytes", written)
+
+    return True
+
+
+def read_segment(fd):
+    """
+    Yield the payloads stored in a segment.
+
+    A truncated record at the end (a crash during an append) is ignored.
+    Raises ValueError when a record fails its checksum.
+    """
+    for _, payload in _read_records(fd):
+        yield payload
+
+
+def _read_records(fd, offset=0):
+    """Yield the ``(offset, payload)`` of the records from ``offset`` on."""
+    with os.fdopen(os.dup(fd), "rb") as segment:
+        segment.seek(offset)
+        while True:
+            offset = segment.tell()
+            header = segment.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+
+            length, checksum = RECORD_HEADER.unpack(header)
+            data = segment.read(length)
+            if len(data) < length:
+                log.warning("Ignoring a truncated record at the end of a spool segment")
+                return
+
+            if zlib.crc32(data) != checksum:
+                raise ValueError("record checksum mismatch")
+
+            yield offset, data.decode()
+
+
+def _set_aside(path, payload, error):
+    """Append a batch the database refused to the refused file of ``path``."""
+    log.error(f"Setting aside a spooled batch of {path} the database refused: {error}")
+
+    fd = os.open(path + REFUSED_SUFFIX, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, _pack_record(payload))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    _increment_stat("refused_batches")
+
+
+def _load_offset(path):
+    """The offset replays of ``path`` start from, 0 for the whole segment."""
+    try:
+        with open(path + OFFSET_SUFFIX) as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _save_offset(path, offset):
+    """Replay ``path`` from ``offset`` next time."""
+    temporary = f"{path}{OFFSET_SUFFIX}.{os.getpid()}"
+    with open(temporary, "w") as f:
+        f.write(str(offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path + OFFSET_SUFFIX)
+
+
+def _remove_offset(path):
+    try:
+        os.remove(path + OFFSET_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def _replay_records(path, fd):
+    """
+    Store the batches of a locked segment, returning how many were stored.
+
+    Like the queue drain, only ``RETRYABLE_ERRORS`` (the database is
+    unavailable) are raised to keep the segment, after saving the offset of
+    the batch that failed.  A batch failing with any other database error
+    would fail every time, it is set aside instead.
+    """
+    replayed = 0
+
+    for offset, payload in _read_records(fd, _load_offset(path)):
+        try:
+            locations = json.loads(payload)
+            store_overland_batch(parse_overland_features(locations))
+        except RETRYABLE_ERRORS:
+            _save_offset(path, offset)
+            raise
+        except DatabaseError as e:
+            _set_aside(path, payload, e)
+        except (ValueError, TypeError, AttributeError) as e:
+            log.error(f"Dropping an invalid spooled batch from {path}: {e}")
+            _increment_stat("dropped_batches")
+        else:
+            replayed += 1
+
+    return replayed
+
+
+def replay_segment(path):
+    """
+    Store the batches of one segment and delete it.
+
+    The segment is skipped while another process holds its lock.  When the
+    database is unavailable the segment is kept and replayed again later,
+    from the batch that failed (see ``OFFSET_SUFFIX``), and a corrupt segment
+    is set aside after storing its readable records.  Batches the database
+    refuses are moved to a ``.refused`` file (rename it to ``.seg`` to replay
+    it once fixed), each of them once.  Returns the number of replayed
+    batches.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return 0
+
+    replayed = 0
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        # Skip segments deleted by another replayer between listing and locking
+        if os.fstat(fd).st_nlink == 0:
+            return 0
+
+        replayed = _replay_records(path, fd)
+        os.remove(path)
+        _remove_offset(path)
+    except BlockingIOError:
+        # Being appended to or replayed by another process
+        return 0
+    except RETRYABLE_ERRORS as e:
+        log.warning(f"Database unavailable while replaying {path}: {str(e)}")
+        _increment_stat("replay_failures")
+    except ValueError as e:
+        log.error(f"Spool segment {path} is corrupt ({e}), setting it aside")
+        os.rename(path, path + CORRUPT_SUFFIX)
+        _remove_offset(path)
+        _increment_stat("corrupt_segments")
+    finally:
+        os.close(fd)
+        # Replay threads open their own database connection
+        connection.close()
+
+    _increment_stat("replayed_batches", replayed)
+
+    return replayed
+
+
+def replay_spool(max_workers=REPLAY_CONCURRENCY):
+    """
+    Replay every spool segment into the hypertables, ``max_workers``
+    segments at a time.  Returns the number of replayed batches.
+    """
+    segments = _list_segments()
+    if not segments:
+        return 0
+
+    log.info(f"Replaying {len(segments)} spool segments")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(replay_segment, segments))
+
+
+def get_spool_stats():
+    """Return the state of the spool on disk and the spool counters."""
+    segments = _list_segment_times()
+
+    stats = {
+        "segments": len(segments),
+        "bytes": get_spool_size(),
+        "max_bytes": SPOOL_MAX_BYTES,
+        "oldest_segment_age": (
+            round(time.time() - segments[0][0]) if segments else None
+        ),
+        "corrupt_segments_on_disk": len(_list_segments(CORRUPT_SUFFIX)),
+        "refused_files_on_disk": len(_list_segments(REFUSED_SUFFIX)),
+    }
+
+    try:
+        counters = get_redis().hgetall(STATS_KEY)
+    except Exception:
+        counters = {}
+
+    for name, value in counters.items():
+        stats[name.decode()] = int(value)
+
+    return stats
@@ -0,0 +1,513 @@
+# storage.py
+
+import logging
+import os
+import time
+from datetime import timedelta
+
+from django.db import transaction
+
+log = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------- #
+#                              PERFORMANCE SETTINGS                            #
+# ---------------------------------------------------------------------------- #
+
+# Rows of this much time are copied per transaction (one hypertable chunk)
+COPY_WINDOW = timedelta(days=1)
+
+# Suffix of the table holding the new layout until the swap
+SHADOW_SUFFIX = "_new"
+
+# Chunks are compressed once all their rows are older than this
+COMPRESS_AFTER = timedelta(days=int(os.getenv("COMPRESS_AFTER_DAYS", "7")))
+
+# Compression layout of each hypertable. Rows are grouped by device and kept
+# in time order inside a compressed chunk, so time range filters skip whole
+# batches and TripsView's ORDER BY time needs no sort.
+COMPRESSION_SETTINGS = {
+    "wayfinder_location": {"segmentby": "device_id", "orderby": "time"},
+    "wayfinder_visit": {"segmentby": "device_id", "orderby": "time"},
+}
+
+
+def has_timescaledb(connection):
+    """Return True when the TimescaleDB extension is installed."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'")
+        return cursor.fetchone() is not None
+
+
+def get_chunk_interval(connection, table):
+    """Return the chunk interval of a hypertable, or None for a plain table."""
+    if not has_timescaledb(connection):
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT time_interval FROM timescaledb_information.dimensions "
+            "WHERE hypertable_name = %s AND column_name = 'time'",
+            [table],
+        )
+        row = cursor.fetchone()
+
+    return row[0] if row else None
+
+
+def _get_columns(cursor, table):
+    cursor.execute(
+        "SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass "
+        "AND attnum > 0 AND NOT attisdropped ORDER BY attnum",
+        [table],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _get_indexes(cursor, table):
+    """Return ``{(unique, definition): name}`` for the indexes of ``table``."""
+    cursor.execute(
+        "SELECT indexdef LIKE 'CREATE UNIQUE %%', "
+        "regexp_replace(indexdef, '^.* USING ', ''), indexname "
+        "FROM pg_indexes WHERE tablename = %s",
+        [table],
+    )
+    return {
+        (unique, definition): name for unique, definition, name in cursor.fetchall()
+    }
+
+
+def _names(connection, table):
+    quote_name = connection.ops.quote_name
+    shadow = f"{table}{SHADOW_SUFFIX}"
+    return {
+        "table": quote_name(table),
+        "shadow": quote_name(shadow),
+        "function": quote_name(f"{shadow}_mirror"),
+        "trigger": quote_name(f"{shadow}_mirror"),
+    }
+
+
+def _select_list(connection, all_columns, columns, prefix=""):
+    """Columns of the table, cast to the new types where they change."""
+    quote_name = connection.ops.quote_name
+    return ", ".join(
+        (
+            f"{prefix}{quote_name(column)}::{columns[column]}"
+            if column in columns
+            else f"{prefix}{quote_name(column)}"
+        )
+        for column in all_columns
+    )
+
+
+def prepare_table_rewrite(connection, table, columns):
+    """
+    Start an online change of column types: create ``<table>_new`` like
+    ``table`` (indexes, defaults, hypertable chunk interval) but with
+    ``columns`` (``{column: new type}``) changed, and a trigger that copies
+    rows inserted into ``table`` from now on.
+
+    Only an empty table is created, so this is quick whatever the size of
+    ``table``.  Safe to run again.
+    """
+    names = _names(connection, table)
+    quote_name = connection.ops.quote_name
+    chunk_interval = get_chunk_interval(connection, table)
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        all_columns = _get_columns(cursor, table)
+
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {names['shadow']} "
+            f"(LIKE {names['table']} INCLUDING ALL)"
+        )
+        cursor.execute(
+            f"ALTER TABLE {names['shadow']} "
+            + ", ".join(
+                f"ALTER COLUMN {quote_name(column)} TYPE {type_}"
+                for column, type_ in columns.items()
+            )
+        )
+
+        if chunk_interval is not None:
+            cursor.execute(
+                "SELECT create_hypertable(%s, 'time', chunk_time_interval => %s, "
+                "create_default_indexes => false, if_not_exists => true)",
+                [f"{table}{SHADOW_SUFFIX}", chunk_interval],
+            )
+
+        column_list = ", ".join(quote_name(column) for column in all_columns)
+        cursor.execute(
+            f"CREATE OR REPLACE FUNCTION {names['function']}() RETURNS trigger AS $$\n"
+            f"BEGIN\n"
+            f"    INSERT INTO {names['shadow']} ({column_list})\n"
+            f"    VALUES ({_select_list(connection, all_columns, columns, 'NEW.')})\n"
+            f"    ON CONFLICT DO NOTHING;\n"
+            f"    RETURN NULL;\n"
+            f"END;\n$$ LANGUAGE plpgsql"
+        )
+        cursor.execute(f"DROP TRIGGER IF EXISTS {names['trigger']} ON {names['table']}")
+        cursor.execute(
+            f"CREATE TRIGGER {names['trigger']} AFTER INSERT ON {names['table']} "
+            f"FOR EACH ROW EXECUTE FUNCTION {names['function']}()"
+        )
+
+
+def copy_table_rows(connection, table, columns, window=COPY_WINDOW):
+    """
+    Copy the existing rows of ``table`` to ``<table>_new``, one ``window``
+    of time at a time.
+
+    Each window is committed on its own, so writes to ``table`` are never
+    blocked.  Rows already copied are skipped, so an interrupted copy can
+    simply be run again.  Returns the number of copied rows.
+    """
+    names = _names(connection, table)
+    quote_name = connection.ops.quote_name
+    time_column = quote_name("time")
+
+    with connection.cursor() as cursor:
+        all_columns = _get_columns(cursor, table)
+        cursor.execute(
+            f"SELECT min({time_column}), max({time_column}) FROM {names['table']}"
+        )
+        start, end = cursor.fetchone()
+
+    if start is None:
+        return 0
+
+    column_list = ", ".join(quote_name(column) for column in all_columns)
+    select_list = _select_list(connection, all_columns, columns)
+
+    copied = 0
+    started = time.monotonic()
+
+    while start <= end:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {names['shadow']} ({column_list}) "
+                f"SELECT {select_list} FROM {names['table']} "
+                f"WHERE {time_column} >= %s AND {time_column} < %s "
+                f"ON CONFLICT DO NOTHING",
+                [start, start + window],
+            )
+            copied += cursor.rowcount
+        start += window
+
+    log.info(f"Copied {copied} rows of {table} in {time.monotonic() - started:.1f}s")
+
+    return copied
+
+
+def update_in_windows(connection, table, assignments, where=None, window=COPY_WINDOW):
+    """
+    Run ``UPDATE table SET assignments [WHERE where]`` one ``window`` of time
+    at a time, each in its own transaction, e.g. to backfill a new column
+    of a large hypertable without holding row locks on all of it.  Returns
+    the number of updated rows.
+    """
+    quote_name = connection.ops.quote_name
+    time_column = quote_name("time")
+    condition = f" AND ({where})" if where else ""
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT min({time_column}), max({time_column}) FROM {quote_name(table)}"
+        )
+        start, end = cursor.fetchone()
+
+    if start is None:
+        return 0
+
+    updated = 0
+    started = time.monotonic()
+
+    while start <= end:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {quote_name(table)} SET {assignments} "
+                f"WHERE {time_column} >= %s AND {time_column} < %s{condition}",
+                [start, start + window],
+            )
+            updated += cursor.rowcount
+        start += window
+
+    log.info(f"Updated {updated} rows of {table} in {time.monotonic() - started:.1f}s")
+
+    return updated
+
+
+def swap_rewritten_table(connection, table):
+    """
+    Replace ``table`` with ``<table>_new``.
+
+    Runs in one short transaction: the old table is dropped, and the new one
+    (with its indexes and id sequence) takes over its names.  The id
+    sequence continues from the old one.
+    """
+    names = _names(connection, table)
+    shadow = f"{table}{SHADOW_SUFFIX}"
+    quote_name = connection.ops.quote_name
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {names['table']} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"DROP TRIGGER IF EXISTS {names['trigger']} ON {names['table']}")
+        cursor.execute(f"DROP FUNCTION IF EXISTS {names['function']}()")
+
+        cursor.execute(
+            "SELECT pg_get_serial_sequence(%s, 'id'), pg_get_serial_sequence(%s, 'id')",
+            [table, shadow],
+        )
+        old_sequence, sequence = cursor.fetchone()
+        if sequence is None or sequence == old_sequence:
+            # A serial column, keep its sequence
+            cursor.execute(
+                f"ALTER SEQUENCE {old_sequence} OWNED BY {names['shadow']}.id"
+            )
+            sequence = None
+        else:
+            # An identity column, continue from the old sequence
+            cursor.execute(
+                f"SELECT setval(%s, last_value, is_called) FROM {old_sequence}",
+                [sequence],
+            )
+
+        old_indexes = _get_indexes(cursor, table)
+        cursor.execute(f"DROP TABLE {names['table']}")
+        cursor.execute(f"ALTER TABLE {names['shadow']} RENAME TO {names['table']}")
+
+        # Give the indexes and the sequence the names of the old ones
+        for key, index in _get_indexes(cursor, table).items():
+            if key in old_indexes and old_indexes[key] != index:
+                cursor.execute(
+                    f"ALTER INDEX {quote_name(index)} "
+                    f"RENAME TO {quote_name(old_indexes[key])}"
+                )
+        if sequence is not None:
+            cursor.execute(
+                f"ALTER SEQUENCE {sequence} " f"RENAME TO {old_sequence.split('.')[-1]}"
+            )
+
+
+def change_column_types(connection, table, columns, window=COPY_WINDOW):
+    """
+    Change the type of ``columns`` (``{column: new type}``) of a large table
+    while it keeps receiving rows.
+
+    ``ALTER COLUMN ... TYPE`` would rewrite the table under an exclusive
+    lock, and adding converted columns would leave the old values on disk.
+    Instead the rows are copied to a new table with the new types, one chunk
+    at a time (see ``prepare_table_rewrite``, ``copy_table_rows`` and
+    ``swap_rewritten_table``).  Needs room for a second copy of the table
+    while it runs.
+    """
+    prepare_table_rewrite(connection, table, columns)
+    copy_table_rows(connection, table, columns, window)
+    swap_rewritten_table(connection, table)
+
+
+def _get_chunks(cursor, table, compressed, older_than=None):
+    """
+    Return the chunks of a hypertable that are (or are not) compressed,
+    oldest first, optionally only those entirely older than ``older_than``.
+    """
+    query = (
+        "SELECT format('%%I.%%I', chunk_schema, chunk_name) "
+        "FROM timescaledb_information.chunks "
+        "WHERE hypertable_name = %s AND is_compressed = %s"
+    )
+    params = [table, compressed]
+    if older_than is not None:
+        query += " AND range_end <= now() - %s"
+        params.append(older_than)
+
+    cursor.execute(query + " ORDER BY range_start", params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def compression_enabled(connection, table):
+    """Return True when native compression is enabled on a hypertable."""
+    if get_chunk_interval(connection, table) is None:
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT compression_enabled FROM timescaledb_information.hypertables "
+            "WHERE hypertable_name = %s",
+            [table],
+        )
+        return cursor.fetchone()[0]
+
+
+def enable_compression(
+    connection, table, segmentby, orderby, compress_after=COMPRESS_AFTER
+):
+    """
+    Enable native compression of a hypertable and add a policy that
+    compresses its chunks once they are older than ``compress_after``.
+
+    The policy runs as a TimescaleDB background job.  Compressed chunks can
+    still be queried, and rows can still be inserted into them (e.g. a late
+    Overland upload or ``import_overland``), which needs TimescaleDB 2.11+
+    because of the unique ``time`` constraint.  Running it again replaces
+    the policy, e.g. with a new ``compress_after``.
+
+    Returns False when ``table`` is not a hypertable.
+    """
+    if get_chunk_interval(connection, table) is None:
+        return False
+
+    quote_name = connection.ops.quote_name
+
+    # The layout can't change once chunks are compressed, keep it
+    enabled = compression_enabled(connection, table)
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if not enabled:
+            cursor.execute(
+                f"ALTER TABLE {quote_name(table)} SET (timescaledb.compress, "
+                f"timescaledb.compress_segmentby = %s, "
+                f"timescaledb.compress_orderby = %s)",
+                [segmentby, orderby],
+            )
+        cursor.execute(
+            "SELECT remove_compression_policy(%s, if_exists => true)", [table]
+        )
+        cursor.execute(
+            "SELECT add_compression_policy(%s, compress_after => %s)",
+            [table, compress_after],
+        )
+
+    log.info(f"Enabled compression of {table} chunks older than {compress_after}")
+
+    return True
+
+
+def disable_compression(connection, table):
+    """
+    Remove the compression policy of a hypertable, decompress its chunks
+    and disable compression.  Needs room for the uncompressed chunks.
+
+    Returns False when ``table`` is not a hypertable.
+    """
+    if get_chunk_interval(connection, table) is None:
+        return False
+
+    quote_name = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT remove_compression_policy(%s, if_exists => true)", [table]
+        )
+        chunks = _get_chunks(cursor, table, compressed=True)
+
+    # One chunk per transaction, so the table is never locked for long
+    for chunk in chunks:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute("SELECT decompress_chunk(%s::regclass)", [chunk])
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE {quote_name(table)} SET (timescaledb.compress = false)"
+        )
+
+    log.info(f"Disabled compression of {table}")
+
+    return True
+
+
+def compress_chunks(connection, table, older_than=COMPRESS_AFTER):
+    """
+    Compress the chunks of ``table`` older than ``older_than`` now, instead
+    of waiting for the policy.  Returns the number of chunks compressed.
+    """
+    if get_chunk_interval(connection, table) is None:
+        return 0
+
+    with connection.cursor() as cursor:
+        chunks = _get_chunks(cursor, table, compressed=False, older_than=older_than)
+
+    started = time.monotonic()
+
+    for chunk in chunks:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute("SELECT compress_chunk(%s::regclass)", [chunk])
+
+    log.info(
+        f"Compressed {len(chunks)} chunks of {table} "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+
+    return len(chunks)
+
+
+def get_compression_stats(connection, table):
+    """
+    Return the number of chunks of a hypertable, how many are compressed and
+    their size before and after compression, or None when compression is
+    not available.
+    """
+    if get_chunk_interval(connection, table) is None:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM show_chunks(%s)", [table])
+        total_chunks = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT number_compressed_chunks, before_compression_total_bytes, "
+            "after_compression_total_bytes FROM hypertable_compression_stats(%s)",
+            [table],
+        )
+        row = cursor.fetchone()
+
+    compressed_chunks, before, after = row or (None, None, None)
+
+    return {
+        "chunks": total_chunks,
+        "compressed_chunks": compressed_chunks or 0,
+        "bytes_before_compression": before,
+        "bytes_after_compression": after,
+    }
+
+
+def get_table_size(connection, table):
+    """
+    Return the number of rows of ``table`` and its total size in bytes,
+    including indexes and, for hypertables, every chunk.
+    """
+    quote_name = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {quote_name(table)}")
+        rows = cursor.fetchone()[0]
+
+        if has_timescaledb(connection):
+            cursor.execute("SELECT hypertable_size(%s::regclass)", [table])
+            size = cursor.fetchone()[0]
+        else:
+            size = None
+
+        if size is None:
+            # Plain table
+            cursor.execute("SELECT pg_total_relation_size(%s::regclass)", [table])
+            size = cursor.fetchone()[0]
+
+    return rows, size
+
+
+def get_column_sizes(connection, table, columns):
+    """Return the average stored size in bytes of each of ``columns``."""
+    quote_name = connection.ops.quote_name
+    averages = ", ".join(
+        f"avg(pg_column_size({quote_name(column)}))" for column in columns
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {averages} FROM {quote_name(table)}")
+        values = cursor.fetchone()
+
+    return {
+        column: round(float(value), 1) if value is not None else None
+        for column, value in zip(columns, values)
+    }
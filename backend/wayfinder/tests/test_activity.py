@@ -0,0 +1,120 @@
+# test_activity.py
+
+import json
+from collections import Counter
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from wayfinder.aggregates import ACTIVITY_AGGREGATES, REFRESH_INTERVAL
+from wayfinder.models import Location, UserSettings
+from wayfinder.storage import has_timescaledb
+from wayfinder.tests.test_tiers import START, make_location
+
+# Half-hour UTC offset, so days don't start on an hour
+HOME_TIMEZONE = ZoneInfo("Asia/Kolkata")
+
+
+def create_activity():
+    """A user in ``HOME_TIMEZONE`` and a location every 10 minutes for 30 hours."""
+    user = User.objects.create_user("user", password="password")
+    UserSettings.objects.create(user=user, home_timezone=str(HOME_TIMEZONE))
+    Location.objects.bulk_create(
+        [make_location(START + timedelta(minutes=10 * i)) for i in range(180)]
+    )
+    return user
+
+
+class ActivityHistoryTestsMixin:
+    """The daily counts must be the raw rows counted per day of the user."""
+
+    def get_history(self):
+        self.client.force_login(self.user)
+        response = self.client.get(
+            "/wayfinder/activity/history/",
+            {"start_date": "2025-01-04", "end_date": "2025-01-07"},
+        )
+        self.assertEqual(response.status_code, 200)
+        return {
+            day["date"]: day["location_count"]
+            for day in json.loads(response.content)["data"]
+        }
+
+    def expected_history(self):
+        counts = Counter(
+            time.astimezone(HOME_TIMEZONE).date().isoformat()
+            for time in Location.objects.values_list("time", flat=True)
+        )
+        return {
+            date: counts[date]
+            for date in ("2025-01-04", "2025-01-05", "2025-01-06", "2025-01-07")
+        }
+
+    def test_daily_counts(self):
+        self.assertEqual(self.get_history(), self.expected_history())
+
+
+class ActivityHistoryTests(ActivityHistoryTestsMixin, TestCase):
+    """The activity buckets aggregated at query time (or in real time)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_activity()
+
+
+class TimescaleDBActivityHistoryTests(ActivityHistoryTestsMixin, TransactionTestCase):
+    """
+    The activity buckets materialized by TimescaleDB, including rows stored
+    late in buckets that were already materialized.
+    """
+
+    def setUp(self):
+        if not has_timescaledb(connection):
+            self.skipTest("TimescaleDB is not installed")
+
+        self.user = create_activity()
+        self.refresh()
+
+    def refresh(self):
+        with connection.cursor() as cursor:
+            for view in ACTIVITY_AGGREGATES:
+                cursor.execute(
+                    "CALL refresh_continuous_aggregate(%s, NULL, NULL)", [view]
+                )
+
+    def test_late_rows(self):
+        Location.objects.bulk_create([make_location(START + timedelta(minutes=5))])
+        # Counted once the refresh policy recomputes their bucket
+        self.refresh()
+        self.assertEqual(self.get_history(), self.expected_history())
+
+    def test_refresh_policies(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT view_name, materialized_only, "
+                "materialization_hypertable_name "
+                "FROM timescaledb_information.continuous_aggregates "
+                "WHERE view_name = ANY(%s)",
+                [list(ACTIVITY_AGGREGATES)],
+            )
+            aggregates = cursor.fetchall()
+            self.assertEqual(
+                sorted(view for view, *_ in aggregates), sorted(ACTIVITY_AGGREGATES)
+            )
+
+            for view, materialized_only, table in aggregates:
+                with self.subTest(view=view):
+                    self.assertFalse(materialized_only)
+                    cursor.execute(
+                        "SELECT schedule_interval, config "
+                        "FROM timescaledb_information.jobs "
+                        "WHERE proc_name = 'policy_refresh_continuous_aggregate' "
+                        "AND hypertable_name = %s",
+                        [table],
+                    )
+                    schedule_interval, config = cursor.fetchone()
+                    self.assertEqual(schedule_interval, REFRESH_INTERVAL)
+                    self.assertIsNone(config["start_offset"])
@@ -0,0 +1,95 @@
+# test_cache.py
+
+from datetime import datetime, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
+
+import redis
+from django.test import SimpleTestCase, TestCase
+
+from wayfinder import cache
+from wayfinder.ingestion import parse_overland_features, store_overland_batch
+from wayfinder.renderers import GeoJSONRenderer
+from wayfinder.tests.test_validators import location_feature
+
+START = datetime(2025, 1, 5, 8, tzinfo=dt_timezone.utc)
+END = datetime(2025, 1, 6, 8, tzinfo=dt_timezone.utc)
+
+
+def make_client(*results):
+    """A Redis client whose pipelines return ``results``, one per execute."""
+    client = mock.MagicMock()
+    pipe = client.pipeline.return_value.__enter__.return_value
+    pipe.execute.side_effect = list(results)
+    return client
+
+
+def cached_range():
+    request = SimpleNamespace(
+        query_params={"start_datetime": START.isoformat()},
+        accepted_media_type="application/json",
+        accepted_renderer=GeoJSONRenderer(),
+    )
+    return cache.CachedRange(request, "trips", START, END)
+
+
+@mock.patch.object(cache, "CACHE_ENABLED", True)
+class PendingInvalidationTests(SimpleTestCase):
+    """
+    Times whose invalidation failed must be invalidated again, and the cache
+    must not be used until they are.
+    """
+
+    def setUp(self):
+        self.addCleanup(cache._pending_times.clear)
+
+    def test_failed_invalidation_is_retried(self):
+        client = make_client()
+        client.incr.side_effect = redis.ConnectionError("unavailable")
+        with mock.patch.object(cache, "get_redis", return_value=client):
+            self.assertEqual(cache.invalidate_times([START]), 0)
+            self.assertFalse(cache.retry_invalidations())
+
+            # Neither read nor stored while the entries may be stale
+            entry = cached_range()
+            self.assertIsNone(entry.response)
+            self.assertIsNone(entry.generation)
+
+        client = make_client([set()], [b"3", {}])
+        with mock.patch.object(cache, "get_redis", return_value=client):
+            entry = cached_range()
+
+        client.incr.assert_called_once_with(cache.GENERATION_KEY)
+        client.pipeline.return_value.__enter__.return_value.smembers.assert_called_once_with(
+            cache.INDEX_KEY.format("2025-01")
+        )
+        self.assertTrue(cache.retry_invalidations())
+        self.assertEqual(entry.generation, 3)
+
+    def test_pending_times_are_invalidated_with_the_next_ones(self):
+        member = f"{cache.epoch_time(START)}:{cache.epoch_time(START)}:entry".encode()
+        client = make_client()
+        client.incr.side_effect = redis.ConnectionError("unavailable")
+        with mock.patch.object(cache, "get_redis", return_value=client):
+            cache.invalidate_times([START])
+
+        client = make_client([{member}], [1, 1])
+        with mock.patch.object(cache, "get_redis", return_value=client):
+            self.assertEqual(cache.invalidate_times([END]), 1)
+        self.assertEqual(cache._pending_times, set())
+
+
+class InvalidationOnCommitTests(TestCase):
+    """Cached responses must only be invalidated once the rows are committed."""
+
+    @mock.patch("wayfinder.cache.invalidate_times")
+    def test_store_overland_batch(self, invalidate_times):
+        batch = parse_overland_features([location_feature()])
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            store_overland_batch(batch, timeout=None)
+            invalidate_times.assert_not_called()
+
+        self.assertEqual(len(callbacks), 1)
+        invalidate_times.assert_called_once_with(
+            [row["time"] for row in batch["locations"]]
+        )
@@ -0,0 +1,156 @@
+# test_formats.py
+
+import io
+import json
+import struct
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from wayfinder.columns import LocationColumns, epoch_time
+from wayfinder.formats import arrow_trips, flatgeobuf_trips, pyarrow
+from wayfinder.tests.test_trips import make_locations, make_visits
+from wayfinder.utils import get_sorted_visit_midtimes, segment_trips_by_midtimes
+
+try:
+    import pyogrio.raw
+except ImportError:
+    pyogrio = None
+
+METADATA = json.dumps({"meta": {"total_locations": 3}})
+
+
+def to_epoch_columns(locations):
+    return LocationColumns(
+        [epoch_time(location["time"]) for location in locations],
+        [location["longitude"] for location in locations],
+        [location["latitude"] for location in locations],
+        epoch=True,
+    )
+
+
+def read_linestring_m(wkb):
+    """The ``(x, y, m)`` points of a little-endian ISO WKB LineString M."""
+    byte_order, geometry_type, count = struct.unpack_from("<BII", wkb)
+    assert (byte_order, geometry_type) == (1, 2002)
+    return list(struct.iter_unpack("<ddd", wkb[9 : 9 + 24 * count]))
+
+
+class TripFormatsTests(SimpleTestCase):
+    """
+    The binary trip formats, read back by their reference readers, must hold
+    every point of every trip, including trips sharing points because
+    overlapping visits have midtimes out of order.
+    """
+
+    cases = [
+        {"count": 300, "visits": 0, "overlapping": False},
+        {"count": 300, "visits": 10, "overlapping": False},
+        {"count": 300, "visits": 10, "overlapping": True},
+        {"count": 40, "visits": 30, "overlapping": True},
+        {"count": 1, "visits": 3, "overlapping": False},
+    ]
+
+    def trips(self):
+        """The case, columns and trip segments of each case."""
+        trips = []
+        for seed, case in enumerate(self.cases):
+            locations = make_locations(case["count"], seed)
+            visits = make_visits(locations, case["visits"], seed, case["overlapping"])
+            columns = to_epoch_columns(locations)
+            segments = segment_trips_by_midtimes(
+                columns, get_sorted_visit_midtimes(visits)
+            )
+            trips.append((case, columns, segments))
+        return trips
+
+    def test_segments_overlap(self):
+        # Otherwise the formats are not tested with overlapping trips
+        overlapping = 0
+        for _, columns, segments in self.trips():
+            points = sum(end - start for _, start, end in segments)
+            overlapping += points > len(columns)
+        self.assertGreater(overlapping, 0)
+
+    @skipUnless(pyarrow, "pyarrow is not installed")
+    def test_arrow(self):
+        for case, columns, segments in self.trips():
+            with self.subTest(case=case):
+                data = arrow_trips(columns, segments, metadata=METADATA)
+                table = pyarrow.ipc.open_stream(data).read_all()
+
+                self.assertEqual(table.schema.metadata[b"wayfinder"], METADATA.encode())
+                self.assertEqual(
+                    list(
+                        zip(
+                            table.column("trip").to_pylist(),
+                            table.column("time").cast(pyarrow.int64()).to_pylist(),
+                            table.column("longitude").to_pylist(),
+                            table.column("latitude").to_pylist(),
+                        )
+                    ),
+                    [
+                        (
+                            trip_id,
+                            columns.times[i],
+                            columns.longitudes[i],
+                            columns.latitudes[i],
+                        )
+                        for trip_id, start, end in segments
+                        for i in range(start, end)
+                    ],
+                )
+
+    @skipUnless(pyarrow, "pyarrow is not installed")
+    def test_arrow_empty(self):
+        table = pyarrow.ipc.open_stream(
+            arrow_trips(LocationColumns(epoch=True), [])
+        ).read_all()
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.schema.names, ["trip", "time", "longitude", "latitude"])
+
+    @skipUnless(pyogrio and pyarrow, "pyogrio is not installed")
+    def test_flatgeobuf(self):
+        for case, columns, segments in self.trips():
+            with self.subTest(case=case):
+                self.assertFlatGeobuf(columns, segments)
+
+    def assertFlatGeobuf(self, columns, segments):
+        data = b"".join(flatgeobuf_trips(columns, segments, metadata=METADATA))
+
+        info = pyogrio.read_info(io.BytesIO(data))
+        self.assertEqual(info["driver"], "FlatGeobuf")
+        self.assertEqual(info["crs"], "EPSG:4326")
+        self.assertEqual(info["features"], len(segments))
+        self.assertEqual(
+            info["total_bounds"],
+            (
+                min(columns.longitudes),
+                min(columns.latitudes),
+                max(columns.longitudes),
+                max(columns.latitudes),
+            ),
+        )
+
+        _, table = pyogrio.raw.read_arrow(io.BytesIO(data))
+        self.assertEqual(
+            table.column("trip_id").to_pylist(),
+            [trip_id for trip_id, _, _ in segments],
+        )
+        self.assertEqual(
+            [
+                read_linestring_m(wkb)
+                for wkb in table.column("wkb_geometry").to_pylist()
+            ],
+            [
+                [
+                    (
+                        columns.longitudes[i],
+                        columns.latitudes[i],
+                        columns.times[i] / 1e6,
+                    )
+                    for i in range(start, end)
+                ]
+                for _, start, end in segments
+            ],
+        )
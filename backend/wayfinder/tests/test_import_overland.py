@@ -0,0 +1,63 @@
+# test_import_overland.py
+
+import json
+import os
+import tempfile
+
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+from wayfinder.management.commands import import_overland
+from wayfinder.tests.test_validators import location_feature
+
+
+class ReadFeaturesTests(SimpleTestCase):
+    """
+    Every file format must yield the same features, read one at a time
+    instead of parsing the whole file first.
+    """
+
+    features = [location_feature(i) for i in range(5)]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def read(self, path):
+        return list(import_overland.Command().read_features(path))
+
+    def test_formats(self):
+        files = {
+            "body.json": json.dumps({"locations": self.features}),
+            "body-indented.json": json.dumps({"locations": self.features}, indent=2),
+            "collection.json": json.dumps(
+                {"type": "FeatureCollection", "features": self.features}
+            ),
+            "list.json": json.dumps(self.features, indent=2),
+            "features.ndjson": "\n".join(map(json.dumps, self.features)) + "\n",
+            "blank-lines.ndjson": "\n\n" + "\n\n".join(map(json.dumps, self.features)),
+        }
+        for name, text in files.items():
+            with self.subTest(name=name):
+                self.assertEqual(self.read(self.write(name, text)), self.features)
+
+    def test_features_are_yielded_before_the_end_is_read(self):
+        # A document broken after its first features still yields them first
+        text = json.dumps({"locations": self.features})[:-20]
+        features = import_overland.Command().read_features(self.write("cut.json", text))
+        self.assertEqual(next(features), self.features[0])
+        with self.assertRaises(CommandError):
+            list(features)
+
+    def test_unrecognised_documents(self):
+        for text in ('{"type": "Feature", "points": [1, 2]', '{"other": [1]}'):
+            with self.subTest(text=text):
+                with self.assertRaises(CommandError):
+                    self.read(self.write("other.json", text))
@@ -0,0 +1,130 @@
+# test_metrics.py
+
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from wayfinder import metrics
+
+
+class RedisTotalsTests(SimpleTestCase):
+    """
+    The totals read back from the Redis hashes, with the updates of several
+    processes added up, must render like the same updates made in one.
+    """
+
+    def make_metrics(self):
+        counter = metrics.Counter("test_counter", "Test counter", ["kind"])
+        histogram = metrics.Histogram("test_seconds", "Test histogram", ["stage"])
+        self.addCleanup(metrics.REGISTRY.remove, counter)
+        self.addCleanup(metrics.REGISTRY.remove, histogram)
+        return counter, histogram
+
+    def update(self, counter, histogram, seed):
+        counter.inc(kind="location")
+        counter.inc(seed + 3, kind="visit")
+        counter.inc(0.5, kind=200)
+        for i in range(20):
+            # Exact in binary, so the sums don't depend on the order
+            histogram.observe((seed + i) / 64, stage="insert")
+        histogram.observe(30, stage="request")
+
+    def test_totals_of_several_processes(self):
+        counter, histogram = self.make_metrics()
+        expected_counter, expected_histogram = self.make_metrics()
+
+        # HINCRBY and HINCRBYFLOAT on the hash of each metric
+        hashes = {counter: {}, histogram: {}}
+        with mock.patch.object(metrics, "flush_metrics"):
+            for seed in range(3):
+                self.update(counter, histogram, seed)
+                self.update(expected_counter, expected_histogram, seed)
+                for metric, fields in hashes.items():
+                    for field, amount in metric.fields(metric.take()):
+                        fields[field] = fields.get(field, 0) + amount
+
+        for metric, expected in (
+            (counter, expected_counter),
+            (histogram, expected_histogram),
+        ):
+            with self.subTest(metric=metric.name):
+                fields = {
+                    field.encode(): str(amount).encode()
+                    for field, amount in hashes[metric].items()
+                }
+                self.assertEqual(metric.values, {})
+                self.assertEqual(metric.render(metric.load(fields)), expected.render())
+
+    def test_restore(self):
+        counter, histogram = self.make_metrics()
+        expected_counter, expected_histogram = self.make_metrics()
+
+        with mock.patch.object(metrics, "flush_metrics"):
+            self.update(counter, histogram, 0)
+            taken = [counter.take(), histogram.take()]
+            self.update(counter, histogram, 1)
+            counter.restore(taken[0])
+            histogram.restore(taken[1])
+
+            self.update(expected_counter, expected_histogram, 0)
+            self.update(expected_counter, expected_histogram, 1)
+
+        self.assertEqual(counter.render(), expected_counter.render())
+        self.assertEqual(histogram.render(), expected_histogram.render())
+
+    def test_flushed_by_a_thread(self):
+        counter, _ = self.make_metrics()
+        flushed = threading.Event()
+        threads = []
+
+        def flush_metrics():
+            threads.append(threading.current_thread())
+            flushed.set()
+
+        with mock.patch.object(metrics, "_flusher_pid", None), mock.patch.object(
+            metrics, "FLUSH_INTERVAL", 0.01
+        ), mock.patch.object(metrics, "flush_metrics", flush_metrics):
+            counter.inc(kind="location")
+            self.assertTrue(flushed.wait(5))
+
+        self.assertEqual(threads[0].name, "metrics-flush")
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
+@mock.patch("wayfinder.views.render_metrics", lambda: "wayfinder_up 1\n")
+class MetricsViewTests(TestCase):
+    """/metrics/ must never be readable without the token or a staff user."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("user", password="password")
+        cls.staff = User.objects.create_user(
+            "staff", password="password", is_staff=True
+        )
+
+    def test_without_token(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 401)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get("/metrics/").status_code, 403)
+
+        self.client.force_login(self.staff)
+        response = self.client.get("/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"wayfinder_up 1\n")
+
+    @mock.patch("wayfinder.views.METRICS_TOKEN", "secret")
+    def test_with_token(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 401)
+        self.assertEqual(
+            self.client.get("/metrics/", HTTP_AUTHORIZATION="Bearer wrong").status_code,
+            401,
+        )
+
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get("/metrics/").status_code, 401)
+
+        response = self.client.get("/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
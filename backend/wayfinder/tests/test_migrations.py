@@ -0,0 +1,69 @@
+# test_migrations.py
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TransactionTestCase
+from django_celery_beat.models import PeriodicTask
+
+from wayfinder.models import Location, LocationActivity, TripPoints1h
+from wayfinder.tests.test_tiers import create_trip_locations
+
+
+class MigrationRoundTripTests(TransactionTestCase):
+    """
+    Migrations 0011 to 0015 (compact columns, compression, continuous
+    aggregates, trip tiers, motion mask) must be reversible and apply again
+    on a database holding rows, without losing any.
+    """
+
+    def tearDown(self):
+        # Leave the latest schema to the other tests, even after a failure
+        call_command("migrate", "wayfinder", verbosity=0)
+
+    def migrate(self, *target):
+        call_command("migrate", "wayfinder", *target, verbosity=0)
+
+    def count_rows(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {connection.ops.quote_name(table)}")
+            return cursor.fetchone()[0]
+
+    def test_round_trip(self):
+        create_trip_locations()
+        count = Location.objects.count()
+
+        self.migrate("0010")
+        self.assertEqual(self.count_rows("wayfinder_location"), count)
+        self.assertEqual(self.count_rows("wayfinder_dailyactivitysummary"), 0)
+
+        self.migrate()
+        self.assertEqual(Location.objects.count(), count)
+        moving = Location.objects.filter(moving=True).count()
+        self.assertEqual(moving, 720)
+        self.assertEqual(
+            TripPoints1h.objects.aggregate(points=Sum("points"))["points"], moving
+        )
+        self.assertEqual(
+            LocationActivity.objects.aggregate(count=Sum("location_count"))["count"],
+            count,
+        )
+
+    def test_activity_summary_task(self):
+        # Reverting 0013 schedules the nightly summary it replaced again
+        self.migrate("0012")
+        task = PeriodicTask.objects.get(name="compute-daily-activity-summary")
+        self.assertEqual(task.task, "wayfinder.tasks.compute_daily_activity_summary")
+        self.assertEqual((task.crontab.hour, task.crontab.minute), ("4", "0"))
+
+        self.migrate()
+        self.assertFalse(
+            PeriodicTask.objects.filter(name="compute-daily-activity-summary").exists()
+        )
+
+        # Reverting again after 0013 deleted it
+        self.migrate("0012")
+        self.assertEqual(
+            PeriodicTask.objects.filter(name="compute-daily-activity-summary").count(),
+            1,
+        )
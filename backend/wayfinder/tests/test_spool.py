@@ -0,0 +1,123 @@
+# test_spool.py
+
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.db import IntegrityError, OperationalError
+from django.test import SimpleTestCase
+
+from wayfinder import spool
+
+
+class ReplaySegmentTests(SimpleTestCase):
+    """
+    A batch the database refuses must not keep the rest of its segment from
+    being stored, while an unavailable database keeps the whole segment.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        for patcher in (
+            mock.patch.object(spool, "SPOOL_DIR", directory.name),
+            mock.patch.object(spool, "_increment_stat"),
+            mock.patch.object(spool, "parse_overland_features", lambda batch: batch),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        writer = spool.SegmentWriter()
+        for i in range(3):
+            writer.append(json.dumps([{"batch": i}]))
+        self.path = writer.path
+
+    def replay(self, *side_effect):
+        with mock.patch.object(
+            spool, "store_overland_batch", side_effect=side_effect
+        ) as store:
+            replayed = spool.replay_segment(self.path)
+        return replayed, [call.args[0] for call in store.call_args_list]
+
+    def test_refused_batch_is_set_aside(self):
+        replayed, stored = self.replay(None, IntegrityError("duplicate"), None)
+
+        self.assertEqual(replayed, 2)
+        self.assertEqual(len(stored), 3)
+        self.assertFalse(os.path.exists(self.path))
+
+        fd = os.open(self.path + spool.REFUSED_SUFFIX, os.O_RDONLY)
+        try:
+            self.assertEqual(list(spool.read_segment(fd)), ['[{"batch": 1}]'])
+        finally:
+            os.close(fd)
+
+    def test_unavailable_database_keeps_segment(self):
+        replayed, stored = self.replay(None, OperationalError("connection refused"))
+
+        self.assertEqual(replayed, 0)
+        self.assertEqual(len(stored), 2)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + spool.REFUSED_SUFFIX))
+
+    def test_kept_segment_resumes_after_the_stored_batches(self):
+        replayed, stored = self.replay(
+            IntegrityError("duplicate"), OperationalError("connection refused")
+        )
+        self.assertEqual((replayed, len(stored)), (0, 2))
+        self.assertTrue(os.path.exists(self.path))
+
+        # Only the batch that failed and the ones after it are replayed, the
+        # refused one is not set aside again
+        replayed, stored = self.replay(None, None)
+        self.assertEqual(replayed, 2)
+        self.assertEqual(stored, [[{"batch": 1}], [{"batch": 2}]])
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + spool.OFFSET_SUFFIX))
+
+        fd = os.open(self.path + spool.REFUSED_SUFFIX, os.O_RDONLY)
+        try:
+            self.assertEqual(list(spool.read_segment(fd)), ['[{"batch": 0}]'])
+        finally:
+            os.close(fd)
+
+
+class ListSegmentsTests(SimpleTestCase):
+    """A segment replayed while the spool is listed must not fail the listing."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        patcher = mock.patch.object(spool, "SPOOL_DIR", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.paths = []
+        for i in range(3):
+            writer = spool.SegmentWriter()
+            writer.append(json.dumps([{"batch": i}]))
+            self.paths.append(writer.path)
+
+    def test_segment_deleted_after_listdir(self):
+        listdir = os.listdir
+
+        def listdir_then_replay(path):
+            names = listdir(path)
+            if os.path.exists(self.paths[0]):
+                os.remove(self.paths[0])
+            return names
+
+        with mock.patch.object(spool.os, "listdir", listdir_then_replay):
+            self.assertEqual(spool._list_segments(), self.paths[1:])
+
+        self.paths[0] = self.paths[1]
+        with mock.patch.object(spool.os, "listdir", listdir_then_replay):
+            self.assertEqual(spool.get_spool_size(), os.path.getsize(self.paths[2]))
+            with mock.patch.object(spool, "get_redis", side_effect=Exception):
+                stats = spool.get_spool_stats()
+
+        self.assertEqual(stats["segments"], 1)
+        self.assertIsNotNone(stats["oldest_segment_age"])
@@ -0,0 +1,178 @@
+# test_tiers.py
+
+import json
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from wayfinder.aggregates import TRIP_TIER_VIEWS, floor_to_bucket
+from wayfinder.models import TRIP_TIERS, Location, TripPoints1h
+from wayfinder.shards import get_point_buckets
+from wayfinder.storage import has_timescaledb
+
+START = datetime(2025, 1, 5, 8, tzinfo=dt_timezone.utc)
+
+# Ranges starting and ending inside buckets of every tier, or on their edges
+RANGES = [
+    (START + timedelta(minutes=30, seconds=5), START + timedelta(hours=3, minutes=31)),
+    (START + timedelta(minutes=30), START + timedelta(hours=3)),
+    (START + timedelta(seconds=45), START + timedelta(minutes=50)),
+    (START + timedelta(minutes=7), START + timedelta(minutes=8, seconds=3)),
+]
+
+
+def make_location(time, **fields):
+    fields = {"motion": ["driving"], "moving": True, **fields}
+    return Location(
+        time=time,
+        longitude=-4.28 + (time - START).total_seconds() * 1e-5,
+        latitude=38.66,
+        altitude=8,
+        battery_level=0.5,
+        battery_state="unplugged",
+        course=10,
+        course_accuracy=2,
+        horizontal_accuracy=5,
+        speed=3,
+        speed_accuracy=1,
+        vertical_accuracy=3,
+        wifi="",
+        **fields,
+    )
+
+
+def create_trip_locations():
+    """A moving location every 20 seconds for 4 hours, and stationary ones."""
+    locations = [make_location(START + timedelta(seconds=20 * i)) for i in range(720)]
+    # Stationary locations are not trip points
+    locations += [
+        make_location(
+            START + timedelta(seconds=20 * i + 10),
+            motion=["stationary"],
+            moving=False,
+        )
+        for i in range(0, 720, 7)
+    ]
+    Location.objects.bulk_create(locations)
+
+
+class TripTierTestsMixin:
+    """
+    A range starting inside a bucket must keep the points of that bucket,
+    even though the first point of the bucket is before the range.
+    """
+
+    def test_point_buckets(self):
+        queryset = Location.objects.filter(moving=True)
+        times = list(queryset.values_list("time", flat=True))
+        for start, end in RANGES:
+            for tier in TRIP_TIERS:
+                with self.subTest(start=start, end=end, tier=tier.__name__):
+                    expected = Counter(
+                        floor_to_bucket(time, tier.bucket_width)
+                        for time in times
+                        if start <= time <= end
+                    )
+                    self.assertEqual(
+                        get_point_buckets(queryset, start, end, tier),
+                        sorted(expected.items()),
+                    )
+
+    def get_trip_times(self, start, end, page_size):
+        """The times of every trip point of the range, page after page."""
+        self.client.force_login(self.user)
+        params = {
+            "start_datetime": start.isoformat(),
+            "end_datetime": end.isoformat(),
+            "page_size": page_size,
+        }
+        times = []
+        bucket_sizes = set()
+        while True:
+            response = self.client.get("/wayfinder/trips/", params)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(b"".join(response.streaming_content))
+            for trip in data["trips"]["features"]:
+                times.extend(trip["properties"]["times"])
+            bucket_sizes.add(data["meta"].get("bucket_size"))
+            if not data["pagination"]["next_cursor"]:
+                return times, bucket_sizes
+            params["cursor"] = data["pagination"]["next_cursor"]
+
+    def test_trips_from_tier(self):
+        start, end = RANGES[0]
+        times, bucket_sizes = self.get_trip_times(start, end, page_size=2)
+        self.assertEqual(bucket_sizes, {TripPoints1h.bucket_size})
+
+        # The first moving location of the range, then the first one of each
+        # hour after it
+        first = Location.objects.filter(moving=True, time__gte=start)
+        expected = [first.order_by("time").first().time] + [
+            START + timedelta(hours=hours) for hours in (1, 2, 3)
+        ]
+        self.assertEqual(times, [time.isoformat() for time in expected])
+
+
+class TripTierEdgeTests(TripTierTestsMixin, TestCase):
+    """The tiers aggregated at query time (or in real time by TimescaleDB)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("user", password="password")
+        create_trip_locations()
+
+
+class TimescaleDBTripTierTests(TripTierTestsMixin, TransactionTestCase):
+    """
+    The tiers materialized by TimescaleDB: hierarchical continuous
+    aggregates, each refreshed from the one below it.
+    """
+
+    def setUp(self):
+        if not has_timescaledb(connection):
+            self.skipTest("TimescaleDB is not installed")
+
+        self.user = User.objects.create_user("user", password="password")
+        create_trip_locations()
+
+        # Finest first, each tier is refreshed from the previous one
+        with connection.cursor() as cursor:
+            for view, _ in TRIP_TIER_VIEWS:
+                cursor.execute(
+                    "CALL refresh_continuous_aggregate(%s, NULL, NULL)", [view]
+                )
+
+    def test_tiers_are_materialized(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT view_name, materialized_only, materialization_hypertable_schema, "
+                "materialization_hypertable_name "
+                "FROM timescaledb_information.continuous_aggregates "
+                "WHERE view_name = ANY(%s)",
+                [[view for view, _ in TRIP_TIER_VIEWS]],
+            )
+            aggregates = cursor.fetchall()
+            self.assertEqual(
+                sorted(view for view, *_ in aggregates),
+                sorted(view for view, _ in TRIP_TIER_VIEWS),
+            )
+            for view, materialized_only, schema, table in aggregates:
+                with self.subTest(view=view):
+                    self.assertFalse(materialized_only)
+                    cursor.execute(
+                        f"SELECT count(*) FROM "
+                        f"{connection.ops.quote_name(schema)}."
+                        f"{connection.ops.quote_name(table)}"
+                    )
+                    self.assertGreater(cursor.fetchone()[0], 0)
+
+            # Every tier has its refresh policy
+            cursor.execute(
+                "SELECT hypertable_name FROM timescaledb_information.jobs "
+                "WHERE proc_name = 'policy_refresh_continuous_aggregate'"
+            )
+            tables = {table for (table,) in cursor.fetchall()}
+            self.assertTrue({table for *_, table in aggregates} <= tables)
@@ -0,0 +1,386 @@
+# test_trips.py
+
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import pandas as pd
+from django.test import SimpleTestCase, TestCase
+
+from wayfinder.columns import LocationColumns, fetch_location_columns, iso_time
+from wayfinder.models import Location
+from wayfinder.utils import (
+    build_trips_feature_collection,
+    find_last_complete_trip_boundary,
+    get_sorted_visit_midtimes,
+    get_visit_midtime,
+    iter_trip_parts,
+    segment_trips,
+    segment_trips_by_midtimes,
+)
+
+START = datetime(2025, 1, 5, 8, tzinfo=dt_timezone.utc)
+
+
+# ---------------------------------------------------------------------------- #
+#                    BASELINE IMPLEMENTATION, WITH DATAFRAMES                   #
+# ---------------------------------------------------------------------------- #
+
+# The trips were built from pandas DataFrames before they were built from
+# columns. These are the original functions, the reference the columns must
+# produce the same GeoJSON as.
+
+
+def baseline_sorted_visit_midtimes(visits_df):
+    if visits_df.empty:
+        return []
+    visits_df = visits_df.sort_values("arrival_date").copy()
+    return [get_visit_midtime(visit) for visit in visits_df.to_dict("records")]
+
+
+def baseline_find_last_complete_trip_boundary(locations_list, midtimes):
+    if not locations_list or not midtimes:
+        return locations_list, None
+
+    last_point_time = locations_list[-1]["time"]
+    trip_start_midtime = None
+    for m in reversed(midtimes):
+        if m <= last_point_time:
+            trip_start_midtime = m
+            break
+
+    if trip_start_midtime is None:
+        return locations_list, None
+
+    truncated = [loc for loc in locations_list if loc["time"] < trip_start_midtime]
+    if not truncated:
+        return locations_list, None
+    return truncated, trip_start_midtime
+
+
+def baseline_segment_trips_by_visits(locations_df, visits_df, trip_id_offset=1):
+    if locations_df.empty:
+        return []
+
+    locations_df = locations_df.sort_values("time").copy()
+    if visits_df.empty:
+        return [(f"trip_{trip_id_offset:03d}", locations_df)]
+
+    midtimes = baseline_sorted_visit_midtimes(visits_df)
+
+    segments = []
+    trip_counter = trip_id_offset
+
+    mask = locations_df["time"] < midtimes[0]
+    if mask.any():
+        segments.append((f"trip_{trip_counter:03d}", locations_df[mask].copy()))
+        trip_counter += 1
+
+    for i in range(len(midtimes) - 1):
+        mask = (locations_df["time"] >= midtimes[i]) & (
+            locations_df["time"] < midtimes[i + 1]
+        )
+        if mask.any():
+            segments.append((f"trip_{trip_counter:03d}", locations_df[mask].copy()))
+            trip_counter += 1
+
+    mask = locations_df["time"] >= midtimes[-1]
+    if mask.any():
+        segments.append((f"trip_{trip_counter:03d}", locations_df[mask].copy()))
+
+    return segments
+
+
+def baseline_locations_to_geojson_linestring(trip_id, locations_df):
+    if locations_df.empty:
+        return None
+
+    locations_records = locations_df.sort_values("time").to_dict("records")
+    coordinates = [
+        [float(loc["longitude"]), float(loc["latitude"])] for loc in locations_records
+    ]
+    times = [
+        (
+            loc["time"].isoformat()
+            if hasattr(loc["time"], "isoformat")
+            else str(loc["time"])
+        )
+        for loc in locations_records
+    ]
+    return {
+        "type": "Feature",
+        "id": trip_id,
+        "geometry": {"type": "LineString", "coordinates": coordinates},
+        "properties": {"trip_id": trip_id, "times": times},
+    }
+
+
+def baseline_build_trips_feature_collection(
+    locations_df, visits_df, separate_trips=False, trip_id_offset=1
+):
+    features = []
+    if locations_df.empty:
+        return {"type": "FeatureCollection", "features": features}
+
+    if not separate_trips or visits_df.empty:
+        segments = [(f"trip_{trip_id_offset:03d}", locations_df)]
+    else:
+        segments = baseline_segment_trips_by_visits(
+            locations_df, visits_df, trip_id_offset=trip_id_offset
+        )
+    for trip_id, segment_df in segments:
+        feature = baseline_locations_to_geojson_linestring(trip_id, segment_df)
+        if feature:
+            features.append(feature)
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+# ---------------------------------------------------------------------------- #
+#                                   FIXTURES                                   #
+# ---------------------------------------------------------------------------- #
+
+
+def make_locations(count, seed=0):
+    """Location dicts at irregular times, some with microseconds."""
+    rng = random.Random(seed)
+    locations = []
+    time = START
+    for i in range(count):
+        time += timedelta(seconds=rng.randint(1, 120))
+        if i % 3 == 0:
+            time += timedelta(microseconds=rng.randint(1, 999999))
+        locations.append(
+            {
+                "time": time,
+                "longitude": -4.28 + rng.uniform(-0.5, 0.5),
+                "latitude": 38.66 + rng.uniform(-0.5, 0.5),
+            }
+        )
+    return locations
+
+
+def make_visits(locations, count, seed=0, overlapping=False):
+    """
+    Visits around the times of ``locations``, plus one before and one after
+    them.  With ``overlapping``, some visits overlap the next one so that
+    their midtimes aren't in arrival order.
+    """
+    rng = random.Random(seed)
+    first, last = locations[0]["time"], locations[-1]["time"]
+    span = (last - first).total_seconds()
+    visits = [
+        {
+            "arrival_date": first - timedelta(hours=2),
+            "departure_date": first - timedelta(hours=1),
+        },
+        {
+            "arrival_date": last + timedelta(hours=1),
+            "departure_date": last + timedelta(hours=2),
+        },
+    ]
+    for _ in range(count):
+        arrival = first + timedelta(seconds=rng.uniform(0, span))
+        if overlapping and rng.random() < 0.5:
+            duration = timedelta(seconds=rng.uniform(span / 10, span / 3))
+        else:
+            duration = timedelta(seconds=rng.uniform(60, 600))
+        visits.append({"arrival_date": arrival, "departure_date": arrival + duration})
+
+    # A visit that is its own midtime boundary, exactly on a location
+    time = locations[len(locations) // 2]["time"]
+    visits.append(
+        {
+            "arrival_date": time - timedelta(minutes=5),
+            "departure_date": time + timedelta(minutes=5),
+        }
+    )
+    return visits
+
+
+def to_columns(locations):
+    return LocationColumns(
+        [iso_time(location["time"]) for location in locations],
+        [location["longitude"] for location in locations],
+        [location["latitude"] for location in locations],
+    )
+
+
+# ---------------------------------------------------------------------------- #
+#                                     TESTS                                    #
+# ---------------------------------------------------------------------------- #
+
+
+class TripsBaselineTests(SimpleTestCase):
+    """
+    Trips built from ``LocationColumns`` must be the GeoJSON the DataFrame
+    implementation built, for every way of separating them.
+    """
+
+    cases = [
+        {"count": 500, "visits": 0, "overlapping": False},
+        {"count": 500, "visits": 12, "overlapping": False},
+        {"count": 500, "visits": 12, "overlapping": True},
+        {"count": 40, "visits": 30, "overlapping": True},
+        {"count": 1, "visits": 3, "overlapping": False},
+    ]
+
+    def test_segment_trips_by_midtimes(self):
+        for seed, case in enumerate(self.cases):
+            locations = make_locations(case["count"], seed)
+            visits = make_visits(locations, case["visits"], seed, case["overlapping"])
+            for offset in (1, 7):
+                with self.subTest(case=case, trip_id_offset=offset):
+                    expected = baseline_segment_trips_by_visits(
+                        pd.DataFrame(locations), pd.DataFrame(visits), offset
+                    )
+                    columns = to_columns(locations)
+                    segments = segment_trips_by_midtimes(
+                        columns, get_sorted_visit_midtimes(visits), offset
+                    )
+                    self.assertEqual(
+                        [
+                            (trip_id, [iso_time(t) for t in df["time"]])
+                            for trip_id, df in expected
+                        ],
+                        [
+                            (trip_id, columns.times[start:end])
+                            for trip_id, start, end in segments
+                        ],
+                    )
+
+    def test_build_trips_feature_collection(self):
+        for seed, case in enumerate(self.cases):
+            locations = make_locations(case["count"], seed)
+            visits = make_visits(locations, case["visits"], seed, case["overlapping"])
+            for separate_trips in (False, True):
+                for offset in (1, 7):
+                    with self.subTest(
+                        case=case, separate_trips=separate_trips, trip_id_offset=offset
+                    ):
+                        expected = baseline_build_trips_feature_collection(
+                            pd.DataFrame(locations),
+                            pd.DataFrame(visits),
+                            separate_trips=separate_trips,
+                            trip_id_offset=offset,
+                        )
+                        collection = build_trips_feature_collection(
+                            to_columns(locations),
+                            separate_trips=separate_trips,
+                            trip_id_offset=offset,
+                            midtimes=get_sorted_visit_midtimes(visits),
+                        )
+                        self.assertEqual(collection, expected)
+
+    def test_empty(self):
+        self.assertEqual(
+            build_trips_feature_collection(LocationColumns(), separate_trips=True),
+            baseline_build_trips_feature_collection(
+                pd.DataFrame(), pd.DataFrame(), separate_trips=True
+            ),
+        )
+
+    def test_find_last_complete_trip_boundary(self):
+        for seed, case in enumerate(self.cases):
+            locations = make_locations(case["count"], seed)
+            visits = make_visits(locations, case["visits"], seed, case["overlapping"])
+            midtimes = get_sorted_visit_midtimes(visits)
+            for page in (1, len(locations) // 3, len(locations)):
+                with self.subTest(case=case, page=page):
+                    expected, expected_midtime = (
+                        baseline_find_last_complete_trip_boundary(
+                            locations[:page], midtimes
+                        )
+                    )
+                    end, midtime = find_last_complete_trip_boundary(
+                        to_columns(locations[:page]), midtimes
+                    )
+                    self.assertEqual(end, len(expected))
+                    self.assertEqual(midtime, expected_midtime)
+
+    def test_iter_trip_parts(self):
+        for seed, case in enumerate(self.cases):
+            locations = make_locations(case["count"], seed)
+            visits = make_visits(locations, case["visits"], seed, case["overlapping"])
+            midtimes = get_sorted_visit_midtimes(visits)
+            columns = to_columns(locations)
+            rows = list(zip(columns.longitudes, columns.latitudes, columns.times))
+            for separate_trips in (False, True):
+                for max_points in (None, 1, 7, 1000):
+                    with self.subTest(
+                        case=case, separate_trips=separate_trips, max_points=max_points
+                    ):
+                        # Each trip of segment_trips, in parts of max_points
+                        step = max_points or len(columns)
+                        expected = [
+                            (
+                                trip_id,
+                                columns.times[i : min(i + step, end)],
+                                list(columns.longitudes[i : min(i + step, end)]),
+                            )
+                            for trip_id, start, end in segment_trips(
+                                columns, separate_trips, 7, midtimes
+                            )
+                            for i in range(start, end, step)
+                        ]
+                        parts = iter_trip_parts(
+                            rows,
+                            separate_trips=separate_trips,
+                            midtimes=midtimes,
+                            trip_id_offset=7,
+                            max_points=max_points,
+                        )
+                        self.assertEqual(
+                            [
+                                (trip_id, part.times, list(part.longitudes))
+                                for trip_id, part in parts
+                            ],
+                            expected,
+                        )
+
+
+class FetchLocationColumnsTests(TestCase):
+    """
+    The times formatted by the database must be the ``isoformat()`` of the
+    datetimes the DataFrames held.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Location.objects.bulk_create(
+            Location(
+                **location,
+                altitude=8,
+                battery_level=0.5,
+                battery_state="unplugged",
+                course=10,
+                course_accuracy=2,
+                horizontal_accuracy=5,
+                motion=["driving"],
+                moving=True,
+                speed=3,
+                speed_accuracy=1,
+                vertical_accuracy=3,
+                wifi="",
+            )
+            for location in make_locations(300)
+        )
+
+    def test_same_geojson_as_dataframes(self):
+        queryset = Location.objects.order_by("time")
+        locations = pd.DataFrame(list(queryset.values("time", "longitude", "latitude")))
+        visits = pd.DataFrame(make_visits(make_locations(300), 8, overlapping=True))
+
+        columns = fetch_location_columns(queryset)
+        self.assertEqual(len(columns), 300)
+        for separate_trips in (False, True):
+            with self.subTest(separate_trips=separate_trips):
+                self.assertEqual(
+                    build_trips_feature_collection(
+                        columns,
+                        separate_trips=separate_trips,
+                        midtimes=get_sorted_visit_midtimes(visits.to_dict("records")),
+                    ),
+                    baseline_build_trips_feature_collection(
+                        locations, visits, separate_trips=separate_trips
+                    ),
+                )
@@ -0,0 +1,199 @@
+# test_validators.py
+
+import copy
+from datetime import datetime, timezone as dt_timezone
+
+from django.test import SimpleTestCase
+
+from wayfinder.serializers import LocationSerializer, VisitSerializer
+from wayfinder.validators import (
+    OverlandFeatureValidator,
+    validate_features_with_serializer,
+)
+
+# Values every field is tried with: missing, empty, wrong types, out of
+# range, non-finite and malformed
+BAD_VALUES = [
+    None,
+    "",
+    "  ",
+    "x",
+    "12",
+    "1e3",
+    "NaN",
+    "Infinity",
+    "\x00a",
+    3.5,
+    1.23456,
+    0.999,
+    1.5,
+    -1,
+    -200,
+    400,
+    10**7,
+    True,
+    [],
+    {},
+    ["walking", "flying"],
+    "charging",
+    "2024-13-01T00:00:00Z",
+    "2024-09-13T10:00:00Z",
+    "2024-09-13T10:00:00",
+]
+
+MISSING = object()
+
+
+def location_feature(i=0, **properties):
+    feature = {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [-4.28 + i * 1e-4, 38.66]},
+        "properties": {
+            "timestamp": f"2024-09-13T11:{i // 60 % 60:02d}:{i % 60:02d}Z",
+            "altitude": 8,
+            "battery_level": 0.75,
+            "battery_state": "unplugged",
+            "course": 10,
+            "course_accuracy": 2,
+            "device_id": "iphone",
+            "horizontal_accuracy": 5,
+            "motion": ["driving"],
+            "speed": 3,
+            "speed_accuracy": 1,
+            "vertical_accuracy": 3,
+            "wifi": "",
+        },
+    }
+    return _with_properties(feature, properties)
+
+
+def visit_feature(i=0, **properties):
+    feature = {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [-4.27, 38.66]},
+        "properties": {
+            "timestamp": f"2024-09-13T10:{i % 60:02d}:40Z",
+            "arrival_date": f"2024-09-13T10:{i % 60:02d}:00Z",
+            "departure_date": f"2024-09-13T10:{i % 60:02d}:30Z",
+            "altitude": 8,
+            "battery_level": 0.5,
+            "battery_state": "unplugged",
+            "device_id": "iphone",
+            "horizontal_accuracy": 30,
+            "vertical_accuracy": 3,
+            "wifi": "",
+        },
+    }
+    return _with_properties(feature, properties)
+
+
+def _with_properties(feature, properties):
+    for name, value in properties.items():
+        if value is MISSING:
+            feature["properties"].pop(name, None)
+        else:
+            feature["properties"][name] = value
+    return feature
+
+
+def malformed_features(feature):
+    """Variants of ``feature`` with a broken GeoJSON structure."""
+    variants = [None, 1, "feature", [], {}, {"properties": []}]
+    for geometry in (None, [], {}, {"coordinates": None}, {"coordinates": [1]}):
+        variant = copy.deepcopy(feature)
+        variant["geometry"] = geometry
+        variants.append(variant)
+    for coordinates in ([1, 2, 3], ["1", "2"], [True, False], [200, 100]):
+        variant = copy.deepcopy(feature)
+        variant["geometry"]["coordinates"] = coordinates
+        variants.append(variant)
+    for value in BAD_VALUES:
+        for i in range(2):
+            variant = copy.deepcopy(feature)
+            variant["geometry"]["coordinates"][i] = value
+            variants.append(variant)
+    return variants
+
+
+class OverlandFeatureValidatorTests(SimpleTestCase):
+    """
+    The compiled validator must accept and reject exactly the features the
+    serializers do, with the same validated data and error codes.
+    """
+
+    existing_times = frozenset(
+        {
+            datetime(2024, 9, 13, 11, 0, 5, tzinfo=dt_timezone.utc),
+            datetime(2024, 9, 13, 10, 3, 40, tzinfo=dt_timezone.utc),
+        }
+    )
+
+    def assertSameResults(self, serializer_class, features):
+        validator = OverlandFeatureValidator(serializer_class, self.existing_times)
+        for feature in features:
+            with self.subTest(feature=feature):
+                expected_rows, expected_errors = validate_features_with_serializer(
+                    serializer_class, [feature], self.existing_times
+                )
+                validated_data, errors = validator.validate_feature(feature)
+
+                if expected_rows:
+                    self.assertIsNone(errors)
+                    self.assertEqual(validated_data, dict(expected_rows[0]))
+                else:
+                    self.assertIsNone(validated_data)
+                    self.assertEqual(errors, expected_errors[0][1])
+
+    def assertSameBatch(self, serializer_class, features):
+        rows, errors = OverlandFeatureValidator(
+            serializer_class, self.existing_times
+        ).validate_batch(features)
+        expected_rows, expected_errors = validate_features_with_serializer(
+            serializer_class, features, self.existing_times
+        )
+        self.assertEqual(
+            [dict(row) for row in rows], [dict(row) for row in expected_rows]
+        )
+        self.assertEqual(errors, expected_errors)
+
+    def field_variants(self, make_feature):
+        features = [make_feature()]
+        for name in make_feature()["properties"]:
+            features.append(make_feature(**{name: MISSING}))
+            features.extend(make_feature(**{name: value}) for value in BAD_VALUES)
+        return features
+
+    def test_locations(self):
+        features = self.field_variants(location_feature)
+        features += [
+            location_feature(unique_id="abc"),
+            location_feature(motion=[]),
+            location_feature(motion=["stationary", "walking"]),
+            location_feature(timestamp="2024-09-13T11:00:05Z"),  # already stored
+            location_feature(timestamp="2024-09-13T11:00:05.5+02:00"),
+        ]
+        features += malformed_features(location_feature())
+        self.assertSameResults(LocationSerializer, features)
+
+    def test_visits(self):
+        features = self.field_variants(visit_feature)
+        features += [
+            visit_feature(unique_id="abc"),
+            visit_feature(timestamp="2024-09-13T10:03:40Z"),  # already stored
+            visit_feature(departure_date="2024-09-13T10:00:00Z"),  # before arrival
+            visit_feature(departure_date="2024-09-13T10:00:00+01:00"),
+            visit_feature(arrival_date=12, departure_date=13),
+        ]
+        features += malformed_features(visit_feature())
+        self.assertSameResults(VisitSerializer, features)
+
+    def test_batches(self):
+        locations = [location_feature(i) for i in range(200)]
+        locations[5]["properties"]["speed"] = "fast"
+        locations[7] = None
+        locations[9]["geometry"]["coordinates"] = [1]
+        self.assertSameBatch(LocationSerializer, locations)
+
+        visits = [visit_feature(i) for i in range(60)]
+        visits[3]["properties"]["battery_level"] = 2
+        self.assertSameBatch(VisitSerializer, visits)
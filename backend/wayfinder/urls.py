@@ -8,6 +8,7 @@ from django.urls import path, include
 from .views import (
     ActivityHistoryView,
     OverlandView,
+    TripShardsView,
     TripsView,
     TokenView,
     UserSettingsView,
@@ -20,6 +21,7 @@ urlpatterns = [
     path("token/", TokenView.as_view(), name="token"),
     path("visits/", VisitsView.as_view(), name="visits"),
     path("trips/", TripsView.as_view(), name="trips"),
+    path("trips/shards/", TripShardsView.as_view(), name="trip-shards"),
     path("activity/history/", ActivityHistoryView.as_view(), name="activity-history"),
     path("settings/", UserSettingsView.as_view(), name="user-settings"),
 ]
@@ -1,6 +1,12 @@
 import logging
+import math
+import operator
+from bisect import bisect_left
 from datetime import datetime
 
+from .columns import LocationColumns
+
+
 
 log = logging.getLogger(__name__)
 
@@ -10,33 +16,24 @@ def get_visit_midtime(visit):
     arrival = visit["arrival_date"]
     departure = visit["departure_date"]
     
-    # Handle pandas Timestamp or datetime objects
-    if hasattr(arrival, 'timestamp'):
-        arrival_ts = arrival.timestamp()
-        departure_ts = departure.timestamp()
-    else:
-        arrival_ts = arrival.timestamp()
-        departure_ts = departure.timestamp()
+    arrival_ts = arrival.timestamp()
+    departure_ts = departure.timestamp()
     
     mid_ts = (arrival_ts + departure_ts) / 2
     return datetime.fromtimestamp(mid_ts, tz=arrival.tzinfo)
 
 
-def get_sorted_visit_midtimes(visits_df):
+def get_sorted_visit_midtimes(visits):
     """
-    Get a sorted list of visit midtimes from a visits DataFrame.
+    Get a sorted list of visit midtimes from a list of visit dicts.
     
-    Returns an empty list if visits_df is empty.
+    Returns an empty list if there are no visits.
     """
-    if visits_df.empty:
-        return []
-    
-    visits_df = visits_df.sort_values("arrival_date").copy()
-    visits_records = visits_df.to_dict('records')
-    return [get_visit_midtime(visit) for visit in visits_records]
+    visits = sorted(visits, key=lambda visit: visit["arrival_date"])
+    return [get_visit_midtime(visit) for visit in visits]
 
 
-def find_last_complete_trip_boundary(locations_list, midtimes):
+def find_last_complete_trip_boundary(locations, midtimes):
     """
     Find the index where we should truncate locations to avoid splitting a trip.
     
@@ -45,125 +42,225 @@ def find_last_complete_trip_boundary(locations_list, midtimes):
     midtime (i.e., the next point would be >= a midtime).
     
     Args:
-        locations_list: List of location dicts with 'time' field, sorted by time
+        locations: LocationColumns of the locations, sorted by time
         midtimes: Sorted list of visit midtimes (datetime objects)
     
     Returns:
-        tuple: (truncated_locations_list, truncation_midtime or None)
-        - truncated_locations_list: Locations up to (but not including) the last trip
+        tuple: (end, truncation_midtime or None)
+        - end: Number of locations to keep, up to (but not including) the last trip
           that might continue beyond this page
         - truncation_midtime: The midtime used for truncation, or None if no truncation
     """
-    if not locations_list or not midtimes:
-        return locations_list, None
+    times = locations.times
+    if not times or not midtimes:
+        return len(times), None
     
-    last_point_time = locations_list[-1]['time']
+    last_point_time = times[-1]
     
     # Find the largest midtime that is <= last_point_time
     # This is the start of the trip that the last point belongs to
     trip_start_midtime = None
     for m in reversed(midtimes):
-        if m <= last_point_time:
+        if locations.time_key(m) <= last_point_time:
             trip_start_midtime = m
             break
     
     if trip_start_midtime is None:
-        # All locations are before the first visit midtime - this is one trip
-        # that might continue, so we can't safely include any of it
-        # But we need to return something, so check if there's a midtime we can use
-        if midtimes and midtimes[0] > last_point_time:
-            # The first midtime is after all our points - the entire page is one 
-            # potentially incomplete trip. We must include it to make progress.
-            return locations_list, None
-        return locations_list, None
+        # The first midtime is after all our points - the entire page is one
+        # potentially incomplete trip. We must include it to make progress.
+        return len(times), None
     
     # Truncate: keep only locations with time < trip_start_midtime
-    truncated = [loc for loc in locations_list if loc['time'] < trip_start_midtime]
+    end = bisect_left(times, locations.time_key(trip_start_midtime))
     
     # If truncation would remove ALL locations, don't truncate
     # (this happens when all locations belong to one trip that's larger than page_size)
-    if not truncated:
-        return locations_list, None
+    if end == 0:
+        return len(times), None
     
-    return truncated, trip_start_midtime
+    return end, trip_start_midtime
 
 
-def segment_trips_by_visits(locations_df, visits_df, trip_id_offset=1):
+def segment_trips_by_visits(locations, visits, trip_id_offset=1):
     """
     Segment trips based on visit midtimes.
     
     Args:
-        locations_df: DataFrame of locations with 'time' column
-        visits_df: DataFrame of visits with 'arrival_date' and 'departure_date' columns
+        locations: LocationColumns of the locations, sorted by time
+        visits: List of visit dicts with 'arrival_date' and 'departure_date'
         trip_id_offset: Starting number for trip IDs (default 1, so first trip is trip_001)
     
-    Returns a list of tuples: (trip_id, locations_df_segment)
+    Returns a list of tuples: (trip_id, start, end)
     Each segment represents a trip between visit midpoints.
     """
-    if locations_df.empty:
-        return []
+    return segment_trips_by_midtimes(
+        locations, get_sorted_visit_midtimes(visits), trip_id_offset=trip_id_offset
+    )
+
+
+def segment_trips_by_midtimes(locations, midtimes, trip_id_offset=1):
+    """
+    Segment trips at the given visit midtimes.
     
-    # Sort dataframes by time
-    locations_df = locations_df.sort_values("time").copy()
+    Every midtime is located in the sorted times with a binary search, so
+    segmenting costs O(visits * log(points)) and copies nothing.
     
-    if visits_df.empty:
-        # No visits, return single trip
-        return [(f"trip_{trip_id_offset:03d}", locations_df)]
+    Args:
+        locations: LocationColumns of the locations, sorted by time
+        midtimes: Sorted list of visit midtimes (datetime objects)
+        trip_id_offset: Starting number for trip IDs (default 1, so first trip is trip_001)
     
-    visits_df = visits_df.sort_values("arrival_date").copy()
+    Returns a list of tuples: (trip_id, start, end)
+    Each trip is the locations at positions start to end (excluded).
+    """
+    if not len(locations):
+        return []
     
-    # Calculate midtimes for all visits using to_dict (faster than iterrows)
-    visits_records = visits_df.to_dict('records')
-    midtimes = [get_visit_midtime(visit) for visit in visits_records]
+    # Position of the first location at or after each midtime. The trip
+    # between two midtimes is the range between their positions (empty when
+    # overlapping visits make a midtime earlier than the previous one).
+    times = locations.times
+    positions = [bisect_left(times, locations.time_key(midtime)) for midtime in midtimes]
+    bounds = [0, *positions, len(times)]
     
     segments = []
     trip_counter = trip_id_offset
     
-    # First segment: before first visit midtime
-    mask = locations_df["time"] < midtimes[0]
-    if mask.any():
-        segments.append((f"trip_{trip_counter:03d}", locations_df[mask].copy()))
-        trip_counter += 1
-    
-    # Segments between visit midtimes
-    for i in range(len(midtimes) - 1):
-        mask = (locations_df["time"] >= midtimes[i]) & (locations_df["time"] < midtimes[i + 1])
-        if mask.any():
-            segments.append((f"trip_{trip_counter:03d}", locations_df[mask].copy()))
+    for start, end in zip(bounds, bounds[1:]):
+        if start < end:
+            segments.append((f"trip_{trip_counter:03d}", start, end))
             trip_counter += 1
     
-    # Last segment: after last visit midtime
-    mask = locations_df["time"] >= midtimes[-1]
-    if mask.any():
-        segments.append((f"trip_{trip_counter:03d}", locations_df[mask].copy()))
-    
     return segments
 
 
-def locations_to_geojson_linestring(trip_id, locations_df):
-    """
-    Convert a locations DataFrame to a GeoJSON LineString Feature.
+def _trip_parts(trip_id, locations, start, end, max_points=None):
+    """The locations from start to end (excluded), in parts of up to max_points."""
+    step = max_points or max(end - start, 1)
+    for i in range(start, end, step):
+        yield trip_id, locations.copy(i, min(i + step, end))
+
+
+def iter_trip_parts(rows, separate_trips=False, midtimes=None, trip_id_offset=1, epoch=False, max_points=None):
     """
-    if locations_df.empty:
-        return None
+    Segment trips incrementally, like segment_trips, from (longitude, latitude, time)
+    rows sorted by time (see iter_location_rows).
     
-    # Sort by time
-    locations_df = locations_df.sort_values("time")
+    The trips are the ones segment_trips_by_midtimes finds in all the rows, including
+    the ones sharing locations when overlapping visits put the midtimes out of order.
+    Only the locations a trip not yielded yet still needs are held.
     
-    # Convert to list of dicts once (much faster than iterrows)
-    locations_records = locations_df.to_dict('records')
+    Args:
+        rows: Iterable of (longitude, latitude, time) rows, with epoch times if epoch
+        separate_trips: If False, the rows are a single trip. If True, trips are
+                        segmented by visit midtimes.
+        midtimes: Sorted list of visit midtimes separating the trips
+        trip_id_offset: Starting number for trip IDs (default 1, so first trip is trip_001)
+        max_points: If set, trips longer than this are yielded in parts of up to
+                    max_points locations with the same trip ID, like pages split them
     
-    # Build coordinates array [lon, lat]
-    coordinates = [
-        [float(loc["longitude"]), float(loc["latitude"])]
-        for loc in locations_records
-    ]
+    Yields tuples: (trip_id, LocationColumns of the trip or part), as soon as they
+    are complete.
+    """
+    locations = LocationColumns(epoch=epoch)
+    keys = [locations.time_key(midtime) for midtime in midtimes] if separate_trips and midtimes else []
+    
+    # Trip i is the locations from keys[i - 1] (included) to keys[i] (excluded),
+    # so the trips after it need no location before the earliest of keys[i:]
+    earliest_keys = keys[:]
+    for i in range(len(keys) - 2, -1, -1):
+        earliest_keys[i] = min(keys[i], earliest_keys[i + 1])
+    
+    trip = 0  # The trip being completed
+    yielded = 0  # Position in locations up to which its parts were yielded
+    started = False  # Whether a part of it was yielded
+    trip_counter = trip_id_offset
     
-    # Build times array
-    times = [
-        loc["time"].isoformat() if hasattr(loc["time"], 'isoformat') else str(loc["time"])
-        for loc in locations_records
-    ]
+    def trip_start():
+        """Position in locations of the first location of the trip not yielded yet."""
+        if not trip:
+            return yielded
+        return max(yielded, bisect_left(locations.times, keys[trip - 1]))
+    
+    def needed_start():
+        """Position in locations of the first location a trip not yielded yet needs."""
+        if trip < len(keys):
+            return min(trip_start(), bisect_left(locations.times, earliest_keys[trip]))
+        return trip_start()
+    
+    for longitude, latitude, time in rows:
+        while trip < len(keys) and time >= keys[trip]:
+            # The location is past the end of the trip: it is complete
+            start = trip_start()
+            end = bisect_left(locations.times, keys[trip])
+            yield from _trip_parts(f"trip_{trip_counter:03d}", locations, start, end, max_points)
+            if start < end or started:
+                trip_counter += 1
+            trip += 1
+            yielded = 0
+            started = False
+            locations.drop_before(needed_start())
+    
+        locations.times.append(time)
+        locations.longitudes.append(longitude)
+        locations.latitudes.append(latitude)
+    
+        if max_points:
+            start = trip_start()
+            if len(locations) - start >= max_points:
+                # Locations the trip shares with the previous one may be held
+                # already, so there can be several parts
+                yielded = start + (len(locations) - start) // max_points * max_points
+                yield from _trip_parts(f"trip_{trip_counter:03d}", locations, start, yielded, max_points)
+                started = True
+                drop = needed_start()
+                locations.drop_before(drop)
+                yielded -= drop
+    
+    # The trips still pending end with the rows
+    while trip <= len(keys):
+        start = trip_start()
+        end = bisect_left(locations.times, keys[trip]) if trip < len(keys) else len(locations)
+        yield from _trip_parts(f"trip_{trip_counter:03d}", locations, start, end, max_points)
+        if start < end or started:
+            trip_counter += 1
+        trip += 1
+        yielded = 0
+        started = False
+
+
+def locations_to_geojson_linestring(trip_id, locations, start=0, end=None, delta_times=False, coordinate_scale=None):
+    """
+    Convert the locations at positions start to end (excluded) of a
+    LocationColumns to a GeoJSON LineString Feature.
+    
+    Opt-in compact forms, for long trips:
+        delta_times: Instead of "times" (ISO strings), "time_start" (epoch seconds)
+                     and "time_deltas" (seconds since the previous point, 0 for the
+                     first one). Requires epoch times.
+        coordinate_scale: Coordinates as integers, multiplied by this factor and rounded
+    """
+    if end is None:
+        end = len(locations)
+    if start >= end:
+        return None
+    
+    # Build coordinates array [lon, lat] and times array straight from the columns
+    longitudes = locations.longitudes[start:end]
+    latitudes = locations.latitudes[start:end]
+    if coordinate_scale:
+        longitudes = [math.floor(longitude * coordinate_scale + 0.5) for longitude in longitudes]
+        latitudes = [math.floor(latitude * coordinate_scale + 0.5) for latitude in latitudes]
+    coordinates = list(map(list, zip(longitudes, latitudes)))
+    
+    properties = {"trip_id": trip_id}
+    if delta_times:
+        # Whole seconds, rounded half up from the epoch microseconds
+        seconds = [(time + 500000) // 1000000 for time in locations.times[start:end]]
+        properties["time_start"] = seconds[0]
+        properties["time_deltas"] = list(map(operator.sub, seconds, [seconds[0], *seconds[:-1]]))
+    else:
+        properties["times"] = locations.times[start:end]
     
     return {
         "type": "Feature",
@@ -172,10 +269,7 @@ def locations_to_geojson_linestring(trip_id, locations_df):
             "type": "LineString",
             "coordinates": coordinates
         },
-        "properties": {
-            "trip_id": trip_id,
-            "times": times
-        }
+        "properties": properties
     }
 
 
@@ -209,55 +303,69 @@ def visit_to_geojson_point(visit, visit_id):
     }
 
 
-def build_trips_feature_collection(locations_df, visits_df, separate_trips=False, trip_id_offset=1):
+def segment_trips(locations, separate_trips=False, trip_id_offset=1, midtimes=None):
+    """
+    Split locations into trips, as build_trips_feature_collection does.
+    
+    Returns a list of tuples: (trip_id, start, end), see segment_trips_by_midtimes
+    """
+    if not len(locations):
+        return []
+    
+    if not separate_trips or not midtimes:
+        # Single trip
+        return [(f"trip_{trip_id_offset:03d}", 0, len(locations))]
+    
+    # Segment trips by visit midtimes
+    return segment_trips_by_midtimes(locations, midtimes, trip_id_offset=trip_id_offset)
+
+
+def build_trips_feature_collection(locations, separate_trips=False, trip_id_offset=1, midtimes=None, segments=None, delta_times=False, coordinate_scale=None):
     """
     Build a GeoJSON FeatureCollection for trips.
     
     Args:
-        locations_df: DataFrame of locations
-        visits_df: DataFrame of visits
+        locations: LocationColumns of the locations, sorted by time
         separate_trips: If False, returns a single trip. If True, segments trips by visit midtimes.
         trip_id_offset: Starting number for trip IDs (default 1, so first trip is trip_001).
                         Used for pagination to continue trip numbering across pages.
+        midtimes: Sorted list of visit midtimes separating the trips (see get_sorted_visit_midtimes)
+        segments: The trips, if already split with segment_trips
+        delta_times, coordinate_scale: Compact forms of the features, see
+                                       locations_to_geojson_linestring
     
     Returns:
         dict: GeoJSON FeatureCollection with trip features
     """
-    features = []
+    if segments is None:
+        segments = segment_trips(locations, separate_trips, trip_id_offset, midtimes)
     
-    if locations_df.empty:
-        return {"type": "FeatureCollection", "features": features}
-    
-    if not separate_trips or visits_df.empty:
-        # Single trip
-        trip_id = f"trip_{trip_id_offset:03d}"
-        feature = locations_to_geojson_linestring(trip_id, locations_df)
+    features = []
+    for trip_id, start, end in segments:
+        feature = locations_to_geojson_linestring(
+            trip_id, locations, start, end, delta_times=delta_times, coordinate_scale=coordinate_scale
+        )
         if feature:
             features.append(feature)
-    else:
-        # Segment trips by visit midtimes
-        segments = segment_trips_by_visits(locations_df, visits_df, trip_id_offset=trip_id_offset)
-        for trip_id, segment_df in segments:
-            feature = locations_to_geojson_linestring(trip_id, segment_df)
-            if feature:
-                features.append(feature)
     
-    return {"type": "FeatureCollection", "features": features}
+    collection = {"type": "FeatureCollection", "features": features}
+    
+    # Tell clients how to read the compact forms
+    if delta_times:
+        collection["time_encoding"] = "delta"
+    if coordinate_scale:
+        collection["coordinate_scale"] = coordinate_scale
+    
+    return collection
 
 
-def build_visits_feature_collection(visits_df):
+def build_visits_feature_collection(visits):
     """
-    Build a GeoJSON FeatureCollection for visits.
+    Build a GeoJSON FeatureCollection for a list of visit dicts.
     """
     features = []
     
-    if visits_df.empty:
-        return {"type": "FeatureCollection", "features": features}
-    
-    # Convert to list of dicts once (much faster than iterrows)
-    visits_records = visits_df.to_dict('records')
-    
-    for idx, visit in enumerate(visits_records, start=1):
+    for idx, visit in enumerate(visits, start=1):
         visit_id = f"visit_{idx:03d}"
         feature = visit_to_geojson_point(visit, visit_id)
         features.append(feature)
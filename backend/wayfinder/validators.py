@@ -0,0 +1,210 @@
+# validators.py
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.fields import get_error_detail
+from rest_framework.serializers import as_serializer_error
+
+from .serializers import get_overland_feature_parts
+
+
+def _get_field_error_codes(exc):
+    """Return the list of error codes of a field validation exception."""
+    if isinstance(exc, DjangoValidationError):
+        detail = get_error_detail(exc)
+    else:
+        detail = exc.detail
+
+    if not isinstance(detail, list):
+        detail = [detail]
+
+    return [getattr(error, "code", None) for error in detail]
+
+
+def _get_error_codes(exc):
+    """
+    Turn a validation exception into ``{field: [codes]}``, using the same
+    keys as ``serializer.errors``.
+    """
+    return {
+        field: [getattr(error, "code", None) for error in errors]
+        for field, errors in as_serializer_error(exc).items()
+    }
+
+
+def _get_serializer_error_codes(errors):
+    """Turn ``serializer.errors`` into ``{field: [codes]}``."""
+    return {
+        field: [getattr(error, "code", None) for error in field_errors]
+        for field, field_errors in errors.items()
+    }
+
+
+def _compile_field(field):
+    """
+    Build a function that validates a single value for a serializer field.
+
+    Common, valid values take a short path: the field's ``to_internal_value``
+    and validators are called directly, skipping the generic ``run_validation``
+    machinery.  Empty values and any value that fails are handed to
+    ``field.run_validation`` so the resulting errors are exactly the ones the
+    serializer would report.
+    """
+    run_validation = field.run_validation
+    to_internal_value = field.to_internal_value
+    allow_null = field.allow_null
+    validators = [
+        (validator, getattr(validator, "requires_context", False))
+        for validator in field.validators
+    ]
+    is_char_field = isinstance(field, serializers.CharField)
+
+    def check(value):
+        if value is None:
+            if allow_null:
+                return None
+            return run_validation(value)
+
+        try:
+            internal_value = to_internal_value(value)
+
+            # Blank strings have their own rules in CharField.run_validation
+            if is_char_field and internal_value == "":
+                return run_validation(value)
+
+            for validator, requires_context in validators:
+                if requires_context:
+                    validator(internal_value, field)
+                else:
+                    validator(internal_value)
+        except (serializers.ValidationError, DjangoValidationError):
+            return run_validation(value)
+
+        return internal_value
+
+    return check
+
+
+class OverlandFeatureValidator:
+    """
+    Batch validator for Overland GeoJSON features.
+
+    The serializer fields, their validators and the ``validate_<field>``
+    methods are resolved once per batch instead of once per feature, and each
+    feature is then checked in a single pass over the compiled fields.  The
+    rules themselves are the serializer's, so results match
+    ``serializer_class(data=feature).is_valid()``; the serializers remain the
+    reference implementation (see ``validate_features_with_serializer``).
+    """
+
+    def __init__(self, serializer_class, existing_times=frozenset()):
+        self.serializer = serializer_class(context={"existing_times": existing_times})
+        self.prepare_data = serializer_class.prepare_overland_data
+
+        self.fields = []
+        for name, field in self.serializer.fields.items():
+            if field.read_only:
+                continue
+            self.fields.append(
+                (
+                    name,
+                    _compile_field(field),
+                    getattr(self.serializer, f"validate_{name}", None),
+                )
+            )
+
+        # Object-level validation, only when the serializer defines any
+        self.validators = self.serializer.validators
+        if type(self.serializer).validate is not serializers.Serializer.validate:
+            self.validate = self.serializer.validate
+        else:
+            self.validate = None
+
+    def validate_feature(self, feature):
+        """
+        Validate a single feature.
+
+        Returns ``(validated_data, None)`` or ``(None, errors)`` where errors
+        maps field names to lists of error codes.
+        """
+        try:
+            # Rejects a null feature the same way Serializer.run_validation does
+            self.serializer.validate_empty_values(feature)
+            properties, coordinates = get_overland_feature_parts(feature)
+            data = self.prepare_data(properties, coordinates)
+        except serializers.ValidationError as exc:
+            return None, _get_error_codes(exc)
+
+        validated_data = {}
+        errors = None
+
+        for name, check, validate_method in self.fields:
+            try:
+                value = check(data.get(name))
+                if validate_method is not None:
+                    value = validate_method(value)
+            except (serializers.ValidationError, DjangoValidationError) as exc:
+                if errors is None:
+                    errors = {}
+                errors[name] = _get_field_error_codes(exc)
+            else:
+                validated_data[name] = value
+
+        if errors is not None:
+            return None, errors
+
+        try:
+            if self.validators:
+                self.serializer.run_validators(validated_data)
+            if self.validate is not None:
+                validated_data = self.validate(validated_data)
+        except (serializers.ValidationError, DjangoValidationError) as exc:
+            return None, _get_error_codes(exc)
+
+        return validated_data, None
+
+    def validate_batch(self, features):
+        """
+        Validate a list of features.
+
+        Returns ``(rows, errors)``: the validated data of every valid feature,
+        and a list of ``(index, errors)`` for the invalid ones.
+        """
+        rows = []
+        errors = []
+
+        for index, feature in enumerate(features):
+            validated_data, feature_errors = self.validate_feature(feature)
+            if feature_errors is None:
+                rows.append(validated_data)
+            else:
+                errors.append((index, feature_errors))
+
+        return rows, errors
+
+
+def validate_features(serializer_class, features, existing_times=frozenset()):
+    """Validate features with the compiled ``OverlandFeatureValidator``."""
+    validator = OverlandFeatureValidator(serializer_class, existing_times)
+    return validator.validate_batch(features)
+
+
+def validate_features_with_serializer(
+    serializer_class, features, existing_times=frozenset()
+):
+    """
+    Reference implementation of ``validate_features``: one serializer per
+    feature.  Returns the same ``(rows, errors)`` structure.
+    """
+    context = {"existing_times": existing_times}
+    rows = []
+    errors = []
+
+    for index, feature in enumerate(features):
+        serializer = serializer_class(data=feature, context=context)
+        if serializer.is_valid():
+            rows.append(serializer.validated_data)
+        else:
+            errors.append((index, _get_serializer_error_codes(serializer.errors)))
+
+    return rows, errors
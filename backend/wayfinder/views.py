@@ -1,15 +1,17 @@
 # views.py
 
+import hmac
+import itertools
 import logging
 import os
-import pandas as pd
-from datetime import date as date_type, datetime, timedelta, time as dt_time
+from datetime import date as date_type, datetime, timedelta
 from dateutil import parser as date_parser
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 # Django
-from django.db import transaction
-from django.db.models import Count
+from django.db.models import Count, Q
+from django.http import HttpResponse
+from django.utils import timezone
 from django.db.models.functions import TruncDate
 
 
@@ -20,6 +22,17 @@ from django.db.models.functions import TruncDate
 # Maximum number of points to return in a single request
 MAX_POINTS = int(os.getenv("MAX_TRIP_POINTS", "10000"))
 
+# Trip requests over more days than this get planner estimates of the total
+# counts instead of exact ones (0: always exact)
+APPROXIMATE_COUNT_DAYS = int(os.getenv("TRIP_APPROXIMATE_COUNT_DAYS", "0"))
+
+
+def make_aware_datetime(value):
+    """Return ``value`` in the default timezone if it has no offset."""
+    if timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
 
 def get_optimal_bucket_size(start_date, end_date, max_points=MAX_POINTS):
     """
@@ -58,6 +71,7 @@ def get_optimal_bucket_size(start_date, end_date, max_points=MAX_POINTS):
 
 # REST Framework
 from rest_framework import status
+from rest_framework.exceptions import APIException
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authentication import (
@@ -65,6 +79,8 @@ from rest_framework.authentication import (
     TokenAuthentication,
 )
 from rest_framework.authtoken.models import Token
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 
 # Spectacular
@@ -72,23 +88,85 @@ from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiParamete
 from drf_spectacular.types import OpenApiTypes
 
 # Utils
+from wayfinder.aggregates import (
+    ACTIVITY_BUCKET,
+    count_in_range,
+    estimate_count,
+    floor_to_bucket,
+    get_daily_counts,
+    select_trip_tier,
+    start_edge_locations,
+    tier_points_in_range,
+)
+from wayfinder.ingestion import (
+    STREAM_CHUNK_SIZE,
+    ingest_overland_features,
+    iter_chunks,
+)
+from wayfinder.ingestion_queue import (
+    QUEUE_ENABLED,
+    QueueFullError,
+    enqueue_overland_payload,
+)
+from wayfinder.metrics import (
+    METRICS_TOKEN,
+    POINTS_RECEIVED,
+    REQUESTS,
+    STAGE_SECONDS,
+    render_metrics,
+)
+from wayfinder.cache import CACHE_TTL, CachedRange
+from wayfinder.columns import (
+    LocationColumns,
+    fetch_location_columns,
+    iter_location_rows,
+)
+from wayfinder.pagination import CURSOR_MAX_AGE, decode_cursor, encode_cursor
+from wayfinder.renderers import (
+    FEATURE_STREAM_RENDERERS,
+    TRIPS_RENDERERS,
+    FeatureStreamRenderer,
+    GeoJSONRenderer,
+    TripsRenderer,
+    stream_features_response,
+    stream_response,
+    stream_trips_response,
+)
+from wayfinder.shards import (
+    DEFAULT_SHARDS,
+    MAX_SHARDS,
+    get_point_buckets,
+    plan_shards,
+    select_plan_tier,
+)
+from wayfinder.spool import SPOOL_ENABLED, spool_overland_payload
 from wayfinder.utils import (
-    build_trips_feature_collection,
     build_visits_feature_collection,
     find_last_complete_trip_boundary,
     get_sorted_visit_midtimes,
+    iter_trip_parts,
+    locations_to_geojson_linestring,
+    segment_trips,
 )
 
 # Local App
-from .models import DailyActivitySummary, Location, UserSettings, Visit
+from .models import (
+    Location,
+    LocationActivity,
+    TRIP_TIERS,
+    TripPoints15m,
+    UserSettings,
+    Visit,
+    VisitActivity,
+)
+from .parsers import StreamingOverlandParser
 from .serializers import (
     ActivityHistoryResponseSerializer,
     ErrorResponseSerializer,
-    LocationSerializer,
     TripPlotResponseSerializer,
+    TripShardPlanResponseSerializer,
     UserSettingsSerializer,
     VisitPlotResponseSerializer,
-    VisitSerializer,
 )
 
 
@@ -103,10 +181,21 @@ class BearerTokenAuthentication(TokenAuthentication):
 class OverlandView(APIView):
 
     authentication_classes = [BearerTokenAuthentication]
+    parser_classes = [StreamingOverlandParser]
+
+    def dispatch(self, request, *args, **kwargs):
+        with STAGE_SECONDS.time(stage="request"):
+            response = super().dispatch(request, *args, **kwargs)
+        REQUESTS.inc(status=response.status_code)
+        return response
 
     @extend_schema(
         request=OpenApiTypes.OBJECT,
-        responses={200: OpenApiTypes.OBJECT, 500: OpenApiTypes.OBJECT},
+        responses={
+            200: OpenApiTypes.OBJECT,
+            500: OpenApiTypes.OBJECT,
+            503: OpenApiTypes.OBJECT,
+        },
         examples=[
             OpenApiExample(
                 "Request Example",
@@ -159,6 +248,16 @@ class OverlandView(APIView):
             ),
             OpenApiExample(
                 "Success Response",
+                value={
+                    "result": "ok",
+                    "inserted": {"locations": 1, "visits": 0},
+                    "skipped": {"locations": 0, "visits": 0},
+                },
+                response_only=True,
+                status_codes=["200"],
+            ),
+            OpenApiExample(
+                "Queued Response",
                 value={"result": "ok"},
                 response_only=True,
                 status_codes=["200"],
@@ -167,113 +266,63 @@ class OverlandView(APIView):
                 "Error Response",
                 value={"result": "not_ok"},
                 response_only=True,
-                status_codes=["500"],
+                status_codes=["500", "503"],
             ),
         ],
-        description="Endpoint for receiving and storing location and visit data from Overland app.",
+        description=(
+            "Endpoint for receiving and storing location and visit data from "
+            "Overland app. When the ingestion queue is enabled (OVERLAND_QUEUE) "
+            "the batch is acknowledged as soon as it is queued, and 503 is "
+            "returned while the queue is full. When the spool is enabled "
+            "(OVERLAND_SPOOL) batches that can't be written to the database are "
+            "kept on disk and acknowledged. The body can be compressed with "
+            "Content-Encoding gzip, deflate or zstd."
+        ),
     )
     def post(self, request):
 
         # Log the token
         log.debug(f"Received token: {request.auth}")
 
-        # Extract the list of locations
+        # Extract the locations, parsed one by one while they are consumed
         locations_data = request.data.get("locations", [])
-        log.info(f"Received {len(locations_data)} locations")
-        log.debug(locations_data)
-
-        locations_to_create = []
-        visits_to_create = []
-
-        # Use sets to keep track of unique timestamps
-        unique_location_timestamps = set()
-        unique_visit_timestamps = set()
-
-        for item in locations_data:
-            if "arrival_date" in item.get("properties", {}):
-
-                # If there is no departure date, skip the visit
-                departure_date = item.get("properties", {}).get("departure_date")
-                if departure_date is None or departure_date == "":
-                    log.debug("Skipping visit without valid departure date")
-                    log.debug(f"Visit data: {item}")
-                    continue
-
-                # This is a visit
-                visit_serializer = VisitSerializer(data=item)
-
-                if visit_serializer.is_valid():
-                    visit_timestamp = visit_serializer.validated_data.get("time")
-                    if visit_timestamp not in unique_visit_timestamps:
-                        unique_visit_timestamps.add(visit_timestamp)
-                        visits_to_create.append(
-                            Visit(**visit_serializer.validated_data)
-                        )
-                    else:
-                        log.debug(
-                            f"Skipping duplicate visit with time: {visit_timestamp}"
-                        )
-                else:
-                    # Check if the error is due to a duplicate visit
-                    try:
-                        if "time" in visit_serializer.errors and any(
-                            error.code == "unique"
-                            for error in visit_serializer.errors["time"]
-                        ):
-                            log.debug(
-                                f"Skipping duplicate visit: {item.get('time', 'unknown time')}"
-                            )
-                        else:
-                            log.error(
-                                f"Skipping invalid visit - validation failed: {visit_serializer.errors}"
-                            )
-                            log.info(f"Visit data not saved: {item}")
-                    except (ValueError, TypeError, AttributeError) as e:
-                        # Handle cases where errors are not in the expected format
-                        log.error(f"Skipping invalid visit - malformed error data: {e}")
-                        log.info(f"Visit data not saved: {item}")
+
+        if QUEUE_ENABLED:
+            chunks = iter_chunks(locations_data, STREAM_CHUNK_SIZE)
+            chunk = []
+            try:
+                for chunk in chunks:
+                    enqueue_overland_payload(chunk)
+                    POINTS_RECEIVED.inc(len(chunk))
+            except APIException:
+                # Invalid or too large request body
+                raise
+            except QueueFullError as e:
+                # Back-pressure: Overland keeps the batch and retries later
+                log.warning(str(e))
+                return Response(
+                    {"result": "not_ok"},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={"Retry-After": "60"},
+                )
+            except Exception as e:
+                log.error(f"Error queuing data, storing it directly: {str(e)}")
+                # Store the chunk that failed and the remaining ones
+                locations_data = itertools.chain(
+                    chunk, itertools.chain.from_iterable(chunks)
+                )
             else:
-                location_serializer = LocationSerializer(data=item)
-                if location_serializer.is_valid():
-                    location_timestamp = location_serializer.validated_data.get("time")
-                    if location_timestamp not in unique_location_timestamps:
-                        unique_location_timestamps.add(location_timestamp)
-                        locations_to_create.append(
-                            Location(**location_serializer.validated_data)
-                        )
-                    else:
-                        log.debug(
-                            f"Skipping duplicate location with time: {location_timestamp}"
-                        )
-                else:
-                    # Check if the error is due to a duplicate location
-                    try:
-                        if "time" in location_serializer.errors and any(
-                            error.code == "unique"
-                            for error in location_serializer.errors["time"]
-                        ):
-                            log.debug(
-                                f"Skipping duplicate location: {item.get('time', 'unknown time')}"
-                            )
-                        else:
-                            log.error(
-                                f"Skipping invalid location - validation failed: {location_serializer.errors}"
-                            )
-                            log.info(f"Location data not saved: {item}")
-                    except (ValueError, TypeError, AttributeError) as e:
-                        # Handle cases where errors are not in the expected format
-                        log.error(
-                            f"Skipping invalid location - malformed error data: {e}"
-                        )
-                        log.info(f"Location data not saved: {item}")
-
-        log.info(f"Parsed {len(locations_to_create)} locations")
-        log.info(f"Parsed {len(visits_to_create)} visits")
+                return Response({"result": "ok"}, status=status.HTTP_200_OK)
 
         try:
-            with transaction.atomic():
-                Location.objects.bulk_create(locations_to_create)
-                Visit.objects.bulk_create(visits_to_create)
+            # Keep the batch on disk if the database is down or timing out
+            result = ingest_overland_features(
+                locations_data,
+                fallback=spool_overland_payload if SPOOL_ENABLED else None,
+            )
+        except APIException:
+            # Invalid or too large request body
+            raise
         except Exception as e:
             # Log the error
             log.error(f"Error saving data: {str(e)}")
@@ -283,8 +332,27 @@ class OverlandView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
-        log.info("Data saved successfully")
-        return Response({"result": "ok"}, status=status.HTTP_200_OK)
+        log.info(f"Received {result['received']} locations")
+        POINTS_RECEIVED.inc(result["received"])
+
+        if result["fallback"]:
+            log.warning(f"Spooled {result['fallback']} locations")
+            return Response({"result": "ok"}, status=status.HTTP_200_OK)
+
+        log.info(
+            f"Data saved successfully: inserted {result['inserted']['locations']} "
+            f"locations and {result['inserted']['visits']} visits, skipped "
+            f"{result['skipped']['locations']} locations and "
+            f"{result['skipped']['visits']} visits that were already stored"
+        )
+        return Response(
+            {
+                "result": "ok",
+                "inserted": result["inserted"],
+                "skipped": result["skipped"],
+            },
+            status=status.HTTP_200_OK,
+        )
 
 
 class TokenView(APIView):
@@ -339,6 +407,7 @@ class TokenView(APIView):
 
 class VisitsView(APIView):
     authentication_classes = [SessionAuthentication]
+    renderer_classes = [GeoJSONRenderer, BrowsableAPIRenderer]
 
     @extend_schema(
         parameters=[
@@ -379,6 +448,17 @@ class VisitsView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        # Past ranges are served from the response cache until rows are
+        # stored in them
+        cached = CachedRange(
+            request,
+            "visits",
+            make_aware_datetime(date_parser.parse(start_date)),
+            make_aware_datetime(date_parser.parse(end_date)),
+        )
+        if cached.response:
+            return cached.response
+
         # Get the visits in the date range - only fetch required fields
         # No time_bucket needed for visits (they're already sparse, unlike locations)
         visits_list = list(
@@ -405,11 +485,8 @@ class VisitsView(APIView):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        # Convert to DataFrame for GeoJSON building
-        visits_df = pd.DataFrame(visits_list)
-
         # Build GeoJSON feature collection
-        visits_collection = build_visits_feature_collection(visits_df)
+        visits_collection = build_visits_feature_collection(visits_list)
 
         # Build response
         response_data = {
@@ -421,11 +498,19 @@ class VisitsView(APIView):
             },
         }
 
-        return Response(response_data, status=status.HTTP_200_OK)
+        return cached.store(
+            stream_response(request, response_data, status=status.HTTP_200_OK)
+        )
 
 
 class TripsView(APIView):
     authentication_classes = [SessionAuthentication]
+    renderer_classes = [
+        GeoJSONRenderer,
+        *TRIPS_RENDERERS,
+        *FEATURE_STREAM_RENDERERS,
+        BrowsableAPIRenderer,
+    ]
 
     @extend_schema(
         parameters=[
@@ -466,9 +551,9 @@ class TripsView(APIView):
             ),
             OpenApiParameter(
                 name="cursor",
-                type=OpenApiTypes.DATETIME,
+                type=OpenApiTypes.STR,
                 location=OpenApiParameter.QUERY,
-                description="Pagination cursor (ISO datetime). Use the 'next_cursor' from previous response to get next page.",
+                description="Pagination cursor. Use the 'next_cursor' from previous response, with the same other parameters, to get next page.",
                 required=False,
             ),
             OpenApiParameter(
@@ -485,11 +570,40 @@ class TripsView(APIView):
                 description="Disable time bucketing to get raw points (use with pagination for full data)",
                 required=False,
             ),
+            OpenApiParameter(
+                name="format",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description="Format of the trips, instead of the Accept header: 'json' (GeoJSON, default), 'polyline' (encoded polylines), 'fgb' (FlatGeobuf) or 'arrow' (Arrow IPC stream, if pyarrow is installed). 'ndjson' and 'geojsonseq' stream the features of the whole range instead of a page, each trip as soon as it is complete (trips longer than the maximum page size in parts with the same trip ID).",
+                enum=[
+                    "json",
+                    *(
+                        renderer.format
+                        for renderer in TRIPS_RENDERERS + FEATURE_STREAM_RENDERERS
+                    ),
+                ],
+                required=False,
+            ),
+            OpenApiParameter(
+                name="time_encoding",
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description="Times of the GeoJSON trips: 'iso' (default) for an ISO 8601 string per point in 'times', or 'delta' for 'time_start' (epoch seconds) and 'time_deltas' (whole seconds since the previous point)",
+                enum=["iso", "delta"],
+                required=False,
+            ),
+            OpenApiParameter(
+                name="coordinate_precision",
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description="Decimals (0 to 9) to quantize the GeoJSON trip coordinates to. They are then integers, to divide by the 'coordinate_scale' of the trips collection. Full precision floats by default.",
+                required=False,
+            ),
             OpenApiParameter(
                 name="trip_id_offset",
                 type=OpenApiTypes.INT,
                 location=OpenApiParameter.QUERY,
-                description="Starting number for trip IDs (default: 1). Use 'next_trip_offset' from previous response for sequential IDs across pages.",
+                description="Starting number for trip IDs (default: 1, or the one carried by the cursor). Use 'next_trip_offset' from previous response for sequential IDs across pages.",
                 required=False,
             ),
         ],
@@ -498,7 +612,7 @@ class TripsView(APIView):
             400: ErrorResponseSerializer,
             404: ErrorResponseSerializer,
         },
-        description="Endpoint for retrieving trip data as GeoJSON within a specified date range. Supports pagination for large datasets.",
+        description="Endpoint for retrieving trip data as GeoJSON within a specified date range. Supports pagination for large datasets. The trips can also be requested as encoded polylines, FlatGeobuf or Arrow, see the format parameter.",
     )
     def get(self, request):
 
@@ -521,9 +635,10 @@ class TripsView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Parse dates for bucket size calculation
-        start_date_parsed = date_parser.parse(start_date_str)
-        end_date_parsed = date_parser.parse(end_date_str)
+        # Parse dates for bucket size calculation, in the default timezone
+        # like the query filters when no offset is given
+        start_date_parsed = make_aware_datetime(date_parser.parse(start_date_str))
+        end_date_parsed = make_aware_datetime(date_parser.parse(end_date_str))
 
         # Get the optional parameters
         if "show_visits" in request.query_params:
@@ -544,15 +659,54 @@ class TripsView(APIView):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-        # Pagination parameters
+        # Opt-in compact GeoJSON trips: times as deltas, quantized coordinates
+        TIME_ENCODING = request.query_params.get("time_encoding", "iso").lower()
+        if TIME_ENCODING not in ("iso", "delta"):
+            return Response(
+                {"message": "Time encoding must be 'iso' or 'delta'"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        COORDINATE_SCALE = None
+        if "coordinate_precision" in request.query_params:
+            try:
+                precision = int(request.query_params.get("coordinate_precision"))
+            except ValueError:
+                precision = -1
+            if not 0 <= precision <= 9:
+                return Response(
+                    {"message": "Coordinate precision must be from 0 to 9 decimals"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            COORDINATE_SCALE = 10**precision
+
+        # Pagination parameters. A cursor is only valid with the parameters
+        # of the request that returned it (except the ones that only change
+        # how the page is written), and carries what that request resolved
+        # for the whole range.
         cursor_str = request.query_params.get("cursor")
+        cursor_query = {
+            key: value
+            for key, value in request.query_params.items()
+            if key
+            not in (
+                "cursor",
+                "trip_id_offset",
+                "format",
+                "time_encoding",
+                "coordinate_precision",
+            )
+        }
         cursor_datetime = None
+        cursor_state = {}
         if cursor_str:
             try:
-                cursor_datetime = date_parser.parse(cursor_str)
-            except (ValueError, TypeError):
+                cursor_datetime, cursor_state = decode_cursor(cursor_str, cursor_query)
+            except ValueError as e:
                 return Response(
-                    {"message": "Invalid cursor format. Use ISO datetime."},
+                    {
+                        "message": f"{e}. Use the next_cursor of a page with the "
+                        "same parameters."
+                    },
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
@@ -568,7 +722,7 @@ class TripsView(APIView):
         NO_BUCKET = request.query_params.get("no_bucket", "").lower() == "true"
 
         # Trip ID offset for sequential trip numbering across paginated requests
-        trip_id_offset = 1
+        trip_id_offset = cursor_state.get("trip_offset", 1)
         if "trip_id_offset" in request.query_params:
             try:
                 trip_id_offset = max(1, int(request.query_params.get("trip_id_offset")))
@@ -586,34 +740,162 @@ class TripsView(APIView):
                 horizontal_accuracy__lte=DESIRED_ACCURACY
             )
 
-        # Get total count for metadata (quick count query) - always for full range
-        all_locations_count = full_range_query.count()
-        log.debug(f"Found {all_locations_count} total locations in the date range")
+        # Non-stationary locations for trip data (full range), read from the
+        # partial index on moving locations
+        full_trip_query = full_range_query.filter(moving=True)
+
+        def get_visits():
+            log.debug("Getting visits")
+
+            # Only fetch required fields for visits
+            visits = (
+                Visit.objects.filter(time__range=[start_date_str, end_date_str])
+                .time_bucket("time", "1 day")
+                .values(
+                    "time",
+                    "longitude",
+                    "latitude",
+                    "arrival_date",
+                    "departure_date",
+                    "horizontal_accuracy",
+                )
+            )
+            visits_list = list(visits)
+
+            visits_count = len(visits_list)
+            log.debug(f"Found {visits_count} visits in the date range")
+
+            return visits_list
+
+        # Streaming mode: the whole range, after the cursor if any, with the
+        # trips written as soon as they are complete instead of in pages
+        if isinstance(request.accepted_renderer, FeatureStreamRenderer):
+            visits_list = get_visits() if SHOW_VISITS or SEPARATE_TRIPS else []
+            rows = iter_location_rows(
+                (
+                    full_trip_query.filter(time__gt=cursor_datetime)
+                    if cursor_datetime
+                    else full_trip_query
+                ).order_by("time"),
+                epoch=TIME_ENCODING == "delta",
+            )
+            trip_parts = iter_trip_parts(
+                rows,
+                separate_trips=SEPARATE_TRIPS,
+                midtimes=get_sorted_visit_midtimes(visits_list),
+                trip_id_offset=trip_id_offset,
+                epoch=TIME_ENCODING == "delta",
+                max_points=MAX_POINTS,
+            )
+            trip_features = (
+                locations_to_geojson_linestring(
+                    trip_id,
+                    part,
+                    delta_times=TIME_ENCODING == "delta",
+                    coordinate_scale=COORDINATE_SCALE,
+                )
+                for trip_id, part in trip_parts
+            )
+            visit_features = (
+                build_visits_feature_collection(visits_list)["features"]
+                if SHOW_VISITS
+                else []
+            )
+            return stream_features_response(
+                request,
+                itertools.chain(visit_features, trip_features),
+                status=status.HTTP_200_OK,
+            )
+
+        # Past ranges are served from the response cache until locations or
+        # visits are stored in them
+        cached = CachedRange(request, "trips", start_date_parsed, end_date_parsed)
+        if cached.response:
+            return cached.response
+
+        # The precomputed activity buckets and trip tiers hold every location,
+        # they can't be used with an accuracy filter
+        USE_TIERS = DESIRED_ACCURACY <= 0
+
+        # Totals for metadata - always for the full range, computed on the
+        # first page only and carried by the cursor to the next ones
+        if "total_locations" in cursor_state and "trip_locations" in cursor_state:
+            all_locations_count = cursor_state["total_locations"]
+            trip_locations_count = cursor_state["trip_locations"]
+            approximate_counts = cursor_state.get("approximate", False)
+        else:
+            # Planner estimates for very large ranges, if enabled
+            approximate_counts = APPROXIMATE_COUNT_DAYS > 0 and (
+                end_date_parsed - start_date_parsed
+            ) > timedelta(days=APPROXIMATE_COUNT_DAYS)
+
+            if approximate_counts:
+                all_locations_count = estimate_count(full_range_query)
+                trip_locations_count = estimate_count(full_trip_query)
+            elif USE_TIERS:
+                # From the precomputed 15-minute buckets, so a year costs about
+                # as much as a day
+                counts = count_in_range(
+                    full_range_query,
+                    start_date_parsed,
+                    end_date_parsed,
+                    {
+                        "total": (None, LocationActivity, "location_count"),
+                        "trips": (Q(moving=True), TripPoints15m, "points"),
+                    },
+                    ACTIVITY_BUCKET,
+                )
+                all_locations_count = counts["total"]
+                trip_locations_count = counts["trips"]
+            else:
+                # Both totals in a single pass over the range
+                counts = full_range_query.aggregate(
+                    total=Count("time"), trips=Count("time", filter=Q(moving=True))
+                )
+                all_locations_count = counts["total"]
+                trip_locations_count = counts["trips"]
+
+        log.debug(
+            f"Found {all_locations_count} total locations and "
+            f"{trip_locations_count} trip locations in the date range"
+        )
 
         # If no locations at all, return empty response
         if all_locations_count == 0:
             log.debug("No locations found in the selected date range")
             return Response({}, status=status.HTTP_404_NOT_FOUND)
 
-        # Get non-stationary locations count for trip data (full range)
-        full_trip_query = full_range_query.exclude(
-            motion__contains="stationary"
-        ).exclude(motion=[])
-        trip_locations_count = full_trip_query.count()
-        log.debug(f"Found {trip_locations_count} trip locations")
-
         # Build paginated query - if cursor is provided, start from after the cursor time
         if cursor_datetime:
             trip_query = full_trip_query.filter(time__gt=cursor_datetime)
         else:
             trip_query = full_trip_query
 
-        # Calculate optimal bucket size based on data volume (skip if pagination with raw data)
-        if NO_BUCKET:
+        # Pick the source of the points: raw locations, a precomputed trip
+        # tier, or time buckets computed at query time with an accuracy filter
+        tier = None
+        if "bucket_size" in cursor_state:
+            # Resolved on the first page
+            bucket_size = cursor_state["bucket_size"]
+            if USE_TIERS and bucket_size:
+                tier = next(t for t in TRIP_TIERS if t.bucket_size == bucket_size)
+        elif NO_BUCKET:
             bucket_size = None
             log.info(
                 f"Time bucketing disabled, returning raw points (page_size={page_size})"
             )
+        elif USE_TIERS:
+            tier = select_trip_tier(
+                TRIP_TIERS,
+                full_trip_query,
+                start_date_parsed,
+                end_date_parsed,
+                page_size,
+            )
+            bucket_size = tier.bucket_size if tier else None
+            log.info(
+                f"Using trip tier: {bucket_size or 'raw'} for {trip_locations_count} points"
+            )
         else:
             bucket_size = get_optimal_bucket_size(
                 start_date_parsed, end_date_parsed, page_size
@@ -622,125 +904,134 @@ class TripsView(APIView):
                 f"Using time bucket: {bucket_size} for {trip_locations_count} points"
             )
 
-        # Apply time_bucket aggregation for efficient data retrieval (if enabled)
-        # Only fetch required fields: time, longitude, latitude
-        if bucket_size:
-            trip_locations = (
-                trip_query.time_bucket("time", bucket_size)
-                .values("time", "longitude", "latitude")
-                .order_by("time")[: page_size + 1]
-            )  # Fetch one extra to check for more
+        # The binary formats and delta times don't need the times as text
+        epoch = (
+            isinstance(request.accepted_renderer, TripsRenderer)
+            or TIME_ENCODING == "delta"
+        )
+
+        # Only fetch required fields: time, longitude, latitude, read into
+        # columns straight from the database cursor
+        locations = LocationColumns(epoch=epoch)
+        if tier:
+            tier_query = tier_points_in_range(tier, start_date_parsed, end_date_parsed)
+            if cursor_datetime:
+                tier_query = tier_query.filter(
+                    bucket__gte=floor_to_bucket(cursor_datetime, tier.bucket_width),
+                    time__gt=cursor_datetime,
+                )
+            else:
+                # The first point of the range, if it falls inside a bucket:
+                # the tier's first point of that bucket may be before it
+                locations = fetch_location_columns(
+                    start_edge_locations(
+                        full_trip_query,
+                        start_date_parsed,
+                        end_date_parsed,
+                        tier.bucket_width,
+                    ).order_by("time")[:1],
+                    epoch=epoch,
+                )
+            trip_locations = tier_query.order_by("bucket")[
+                : page_size + 1 - len(locations)
+            ]  # Fetch one extra to check for more
+        elif bucket_size:
+            trip_locations = trip_query.time_bucket("time", bucket_size).order_by(
+                "time"
+            )[
+                : page_size + 1
+            ]  # Fetch one extra to check for more
         else:
             # No bucketing - return raw points with pagination
-            trip_locations = trip_query.values(
-                "time", "longitude", "latitude"
-            ).order_by("time")[
+            trip_locations = trip_query.order_by("time")[
                 : page_size + 1
             ]  # Fetch one extra to check for more
 
-        # Convert to list efficiently (avoid pandas overhead for simple case)
-        trip_locations_list = list(trip_locations)
+        locations.extend(fetch_location_columns(trip_locations, epoch=epoch))
 
         # Check if there are more results beyond this page
-        has_more = len(trip_locations_list) > page_size
+        has_more = len(locations) > page_size
         if has_more:
-            trip_locations_list = trip_locations_list[
-                :page_size
-            ]  # Remove the extra item
+            locations.truncate(page_size)  # Remove the extra item
 
-        def get_visits_df():
-            log.debug("Getting visits dataframe")
+        visits_list = []
 
-            # Only fetch required fields for visits
-            visits = (
-                Visit.objects.filter(time__range=[start_date_str, end_date_str])
-                .time_bucket("time", "1 day")
-                .values(
-                    "time",
-                    "longitude",
-                    "latitude",
-                    "arrival_date",
-                    "departure_date",
-                    "horizontal_accuracy",
-                )
-            )
-            visits_list = list(visits)
-            visits_df = pd.DataFrame(visits_list) if visits_list else pd.DataFrame()
-
-            visits_count = len(visits_list)
-            log.debug(f"Found {visits_count} visits in the date range")
-
-            return visits_df
-
-        # Initialize visits_df
-        visits_df = pd.DataFrame()
+        # Visit midtimes that separate trips, carried by the cursor after the
+        # first page
+        midtimes = cursor_state.get("midtimes") if SEPARATE_TRIPS else None
 
         # Get visits if needed (for SHOW_VISITS or SEPARATE_TRIPS)
-        if SHOW_VISITS or SEPARATE_TRIPS:
-            visits_df = get_visits_df()
+        visits_count = cursor_state.get("visits_count", 0)
+        if SHOW_VISITS or (SEPARATE_TRIPS and midtimes is None):
+            visits_list = get_visits()
+            visits_count = len(visits_list)
+        if SEPARATE_TRIPS and midtimes is None:
+            midtimes = get_sorted_visit_midtimes(visits_list)
 
         # Visit-aware pagination: when separating trips and there are more pages,
         # truncate at trip boundaries to avoid splitting a single trip across pages
         truncation_applied = False
-        if SEPARATE_TRIPS and has_more and not visits_df.empty and trip_locations_list:
-            midtimes = get_sorted_visit_midtimes(visits_df)
+        if SEPARATE_TRIPS and has_more and len(locations):
             if midtimes:
-                original_count = len(trip_locations_list)
-                trip_locations_list, truncation_midtime = (
-                    find_last_complete_trip_boundary(trip_locations_list, midtimes)
+                original_count = len(locations)
+                end, truncation_midtime = find_last_complete_trip_boundary(
+                    locations, midtimes
                 )
                 if truncation_midtime is not None:
+                    locations.truncate(end)
                     truncation_applied = True
                     log.debug(
                         f"Visit-aware pagination: truncated from {original_count} to "
-                        f"{len(trip_locations_list)} points at midtime {truncation_midtime}"
+                        f"{len(locations)} points at midtime {truncation_midtime}"
                     )
 
-        # Get the next cursor (timestamp of the last point)
-        next_cursor = None
-        if has_more and trip_locations_list:
-            last_point = trip_locations_list[-1]
-            next_cursor = (
-                last_point["time"].isoformat()
-                if hasattr(last_point["time"], "isoformat")
-                else str(last_point["time"])
-            )
-
-        # Convert to DataFrame only if needed for SEPARATE_TRIPS
-        trip_locations_df = (
-            pd.DataFrame(trip_locations_list) if trip_locations_list else pd.DataFrame()
-        )
-
-        # Build GeoJSON feature collections
-        trips_collection = build_trips_feature_collection(
-            trip_locations_df,
-            visits_df if SEPARATE_TRIPS else pd.DataFrame(),
+        # Split the trips, rendered in the negotiated format
+        trips = segment_trips(
+            locations,
             separate_trips=SEPARATE_TRIPS,
             trip_id_offset=trip_id_offset,
+            midtimes=midtimes,
         )
+        next_trip_offset = trip_id_offset + len(trips)
+
+        # Get the next cursor (timestamp of the last point) with the state
+        # resolved for the whole range
+        next_cursor = None
+        if has_more and len(locations):
+            next_cursor = encode_cursor(
+                locations.datetime_at(-1),
+                cursor_query,
+                midtimes=midtimes,
+                total_locations=all_locations_count,
+                trip_locations=trip_locations_count,
+                approximate=approximate_counts,
+                visits_count=visits_count,
+                bucket_size=bucket_size,
+                trip_offset=next_trip_offset,
+            )
         visits_collection = (
-            build_visits_feature_collection(visits_df)
+            build_visits_feature_collection(visits_list)
             if SHOW_VISITS
             else {"type": "FeatureCollection", "features": []}
         )
 
-        # Build response
+        # Build response, the trips are added by stream_trips_response
         response_data = {
-            "trips": trips_collection,
             "visits": visits_collection,
             "meta": {
                 "start_datetime": start_date_str,
                 "end_datetime": end_date_str,
                 "total_locations": all_locations_count,
-                "trip_locations": len(trip_locations_list),
+                "trip_locations": len(locations),
                 "trip_locations_raw": trip_locations_count,
-                "visits_count": len(visits_df) if not visits_df.empty else 0,
-                "trips_count": len(trips_collection["features"]),
+                "visits_count": visits_count,
+                "trips_count": len(trips),
                 "separate_trips": SEPARATE_TRIPS,
                 "show_visits": SHOW_VISITS,
                 "bucket_size": bucket_size,
                 "downsampled": bucket_size is not None
                 and trip_locations_count > page_size,
+                "approximate_counts": approximate_counts,
             },
             "pagination": {
                 "page_size": page_size,
@@ -748,39 +1039,195 @@ class TripsView(APIView):
                 "next_cursor": next_cursor,
                 "is_first_page": cursor_datetime is None,
                 "trip_boundary_aligned": truncation_applied,
-                "next_trip_offset": (
-                    trip_id_offset + len(trips_collection["features"])
-                    if has_more
-                    else None
-                ),
+                "next_trip_offset": next_trip_offset if has_more else None,
             },
         }
 
-        return Response(response_data, status=status.HTTP_200_OK)
+        response = stream_trips_response(
+            request,
+            locations,
+            trips,
+            response_data,
+            status=status.HTTP_200_OK,
+            delta_times=TIME_ENCODING == "delta",
+            coordinate_scale=COORDINATE_SCALE,
+        )
+
+        # A cached page is served with the next_cursor it was computed with,
+        # which must stay valid for a while after that
+        return cached.store(
+            response, max_age=CURSOR_MAX_AGE // 2 if next_cursor else CACHE_TTL
+        )
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Errors are JSON whatever format the trips were asked in
+        if isinstance(response, Response) and isinstance(
+            getattr(request, "accepted_renderer", None),
+            (TripsRenderer, FeatureStreamRenderer),
+        ):
+            request.accepted_renderer = GeoJSONRenderer()
+            request.accepted_media_type = GeoJSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
 
-def _update_activity_schedule(timezone_str: str) -> None:
-    """Update the Celery beat periodic task to run at 00:00 in the given timezone."""
-    from django_celery_beat.models import CrontabSchedule, PeriodicTask
 
-    schedule, _ = CrontabSchedule.objects.get_or_create(
-        minute="0",
-        hour="0",
-        day_of_week="*",
-        day_of_month="*",
-        month_of_year="*",
-        timezone=timezone_str,
-    )
-    updated = PeriodicTask.objects.filter(name="compute-daily-activity-summary").update(
-        crontab=schedule
+class TripShardsView(APIView):
+    authentication_classes = [SessionAuthentication]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="start_datetime",
+                type=OpenApiTypes.DATETIME,
+                location=OpenApiParameter.QUERY,
+                description="Start date for the date range filter (inclusive)",
+                required=True,
+            ),
+            OpenApiParameter(
+                name="end_datetime",
+                type=OpenApiTypes.DATETIME,
+                location=OpenApiParameter.QUERY,
+                description="End date for the date range filter (inclusive)",
+                required=True,
+            ),
+            OpenApiParameter(
+                name="separate_trips",
+                type=OpenApiTypes.BOOL,
+                location=OpenApiParameter.QUERY,
+                description="Flag to place the shard edges at visit midtimes, so no trip is split between shards",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="desired_accuracy",
+                type=OpenApiTypes.NUMBER,
+                location=OpenApiParameter.QUERY,
+                description="Desired accuracy in meters. 0 means no filtering",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="shards",
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description=f"Number of shards to plan (default: {DEFAULT_SHARDS}, max: {MAX_SHARDS}). There can be fewer, e.g. with few visits to align to.",
+                required=False,
+            ),
+        ],
+        responses={
+            200: TripShardPlanResponseSerializer,
+            400: ErrorResponseSerializer,
+            404: ErrorResponseSerializer,
+        },
+        description=(
+            "Plans the trips of a date range as consecutive time shards with about the "
+            "same number of points, from the precomputed point counts. Each shard can "
+            "be fetched from the trips endpoint with its start_datetime and "
+            "end_datetime, concurrently with the others. Trip IDs start at trip_001 "
+            "in every shard."
+        ),
     )
-    if updated:
-        log.info("Updated activity summary schedule to run at 00:00 %s", timezone_str)
-    else:
-        log.warning(
-            "Could not find periodic task 'compute-daily-activity-summary' to update"
+    def get(self, request):
+        SEPARATE_TRIPS = False
+        DESIRED_ACCURACY = 0
+
+        log.debug("Received request to plan trip shards")
+
+        start_date_str = request.query_params.get("start_datetime")
+        end_date_str = request.query_params.get("end_datetime")
+
+        if start_date_str is None or end_date_str is None:
+            log.error("No date range provided")
+
+            return Response(
+                {"message": "Please provide a start_date and end_date query parameter"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # In the default timezone like TripsView when no offset is given
+        start_date_parsed = make_aware_datetime(date_parser.parse(start_date_str))
+        end_date_parsed = make_aware_datetime(date_parser.parse(end_date_str))
+
+        if "separate_trips" in request.query_params:
+            SEPARATE_TRIPS = (
+                request.query_params.get("separate_trips").lower() == "true"
+            )
+        if "desired_accuracy" in request.query_params:
+            try:
+                DESIRED_ACCURACY = float(request.query_params.get("desired_accuracy"))
+            except ValueError:
+                log.error("Desired accuracy is not a number")
+                return Response(
+                    {"message": "Desired accuracy must be a number"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        shards = DEFAULT_SHARDS
+        if "shards" in request.query_params:
+            try:
+                shards = int(request.query_params.get("shards"))
+            except ValueError:
+                shards = 0
+            if not 1 <= shards <= MAX_SHARDS:
+                return Response(
+                    {"message": f"Shards must be a number from 1 to {MAX_SHARDS}"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        # Moving locations, as TripsView reads them
+        trip_query = Location.objects.filter(moving=True)
+        if DESIRED_ACCURACY > 0:
+            trip_query = trip_query.filter(horizontal_accuracy__lte=DESIRED_ACCURACY)
+
+        # Point counts per bucket: from the trip tiers, or counted at query
+        # time with an accuracy filter
+        tier = select_plan_tier(start_date_parsed, end_date_parsed)
+        buckets = get_point_buckets(
+            trip_query,
+            start_date_parsed,
+            end_date_parsed,
+            tier,
+            use_tiers=DESIRED_ACCURACY <= 0,
         )
 
+        midtimes = None
+        if SEPARATE_TRIPS:
+            visits = Visit.objects.filter(
+                time__range=[start_date_str, end_date_str]
+            ).values("arrival_date", "departure_date")
+            midtimes = get_sorted_visit_midtimes(list(visits))
+
+        plan = plan_shards(
+            buckets, start_date_parsed, end_date_parsed, shards, midtimes=midtimes
+        )
+        trip_locations = sum(points for _, _, points in plan)
+
+        if trip_locations == 0:
+            log.debug("No trip locations found in the selected date range")
+            return Response(
+                {"message": "No trip locations in the date range"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        log.info(
+            f"Planned {len(plan)} trip shards of {trip_locations} points "
+            f"from {tier.bucket_size} buckets"
+        )
+
+        response_data = {
+            "shards": [
+                {"start_datetime": start, "end_datetime": end, "points": points}
+                for start, end, points in plan
+            ],
+            "meta": {
+                "start_datetime": start_date_str,
+                "end_datetime": end_date_str,
+                "trip_locations": trip_locations,
+                "shards_count": len(plan),
+                "bucket_size": tier.bucket_size,
+                "separate_trips": SEPARATE_TRIPS,
+            },
+        }
+
+        return Response(response_data, status=status.HTTP_200_OK)
+
 
 class UserSettingsView(APIView):
     authentication_classes = [SessionAuthentication]
@@ -800,19 +1247,12 @@ class UserSettingsView(APIView):
     )
     def patch(self, request):
         settings_obj, _ = UserSettings.objects.get_or_create(user=request.user)
-        old_timezone = settings_obj.home_timezone
         serializer = UserSettingsSerializer(
             settings_obj, data=request.data, partial=True
         )
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         serializer.save()
-        new_timezone = serializer.instance.home_timezone
-        if "home_timezone" in request.data and new_timezone != old_timezone:
-            _update_activity_schedule(new_timezone)
-            from wayfinder.tasks import compute_daily_activity_summary
-
-            compute_daily_activity_summary.delay()
         return Response(serializer.data)
 
 
@@ -838,16 +1278,14 @@ class ActivityHistoryView(APIView):
         ],
         responses={
             200: ActivityHistoryResponseSerializer,
-            206: ActivityHistoryResponseSerializer,
             404: ErrorResponseSerializer,
         },
         description=(
             "Returns daily location and visit counts for a date range, grouped by the "
-            "authenticated user's home timezone.  Past days use pre-computed summaries; "
-            "today's counts are always computed live.  Pre-computed data is refreshed nightly "
-            "at 00:00 in the user's home timezone by a background task.  Returns 206 when "
-            "some dates are missing or only partially computed, and triggers a background "
-            "recalculation for those dates."
+            "authenticated user's home timezone.  Counts are rolled up from 15-minute "
+            "buckets kept up to date by the database, so every day, today included, "
+            "is complete (points backfilled into past days are counted within 15 "
+            "minutes)."
         ),
     )
     def get(self, request):
@@ -896,66 +1334,28 @@ class ActivityHistoryView(APIView):
             )
 
         log.debug(
-            "Querying pre-computed summaries from %s to %s (tz=%s)",
+            "Rolling up activity from %s to %s (tz=%s)",
             start_date,
             end_date,
             timezone_str,
         )
 
-        # Fetch pre-computed summaries (today is always computed live below)
-        summaries = DailyActivitySummary.objects.filter(
-            timezone=timezone_str,
-            date__gte=start_date,
-            date__lte=end_date,
-            date__lt=today_in_tz,
-        ).order_by("date")
-
-        summaries_dict = {s.date: s for s in summaries}
-
-        # Track missing and partial dates (today excluded — always computed live)
-        missing_dates: set = set()
-        partial_dates: set = set()
-        current_date = start_date
-        while current_date <= end_date:
-            if current_date != today_in_tz:
-                summary = summaries_dict.get(current_date)
-                if summary is None:
-                    missing_dates.add(current_date)
-                elif summary.partial:
-                    partial_dates.add(current_date)
-            current_date += timedelta(days=1)
-
-        incomplete_dates = missing_dates | partial_dates
-
-        # Compute today's counts live so the graph reflects the current state
-        today_start = datetime.combine(today_in_tz, dt_time.min, tzinfo=user_tz)
-        today_end = datetime.combine(today_in_tz, dt_time.max, tzinfo=user_tz)
-        live_location_count = Location.objects.filter(
-            time__gte=today_start, time__lte=today_end
-        ).count()
-        live_visit_count = Visit.objects.filter(
-            time__gte=today_start, time__lte=today_end
-        ).count()
+        location_counts = get_daily_counts(
+            LocationActivity, "location_count", start_date, end_date, user_tz
+        )
+        visit_counts = get_daily_counts(
+            VisitActivity, "visit_count", start_date, end_date, user_tz
+        )
 
         # Build the response, filling gaps with zero
         data = []
         total_locations = 0
         total_visits = 0
-        precomputed_locations = 0
-        precomputed_visits = 0
         current_date = start_date
 
         while current_date <= end_date:
-            if current_date == today_in_tz:
-                location_count = live_location_count
-                visit_count = live_visit_count
-            else:
-                summary = summaries_dict.get(current_date)
-                location_count = summary.location_count if summary else 0
-                visit_count = summary.visit_count if summary else 0
-                precomputed_locations += location_count
-                precomputed_visits += visit_count
-
+            location_count = location_counts.get(current_date, 0)
+            visit_count = visit_counts.get(current_date, 0)
             total_locations += location_count
             total_visits += visit_count
 
@@ -968,6 +1368,22 @@ class ActivityHistoryView(APIView):
             )
             current_date += timedelta(days=1)
 
+        if (
+            total_locations == 0
+            and total_visits == 0
+            and not Location.objects.exists()
+            and not Visit.objects.exists()
+        ):
+            log.debug("No location or visit data exists yet")
+            return Response(
+                {
+                    "message": (
+                        "Location counts will appear here once you have some location data."
+                    )
+                },
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
         response_data = {
             "data": data,
             "meta": {
@@ -979,70 +1395,6 @@ class ActivityHistoryView(APIView):
             },
         }
 
-        # Determine response status
-        from wayfinder.tasks import compute_daily_activity_summary
-
-        # Cap task end date at yesterday (today is always live, never recalculated)
-        task_end = min(end_date, today_in_tz - timedelta(days=1))
-
-        if precomputed_locations == 0 and precomputed_visits == 0 and missing_dates:
-            # Check for raw data specifically within the queried range (not globally),
-            # so a year with no data doesn't trigger "computing" just because other
-            # years have data.
-            if task_end >= start_date:
-                range_start_dt = datetime.combine(start_date, dt_time.min, tzinfo=user_tz)
-                range_end_dt = datetime.combine(task_end, dt_time.max, tzinfo=user_tz)
-                has_raw_data = Location.objects.filter(
-                    time__gte=range_start_dt, time__lte=range_end_dt
-                ).exists() or Visit.objects.filter(
-                    time__gte=range_start_dt, time__lte=range_end_dt
-                ).exists()
-            else:
-                has_raw_data = False
-            if has_raw_data:
-                log.debug(
-                    "No pre-computed activity data found; triggering background task"
-                )
-                compute_daily_activity_summary.delay(
-                    start_date=start_date.isoformat(),
-                    end_date=task_end.isoformat(),
-                )
-                return Response(
-                    {
-                        "message": (
-                            "Activity data is being computed in the background; "
-                            "please refresh the page in a few minutes."
-                        )
-                    },
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-            elif not Location.objects.exists() and not Visit.objects.exists():
-                log.debug("No location or visit data exists yet")
-                return Response(
-                    {
-                        "message": (
-                            "Location counts will appear here once you have some location data."
-                        )
-                    },
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-            else:
-                # Data exists in other date ranges but not this one — return zeros
-                # directly as 200 rather than falling through to the 206 path, since
-                # there is nothing to compute.
-                return Response(response_data, status=status.HTTP_200_OK)
-
-        if incomplete_dates:
-            log.info(
-                "Returning partial activity history (%d incomplete dates); triggering background task",
-                len(incomplete_dates),
-            )
-            compute_daily_activity_summary.delay(
-                start_date=start_date.isoformat(),
-                end_date=task_end.isoformat(),
-            )
-            return Response(response_data, status=status.HTTP_206_PARTIAL_CONTENT)
-
         log.info(
             "Returning activity history: %d days, %d locations, %d visits",
             len(data),
@@ -1051,3 +1403,34 @@ class ActivityHistoryView(APIView):
         )
 
         return Response(response_data, status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """
+    Overland ingestion metrics in the Prometheus text format.
+
+    The scraper must send ``METRICS_TOKEN`` as a Bearer token.  Without a
+    token configured, only staff users (session or API token) can read them.
+    """
+
+    permission_classes = [AllowAny]
+
+    @extend_schema(exclude=True)
+    def get(self, request):
+        if METRICS_TOKEN:
+            expected = f"Bearer {METRICS_TOKEN}"
+            received = request.META.get("HTTP_AUTHORIZATION", "")
+            if not hmac.compare_digest(received.encode(), expected.encode()):
+                return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+        elif not request.user.is_staff:
+            return HttpResponse(
+                status=(
+                    status.HTTP_403_FORBIDDEN
+                    if request.user.is_authenticated
+                    else status.HTTP_401_UNAUTHORIZED
+                )
+            )
+
+        return HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
@@ -21,8 +21,8 @@ import { customAxios, customAxiosInstance } from "../../axios";
 type SecondParameter<T extends (...args: never) => unknown> = Parameters<T>[1];
 
 /**
- * Returns pre-computed daily location and visit counts for a date range, grouped by the authenticated user's home timezone.
- * Defaults to the past 365 days if no params are provided. Returns 206 if some dates are still being computed.
+ * Returns daily location and visit counts for a date range, grouped by the authenticated user's home timezone.
+ * Defaults to the past 365 days if no params are provided.
  */
 export const wayfinderActivityHistoryRetrieve = async (
   params?: WayfinderActivityHistoryRetrieveParams,
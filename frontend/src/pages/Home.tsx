@@ -105,18 +105,11 @@ const Home = () => {
       setIsLoading(true);
       setActivityData([]);
       try {
-        const { data, status } = await wayfinderActivityHistoryRetrieve({
+        const { data } = await wayfinderActivityHistoryRetrieve({
           start_date: apiStart,
           end_date: apiEnd
         });
         setActivityData(data.data);
-
-        if (status === 206) {
-          toast.info(
-            "Some dates are still being computed in the background. Refresh the page shortly for complete data.",
-            { id: "activity-history-206", duration: 8000 }
-          );
-        }
       } catch (error: unknown) {
         const status = (error as { response?: { status?: number } })?.response
           ?.status;